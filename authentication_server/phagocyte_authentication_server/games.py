@@ -1,9 +1,17 @@
 """
 Game Manager handling
+
+Managers send heartbeats with the load of their game servers. New games are placed according to the
+PLACEMENT_POLICY setting:
+
+    - "least-loaded", the default, spreads the games on the least loaded managers
+    - "bin-packing" fills the most loaded managers under PLACEMENT_MAX_USAGE first, keeping others idle
+    - "first-fit" takes the first manager with a free slot
 """
 
+import time
 import uuid
-from typing import Dict
+from typing import Dict, List
 
 import requests
 from flask import Flask
@@ -14,6 +22,9 @@ from phagocyte_authentication_server.custom_types import json_object
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
 
 
+HEARTBEAT_TIMEOUT = 15  # time after which the load reported by a manager isn't trusted anymore, in seconds
+
+
 class GameExistsException(Exception):
     """
     Exception to be raised if a game with the same name already exists
@@ -40,6 +51,24 @@ class GameManager:
             self.token = None  # type: str
             self.capacity = capacity  # type: int
             self.slots = 0  # type: int
+            self.load = None  # type: json_object
+            self.last_heartbeat = 0  # type: float
+            # games created since the last heartbeat, not accounted for in the load yet
+            self.pending = 0  # type: int
+
+        def usage(self) -> float:
+            """
+            get the fraction of the resources of the manager in use, from the CPU use and the busiest tick of its
+            servers when its last heartbeat is recent, from the number of games it hosts otherwise
+            """
+            if self.load is None or self.last_heartbeat < time.time() - HEARTBEAT_TIMEOUT:
+                return self.slots / self.capacity
+
+            return max(self.load["cpu"], self.load["busy"]) + self.pending / self.capacity
+
+        def players(self) -> int:
+            """ get the number of players on the manager's servers, as of the last heartbeat """
+            return self.load["players"] if self.load is not None else 0
 
     class Game:
         """
@@ -71,6 +100,8 @@ class GameManager:
 
     games = {}
     managers = []
+    policy = "least-loaded"
+    max_usage = 0.8
 
     def __init__(self, app: Flask=None):
         if app is not None:
@@ -83,6 +114,8 @@ class GameManager:
         :param app: Flask application
         """
         app.games = self
+        self.policy = app.config.get("PLACEMENT_POLICY", self.policy)
+        self.max_usage = app.config.get("PLACEMENT_MAX_USAGE", self.max_usage)
 
     def add_game(self, **kwargs):
         """
@@ -135,6 +168,23 @@ class GameManager:
             if r.status_code != requests.codes.ok:
                 raise KeyError(r.json())
 
+    def remove_crashed_game(self, token: str, port: int):
+        """
+        Removes the game of a server that crashed, as reported by its manager, without notifying the manager back
+
+        :param token: token of the manager
+        :param port: port on which the game was listening
+        :raise KeyError: if the manager doesn't host any game on this port
+        """
+        for (ip, game_port), game in self.games.items():
+            if game_port == port and game.manager.token == token:
+                break
+        else:
+            raise KeyError("No game registered for this manager on port {}".format(port))
+
+        self.games.pop((ip, game_port))
+        game.manager.slots -= 1
+
     def add_manager(self, **kwargs) -> str:
         """
         Adds a new game manager
@@ -160,6 +210,41 @@ class GameManager:
 
         return manager.token
 
+    def heartbeat(self, token: str, load: json_object):
+        """
+        Updates the load of the given manager
+
+        :param token: token identifying the manager
+        :param load: load of the manager, with the CPU use and the busiest tick of its servers as fractions,
+                     and the number of players on them
+        :raise KeyError: if the manager is not registered
+        """
+        for manager in self.managers:
+            if manager.token == token:
+                manager.load = load
+                manager.last_heartbeat = time.time()
+                manager.pending = 0
+                return
+
+        raise KeyError("Unknown manager")
+
+    def place(self, managers: List[Manager]) -> Manager:
+        """
+        chooses the manager on which to create a new game, according to the placement policy
+
+        :param managers: managers with a free slot
+        :return: the chosen manager
+        """
+        if self.policy == "first-fit":
+            return managers[0]
+
+        elif self.policy == "bin-packing":
+            fitting = [manager for manager in managers if manager.usage() < self.max_usage]
+            if fitting:
+                return max(fitting, key=lambda manager: (manager.usage(), manager.players()))
+
+        return min(managers, key=lambda manager: (manager.usage(), manager.players()))
+
     def remove_manager(self, token: str):
         """
         removes the given manager from the list of active managers
@@ -182,12 +267,11 @@ class GameManager:
         :param data: data used to create the new game
         :raise ValueError: if one data is not valid
         """
-        for manager in self.managers:
-            if manager.slots < manager.capacity:
-                break
-        else:
+        managers = [manager for manager in self.managers if manager.slots < manager.capacity]
+        if not managers:
             raise ValueError("Not enough servers to handle a new game")
 
+        manager = self.place(managers)
         data["token"] = manager.token
 
         if data["name"] == "":
@@ -233,3 +317,5 @@ class GameManager:
 
         if r.status_code != requests.codes.ok:
             raise ValueError(r.json())
+
+        manager.pending += 1
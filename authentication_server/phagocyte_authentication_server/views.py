@@ -93,6 +93,18 @@ def delete_game():
     return "", 200
 
 
+@app.route("/games/server/crash", methods=["POST"])
+def crashed_game():
+    """
+    removes the game of a server that crashed, as reported by its manager
+    """
+    try:
+        app.games.remove_crashed_game(**request.json)
+    except KeyError as e:
+        return jsonify(error=str(e)), 400
+    return "", 200
+
+
 @app.route("/games/manager", methods=["POST"])
 def register_manager():
     """
@@ -103,6 +115,18 @@ def register_manager():
     return jsonify(dict(token=app.games.add_manager(**request.json)))
 
 
+@app.route("/games/manager/heartbeat", methods=["POST"])
+def manager_heartbeat():
+    """
+    Updates the load of a game manager
+    """
+    try:
+        app.games.heartbeat(**request.json)
+    except KeyError as e:
+        return jsonify(error=str(e)), 404
+    return "", 200
+
+
 @app.route("/games/manager", methods=["DELETE"])
 def delete_manager():
     """
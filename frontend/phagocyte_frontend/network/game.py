@@ -4,7 +4,7 @@ Client-side classes to communicate with the game server.
 
 import enum
 import json
-from typing import Dict, Union
+from typing import Dict, Iterable, Union
 
 import time
 import twisted.internet
@@ -33,6 +33,13 @@ __author__ = "Basile Vu <basile.vu@gmail.com>"
 
 REACTOR = reactor
 
+ACK_WINDOW = 64  # number of sequence numbers acknowledged in addition to the last one
+RESYNC_DELAY = 2  # minimum time between two requests for the food and bonuses, in seconds
+INPUT_STEP = 1 / 30  # time during which each input sent to the server is applied, in seconds
+INPUT_HEARTBEAT = 1  # time between two inputs sent while the player doesn't move, in seconds
+IDLE_DIRECTION = 4  # direction sent when the player doesn't move
+RESUME_DELAY = 3  # time without hearing from the server after which to resume the session, in seconds
+
 
 @enum.unique
 class Event(enum.IntEnum):
@@ -50,6 +57,26 @@ class Event(enum.IntEnum):
     HOOK = 8
     ALIVE = 9
     FINISHED = 10
+    ACK = 11
+    PING = 12
+    PONG = 13
+    SYNC = 14
+    RESYNC = 15
+    INPUT = 16
+    RESUME = 17
+
+
+def checksum(uids: Iterable[int]) -> int:
+    """
+    computes the checksum of a collection of objects, the same way the server does
+
+    :param uids: unique ids of the objects
+    :return: xor of the scrambled ids
+    """
+    result = 0
+    for uid in uids:
+        result ^= (uid * 2654435761) & 0xFFFFFFFF
+    return result
 
 
 @enum.unique
@@ -61,6 +88,7 @@ class Error(enum.IntEnum):
     MAX_CAPACITY = 1
     NO_TOKEN = 2
     DUPLICATE_USERNAME = 3
+    RESUME_INVALID = 4
 
 
 class NetworkGameClient(DatagramProtocol):
@@ -82,6 +110,11 @@ class NetworkGameClient(DatagramProtocol):
         self.died = False
         self.tried_connection = False
         self.last_timestamp = 0
+        self.ack_seq = -1
+        self.ack_mask = 0
+        self.ack_timestamp = 0
+        self.resync_timestamp = 0
+        self.resume_token = None
 
     def startProtocol(self):
         """
@@ -100,28 +133,43 @@ class NetworkGameClient(DatagramProtocol):
             Logger.warning("Invalid json received : '{json}".format(json=datagram.decode("utf-8")))
             return
 
+        # any message tells that the server still hears us, not only the periodic ALIVE
+        self.last_timestamp = time.time()
         event_type = data.get("event", None)
 
+        if data.get("seq") is not None:
+            self.receive_seq(data["seq"])
+
         if event_type == Event.GAME_INFO:
             self.name = data["name"]
+            self.resume_token = data.get("resume")
             self.game.start_game(self, data)
-            self.last_timestamp = time.time()
             task.LoopingCall(self.check_server_alive).start(3)
+            task.LoopingCall(self.send_ack).start(1 / 10)
         elif event_type == Event.STATE:
-            self.game.update_state(data["updates"], data["deaths"])
+            self.game.update_state(data["updates"], data["deaths"], data.get("t"))
         elif event_type == Event.FOOD:
             self.game.update_food(data.get("food", []), data.get("deleted", []))
         elif event_type == Event.BULLETS:
-            self.game.check_bullets(data["bullets"], data["deleted"])
+            self.game.check_bullets(data["bullets"], data["deleted"], data.get("t"))
         elif event_type == Event.BONUS:
             self.game.update_bonus(data.get("bonus", []), data.get("deleted", []))
+        elif event_type == Event.RESUME:
+            self.game.catch_up(data)
+        elif event_type == Event.SYNC:
+            if not self.game.check_sync(data["sync"]):
+                self.request_resync()
+        elif event_type == Event.RESYNC:
+            self.game.resync(data["id"], data["kind"], data["total"], data[data["kind"]])
         elif event_type == Event.DEATH:
             self.died = True
             self.send_dict(event=Event.DEATH)
             self.game.death()
         elif event_type == Event.ALIVE:
             self.game.handle_alives(data.get("alives"))
-            self.last_timestamp = time.time()
+        elif event_type == Event.PING:
+            self.send_dict(event=Event.PONG, t=data["t"], ct=time.time())
+            self.game.update_latency(data.get("rtt"), data.get("jitter"))
         elif event_type == Event.FINISHED:
             self.send_dict(event=Event.FINISHED)
             self.game.handle_win(data.get("win"))
@@ -161,13 +209,53 @@ class NetworkGameClient(DatagramProtocol):
         elif code == Error.DUPLICATE_USERNAME:
             self.game.handle_error("Another user with the same name is already playing here")
 
+        elif code == Error.RESUME_INVALID:
+            self.game.handle_error("Cannot reach game server anymore, sorry !")
+
         else:
             Logger.error("Got unknown error code {code}".format(code=code))
 
     def check_server_alive(self):
+        """
+        Gives up if the server didn't send anything for too long, after trying to resume the session
+        in case only our address changed
+        """
         if self.last_timestamp < time.time() - 10:
             self.game.handle_error("Cannot reach game server anymore, sorry !")
             self.last_timestamp = time.time()
+        elif self.last_timestamp < time.time() - RESUME_DELAY and self.resume_token is not None:
+            self.send_dict(event=Event.RESUME, token=self.resume_token)
+
+    def receive_seq(self, seq: int):
+        """
+        Marks the given sequence number as received, to acknowledge it to the server
+
+        :param seq: sequence number of the datagram received
+        """
+        if seq > self.ack_seq:
+            if self.ack_seq >= 0:
+                shift = seq - self.ack_seq
+                self.ack_mask = ((self.ack_mask << shift) | (1 << (shift - 1))) & ((1 << ACK_WINDOW) - 1)
+            self.ack_seq = seq
+            self.ack_timestamp = time.time()
+        elif 0 < self.ack_seq - seq <= ACK_WINDOW:
+            self.ack_mask |= 1 << (self.ack_seq - seq - 1)
+
+    def send_ack(self):
+        """
+        Acknowledges the datagrams received to the server, to let it adapt its sending rate
+        """
+        if self.ack_seq >= 0 and not self.died:
+            self.send_dict(event=Event.ACK, seq=self.ack_seq, mask=self.ack_mask,
+                           delay=time.time() - self.ack_timestamp)
+
+    def request_resync(self):
+        """
+        Asks the server for all the food and bonuses, when some of their spawns or despawns were lost
+        """
+        if self.resync_timestamp < time.time() - RESYNC_DELAY:
+            self.resync_timestamp = time.time()
+            self.send_dict(event=Event.RESYNC)
 
     def send_token(self):
         """
@@ -175,11 +263,14 @@ class NetworkGameClient(DatagramProtocol):
         """
         self.send_dict(event=Event.TOKEN, token=self.auth_client.token)
 
-    def send_state(self, position):
+    def send_input(self, seq: int, direction: int):
         """
-        Sends the state of the phagocyte to the server.
+        Sends the direction in which the phagocyte moves to the server.
+
+        :param seq: sequence number of the input
+        :param direction: direction on both axes, encoded as 3 * (x + 1) + (y + 1)
         """
-        self.send_dict(event=Event.STATE, position=position)
+        self.send_dict(event=Event.INPUT, s=seq, d=direction)
 
     def send_bullet(self, angle):
         """
@@ -2,12 +2,13 @@
 This module contains everything related to the actual game
 """
 
+import collections
 import enum
 from itertools import chain
 from math import atan2
 
 import time
-from typing import Dict, Union, List, Any
+from typing import Deque, Dict, Union, List, Any
 from typing import Tuple
 
 from kivy.clock import Clock
@@ -16,7 +17,7 @@ from kivy.properties import NumericProperty, ListProperty, StringProperty
 from kivy.uix.widget import Widget
 from kivy.utils import get_color_from_hex
 
-from phagocyte_frontend.network.game import NetworkGameClient
+from phagocyte_frontend.network.game import IDLE_DIRECTION, INPUT_HEARTBEAT, INPUT_STEP, NetworkGameClient, checksum
 
 
 __author__ = "Mathieu Urstein <mathieu.urstein@heig-vd.ch"
@@ -146,6 +147,7 @@ class MainPlayer(Player):
     """
     Represents the main player of the application
     """
+    RECONCILIATION_THRESHOLD = 2  # type: float
     bonus_speedup = NumericProperty(0)  # type: NumericProperty
     current_bonus = StringProperty("")  # type: StringProperty
 
@@ -158,6 +160,9 @@ class MainPlayer(Player):
         self.correction_y = 0  # type: float
         self.speed_x = 0  # type: float
         self.speed_y = 0  # type: float
+        self.input_seq = 0  # type: int
+        # inputs sent to the server that it didn't acknowledge yet, with the move they caused
+        self.pending_inputs = collections.deque()  # type: collections.deque[Tuple[int, float, float]]
 
         # determines whether the player is currently shooting or not
         self.shooting = False  # type: bool
@@ -234,16 +239,53 @@ class MainPlayer(Player):
         """
         self.max_speed = self.bonus_speedup * 50 * self.initial_size / self.size[0] ** 0.5
 
-    def move(self, dt: float):
+    @property
+    def direction(self) -> int:
+        """ direction in which the player moves, encoded for the server """
+        return 3 * (self.speed_y + 1) + self.speed_x + 1
+
+    def move(self, dt: float) -> Tuple[float, float]:
         """
         Moves the player according to the time since last move
 
         :param dt: delta of time since last move
+        :return: move on both axes
         """
-        self.add_position(
-            self.max_speed * self.speed_y * dt,
-            self.max_speed * self.speed_x * dt
-        )
+        move = (self.max_speed * self.speed_y * dt, self.max_speed * self.speed_x * dt)
+        self.add_position(*move)
+        return move
+
+    def record_input(self, move: Tuple[float, float]) -> int:
+        """
+        Records an input sent to the server, to replay it until the server acknowledges it
+
+        :param move: move caused by the input
+        :return: sequence number of the input
+        """
+        self.input_seq += 1
+        self.pending_inputs.append((self.input_seq, move[0], move[1]))
+        return self.input_seq
+
+    def reconcile(self, x: float, y: float, ack: int):
+        """
+        Corrects the position predicted for the player with the one computed by the server
+
+        :param x: position of the center of the player on the x axis, according to the server
+        :param y: position of the center of the player on the y axis, according to the server
+        :param ack: sequence number of the last input the server applied
+        """
+        while self.pending_inputs and self.pending_inputs[0][0] <= ack:
+            self.pending_inputs.popleft()
+
+        # the inputs not yet applied by the server are replayed on top of its position
+        delta_x = x + sum(move[1] for move in self.pending_inputs) - \
+            (self.position_x + self.size[0] / 2 + self.correction_x)
+        delta_y = y + sum(move[2] for move in self.pending_inputs) - \
+            (self.position_y + self.size[1] / 2 + self.correction_y)
+
+        if abs(delta_x) > self.RECONCILIATION_THRESHOLD or abs(delta_y) > self.RECONCILIATION_THRESHOLD:
+            self.correction_x += delta_x
+            self.correction_y += delta_y
 
     def set_bonus(self, bonus: int):
         """
@@ -326,72 +368,74 @@ class World(Widget):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.players = {}  # type: Dict[str, Player]
-        self.food = {}  # type: Dict[Tuple(float, float), Food]
+        self.food = {}  # type: Dict[int, Food]
         self.bullets = {}  # type: Dict[str, Bullet]
-        self.bonuses = {}  # type: Dict[Tuple(float, float), Bonus]
+        self.bonuses = {}  # type: Dict[int, Bonus]
 
-    def add_food(self, x: float, y: float, size: float):
+    def add_food(self, uid: int, x: float, y: float, size: float):
         """
         add a new food on the map
 
+        :param uid: unique id of the food
         :param x: position on the x axis of the food
         :param y: position on the y axis of the food
         :param size: size of the food
         """
         food = Food(size=(size, size))
-        self.food[(x, y)] = food
+        self.food[uid] = food
         self.add_widget(food)
         food.set_position(x, y)
 
-    def add_bullet(self, uid: str, x: float, y: float, speed_x: float, speed_y: float, color: str, size: float):
+    def add_bullet(self, uid: str, x: float, y: float, speed_x: float, speed_y: float, color: str, size: float,
+                   age: float=0):
         """
-        Adds a new bullet on the map
+        Adds a new bullet on the map, that then moves by itself
 
         :param uid: unique id of the bullet
-        :param x: position on the x axis of the bullet
-        :param y: position on the y axis of the bullet
+        :param x: position on the x axis where the bullet was shot
+        :param y: position on the y axis where the bullet was shot
         :param speed_x: speed on the x axis of the bullet
         :param speed_y: speed on the y axis of the bullet
         :param color: color of the bullet
         :param size: size of the bullet
+        :param age: time since the bullet was shot
         """
         if self.bullets.get(uid) is None:
             self.bullets[uid] = Bullet(uid, speed_x, speed_y, size=(size, size), color=get_color_from_hex(color))
             self.add_widget(self.bullets[uid])
-        self.bullets[uid].set_position(x, y)
+            self.bullets[uid].set_position(x + speed_x * age, y + speed_y * age)
 
-    def add_bonus(self, x: float, y: float, size: float):
+    def add_bonus(self, uid: int, x: float, y: float, size: float):
         """
         Adds a new bonus on the map
 
+        :param uid: unique id of the bonus
         :param x: position on the x axis of the bonus
         :param y: position on the y axis of the bonus
         :param size: size of the bonus
         """
         bonus = Bonus(size=(size, size))
         self.add_widget(bonus)
-        self.bonuses[(x, y)] = bonus
+        self.bonuses[uid] = bonus
         bonus.set_position(x, y)
 
-    def remove_bonus(self, x: float, y: float):
+    def remove_bonus(self, uid: int):
         """
-        Removes the bonus at the position (x, y)
+        Removes the bonus identified by the given uid
 
-        :param x: position on the x axis of the bonus
-        :param y: position on the y axis of the bonus
+        :param uid: unique id of the bonus to remove
         """
-        b = self.bonuses.pop((x, y), None)
+        b = self.bonuses.pop(uid, None)
         if b:
             self.remove_widget(b)
 
-    def remove_food(self, x: float, y: float):
+    def remove_food(self, uid: int):
         """
-        Removes the food at the position (x, y)
+        Removes the food identified by the given uid
 
-        :param x: position on the x axis of the bonus
-        :param y: position on the y axis of the bonus
+        :param uid: unique id of the food to remove
         """
-        f = self.food.pop((x, y), None)
+        f = self.food.pop(uid, None)
         if f:
             self.remove_widget(f)
 
@@ -406,6 +450,32 @@ class World(Widget):
             self.remove_widget(b)
 
 
+def interpolate(snapshots: Deque[Tuple[float, float, float]], render_time: float,
+                max_extrapolation: float) -> Tuple[float, float]:
+    """
+    Computes the position of a player at the time rendered, between the two positions received around that time.
+    The positions older than needed are removed.
+
+    Past the newest position, the player keeps going in the same direction for max_extrapolation seconds in case
+    updates were lost. Players that stop are sent once more where they stopped, and thus don't overshoot.
+
+    :param snapshots: server time and position on both axes of the player, oldest first
+    :param render_time: time rendered, on the clock of the server
+    :param max_extrapolation: longest time to extrapolate for, in seconds
+    :return: position of the player on both axes
+    """
+    # the snapshots before the one just before the time rendered are not needed anymore
+    while len(snapshots) > 2 and snapshots[1][0] <= render_time:
+        snapshots.popleft()
+
+    if len(snapshots) == 1 or render_time <= snapshots[0][0]:
+        return snapshots[0][1], snapshots[0][2]
+
+    (t0, x0, y0), (t1, x1, y1) = snapshots[0], snapshots[1]
+    ratio = (min(render_time, t1 + max_extrapolation) - t0) / (t1 - t0)
+    return x0 + (x1 - x0) * ratio, y0 + (y1 - y0) * ratio
+
+
 class GameInstance(Widget):
     """
     The instance of the game displayed by the game manager
@@ -414,11 +484,16 @@ class GameInstance(Widget):
     """
     REFRESH_RATE = 1 / 60  # type: float
     SCALE_RATIO = 8  # type: int
+    INTERPOLATION_DELAY = 0.1  # type: float
+    MAX_EXTRAPOLATION = 0.25  # type: float
+    MAX_SNAPSHOTS = 32  # type: int
+    CLOCK_DRIFT = 0.001  # type: float
     win_size = NumericProperty(1000)  # type: NumericProperty
     scale_ratio_util = NumericProperty(0)  # type: NumericProperty
     server = None  # type: NetworkGameClient
 
     bonus_label = StringProperty("")  # type: StringProperty
+    latency = StringProperty("")  # type: StringProperty
     # noinspection PyArgumentList
     best_players = ListProperty(["", "", ""])  # type: ListProperty
 
@@ -426,7 +501,15 @@ class GameInstance(Widget):
         super().__init__(**kwargs)
         self.world.main_player.bind(center=self.follow_main_player)
 
-        self.events = [self.move_main_player, self.send_moves, self.send_bullets, self.move_bullets]
+        self.events = [self.send_bullets, self.move_bullets, self.interpolate_players]
+        self.last_input = 0  # type: float
+        # positions of the other players received from the server, with the time of the server at which they were
+        # sent, to render them a bit in the past between two known positions
+        self.snapshots = {}  # type: Dict[str, collections.deque[Tuple[float, float, float]]]
+        # estimation of the difference between our clock and the one of the server, latency included
+        self.clock_offset = None  # type: float
+        # records of the resynchronizations being received, by kind of object
+        self.pending_resyncs = {}  # type: Dict[str, Tuple[int, Dict[int, Dict[str, float]]]]
 
     def _stop_game(self):
         """
@@ -434,17 +517,10 @@ class GameInstance(Widget):
         """
         for event in self.events:
             Clock.unschedule(event)
+        Clock.unschedule(self.send_inputs)
 
         self.world.main_player.keyboard.release()
 
-    def move_main_player(self, dt: int):
-        """
-        Moves the main player for the given time
-
-        :param dt: time elapsed since last move
-        """
-        self.world.main_player.move(dt)
-
     # noinspection PyUnusedLocal
     def follow_main_player(self, instance, attribute):
         """
@@ -461,16 +537,19 @@ class GameInstance(Widget):
         self.camera.scroll_y = y
 
     # noinspection PyUnusedLocal
-    def send_moves(self, dt: int):
+    def send_inputs(self, dt: int):
         """
-        Send new position to the server
+        Moves the main player by one input step, predicting what the server will do, and sends the direction
+        in which it moves to the server. Inputs are only sent once in a while when the player doesn't move.
 
-        :param dt: time since last move was sent
+        :param dt: time since last input was sent
         """
-        self.server.send_state((
-            self.world.main_player.center_x - Window.width / 2,
-            self.world.main_player.center_y - Window.height / 2
-        ))
+        player = self.world.main_player
+        move = player.move(INPUT_STEP)
+
+        if player.direction != IDLE_DIRECTION or self.last_input < time.time() - INPUT_HEARTBEAT:
+            self.last_input = time.time()
+            self.server.send_input(player.record_input(move), player.direction)
 
     # noinspection PyUnusedLocal
     def send_bullets(self, dt: int):
@@ -516,19 +595,32 @@ class GameInstance(Widget):
         """
         for event in self.events:
             Clock.schedule_interval(event, self.REFRESH_RATE)
+        Clock.schedule_interval(self.send_inputs, INPUT_STEP)
 
-    def update_state(self, states: List[Dict[str, Union[str, int, float, Dict[str, float]]]], deaths: List[str]):
+    def update_state(self, states: List[Dict[str, Union[str, int, float, Dict[str, float]]]], deaths: List[str],
+                     server_time: float=None):
         """
         updates the current state of the game
 
         :param states: players that moved
         :param deaths: players that died
+        :param server_time: time of the server at which the state was sent, None if it doesn't tell it
         """
+        if server_time is not None:
+            offset = time.time() - server_time
+            # the smallest offset seen is the one with the least latency, it slowly drifts to follow clock changes
+            if self.clock_offset is None or offset < self.clock_offset + self.CLOCK_DRIFT:
+                self.clock_offset = offset
+            else:
+                self.clock_offset += self.CLOCK_DRIFT
+
         for state in states:
             if state["name"] == self.server.name:
                 player = self.world.main_player
 
-                if state.get("dirty", None):
+                if state.get("ack") is not None:
+                    player.reconcile(state["x"], state["y"], state["ack"])
+                elif state.get("dirty", None):
                     player.correction_x += state["dirty"][0]
                     player.correction_y += state["dirty"][1]
             else:
@@ -540,43 +632,150 @@ class GameInstance(Widget):
                     player.color = get_color_from_hex(state["color"])
                     self.world.add_widget(player)
                     self.world.players[state["name"]] = player
+                    player.set_position(state["x"] - player.size[0] / 2, state["y"] - player.size[1] / 2)
 
-                player.set_position(state["x"] - player.size[0] / 2, state["y"] - player.size[1] / 2)
+                if server_time is None:
+                    player.set_position(state["x"] - player.size[0] / 2, state["y"] - player.size[1] / 2)
+                else:
+                    snapshots = self.snapshots.get(state["name"])
+                    if snapshots is None:
+                        snapshots = self.snapshots[state["name"]] = collections.deque(maxlen=self.MAX_SNAPSHOTS)
+                    if not snapshots or snapshots[-1][0] < server_time:
+                        snapshots.append((server_time, state["x"], state["y"]))
 
             player.update(state["size"], state["bonus"], state["hook"])
 
         for death in deaths:
+            self.snapshots.pop(death, None)
             dead = self.world.players.pop(death)
             if dead:
                 self.world.remove_widget(dead)
 
-    def update_food(self, new: List[Dict[str, float]], deleted: List[Dict[str, float]]):
+    def catch_up(self, data: Dict[str, Any]):
+        """
+        updates the game after the session was resumed, with what we could have missed while disconnected
+
+        :param data: state of the main player, names of the players still in the game and checksums of the
+                     food and bonuses
+        """
+        you = data["you"]
+        # the server sends no acknowledgement when it didn't apply any of our inputs yet
+        if you.get("ack") is not None:
+            self.world.main_player.reconcile(you["x"], you["y"], you["ack"])
+        self.world.main_player.update(you["size"], you["bonus"], you["hook"])
+
+        for name in [name for name in self.world.players if name not in data["players"]]:
+            self.snapshots.pop(name, None)
+            self.world.remove_widget(self.world.players.pop(name))
+
+        if not self.check_sync(data["sync"]):
+            self.server.request_resync()
+
+    # noinspection PyUnusedLocal
+    def interpolate_players(self, dt: float):
+        """
+        Moves the other players to where they were INTERPOLATION_DELAY seconds ago, between the two positions
+        received around that time. When no newer position was received, the players keep going in the same
+        direction for a short time.
+
+        :param dt: time since the last call
+        """
+        if self.clock_offset is None:
+            return
+
+        render_time = time.time() - self.clock_offset - self.INTERPOLATION_DELAY
+
+        for name, snapshots in self.snapshots.items():
+            player = self.world.players.get(name)
+            if player is None:
+                continue
+
+            x, y = interpolate(snapshots, render_time, self.MAX_EXTRAPOLATION)
+            player.set_position(x - player.size[0] / 2, y - player.size[1] / 2)
+
+    def update_food(self, new: List[Dict[str, float]], deleted: List[int]):
         """
         updates the state of the food in the world
 
-        :param new: new food objects
-        :param deleted: food objects to remove from the game
+        :param new: food objects that spawned
+        :param deleted: unique ids of the food objects to remove from the game
         """
         for entry in new:
-            if (entry["x"], entry["y"]) not in self.world.food.keys():
-                self.world.add_food(entry["x"], entry["y"], entry["size"])
+            if entry["uid"] not in self.world.food:
+                self.world.add_food(**entry)
 
-        for entry in deleted:
-            self.world.remove_food(entry["x"], entry["y"])
+        for uid in deleted:
+            self.world.remove_food(uid)
 
-    def update_bonus(self, new: List[Dict[str, float]], deleted: List[Dict[str, float]]):
+    def update_bonus(self, new: List[Dict[str, float]], deleted: List[int]):
         """
         updates the state of the bonus in the world
 
-        :param new: new bonus objects
-        :param deleted: bonus objects to remove from the game
+        :param new: bonus objects that spawned
+        :param deleted: unique ids of the bonus objects to remove from the game
         """
         for entry in new:
-            if (entry["x"], entry["y"]) not in self.world.bonuses.keys():
-                self.world.add_bonus(entry["x"], entry["y"], entry["size"])
+            if entry["uid"] not in self.world.bonuses:
+                self.world.add_bonus(**entry)
+
+        for uid in deleted:
+            self.world.remove_bonus(uid)
+
+    def check_sync(self, syncs: List[Dict[str, Union[str, int]]]) -> bool:
+        """
+        checks that the food and bonuses on the map are the same as on the server
 
-        for entry in deleted:
-            self.world.remove_bonus(entry["x"], entry["y"])
+        :param syncs: number and checksum of the objects on the server, for each kind of object
+        :return: False if some spawns or despawns were missed
+        """
+        for sync in syncs:
+            objects = self.world.food if sync["field"] == "food" else self.world.bonuses
+            if len(objects) != sync["count"] or checksum(objects.keys()) != sync["checksum"]:
+                return False
+        return True
+
+    def resync(self, rid: int, kind: str, total: int, records: List[Dict[str, float]]):
+        """
+        replaces the food or bonuses on the map by the ones sent by the server, once all were received
+
+        :param rid: id of the resynchronization the records belong to
+        :param kind: "food" or "bonus"
+        :param total: number of objects of this kind on the server
+        :param records: part of the objects of this kind
+        """
+        pending_rid, pending = self.pending_resyncs.get(kind, (None, {}))
+        if pending_rid != rid:
+            pending = {}
+            self.pending_resyncs[kind] = (rid, pending)
+
+        for record in records:
+            pending[record["uid"]] = record
+
+        if len(pending) < total:
+            return
+
+        del self.pending_resyncs[kind]
+        objects, add, remove = (self.world.food, self.world.add_food, self.world.remove_food) if kind == "food" \
+            else (self.world.bonuses, self.world.add_bonus, self.world.remove_bonus)
+
+        for uid in [uid for uid in objects if uid not in pending]:
+            remove(uid)
+
+        for uid, record in pending.items():
+            if uid not in objects:
+                add(**record)
+
+    def update_latency(self, rtt: float, jitter: float):
+        """
+        updates the latency to the server, as measured by it
+
+        :param rtt: round trip time to the server, in seconds, None if not measured yet
+        :param jitter: jitter of the round trip time, in seconds
+        """
+        if rtt is None:
+            self.latency = ""
+        else:
+            self.latency = "{:.0f} ms (+/- {:.0f} ms)".format(rtt * 1000, jitter * 1000)
 
     def move_bullets(self, dt: int):
         """
@@ -637,15 +836,17 @@ class GameInstance(Widget):
             for obj in static_objects:
                 obj.redraw()
 
-    def check_bullets(self, bullets: List[Dict[str, Union[float, str]]], deleted: List[str]):
+    def check_bullets(self, bullets: List[Dict[str, Union[float, str]]], deleted: List[str], now: float):
         """
-        Adds new bullets and remove the ones that hit something
+        Adds new bullets and remove the ones that hit something or left the map
 
-        :param bullets: new bullets to add
+        :param bullets: bullets that were shot, with where and when
         :param deleted: bullets to remove
+        :param now: time of the server when the message was sent
         """
         for bullet in bullets:
-            self.world.add_bullet(**bullet)
+            shot = bullet.pop("t", None)
+            self.world.add_bullet(age=now - shot if now is not None and shot is not None else 0, **bullet)
 
         for bullet in deleted:
             self.world.remove_bullet(bullet)
@@ -713,6 +914,7 @@ class GameInstance(Widget):
 
         for player in to_remove:
             self.world.players.pop(player[0])
+            self.snapshots.pop(player[0], None)
             self.world.remove_widget(player[1])
 
         best_players = sorted(
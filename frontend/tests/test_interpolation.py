@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import collections
+import unittest
+
+from phagocyte_frontend.views.game import interpolate
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestInterpolation(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshots = collections.deque([(0, 0, 0), (1, 100, 50)])
+
+    def test_single_snapshot(self):
+        self.assertEqual(interpolate(collections.deque([(1, 100, 50)]), 5, 0.25), (100, 50))
+
+    def test_between_snapshots(self):
+        self.assertEqual(interpolate(self.snapshots, 0.5, 0.25), (50, 25))
+
+    def test_extrapolates_when_updates_are_late(self):
+        self.assertEqual(interpolate(self.snapshots, 1.25, 0.25), (125, 62.5))
+
+    def test_extrapolation_is_limited(self):
+        self.assertEqual(interpolate(self.snapshots, 10, 0.25), (125, 62.5))
+
+    def test_player_stopping(self):
+        # players that stop are sent once more where they stopped, they are never drawn further
+        self.snapshots.append((1.1, 100, 50))
+
+        self.assertEqual(interpolate(self.snapshots, 1.05, 0.25), (100, 50))
+        self.assertEqual(interpolate(self.snapshots, 2, 0.25), (100, 50))
+        self.assertEqual(len(self.snapshots), 2)
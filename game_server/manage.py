@@ -5,15 +5,52 @@ Manage commands to run game servers
 """
 
 import argparse
+import importlib
+import json
 import sys
-
-from phagocyte_game_server import runserver as run_node
-from phagocyte_game_manager import runserver
+from typing import Callable
 
 
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
 
 
+def load(entry_point: str) -> Callable:
+    """
+    imports the function implementing a command. Commands are only imported once chosen, so that each
+    of them only pays for the modules it uses: game nodes don't need Flask, and the manager doesn't need Twisted
+
+    :param entry_point: path of the function, as "module:function"
+    :return: the function
+    """
+    module, function = entry_point.split(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def standby(port: int, auth_host: str, auth_port: int):
+    """
+    launches a game node waiting for its game on the standard input, as a JSON list of the remaining command
+    line arguments. The modules of the node are imported meanwhile, so that the game starts right when given.
+
+    Once a game is over, the node resets and waits for the next one the same way, until the input is closed
+
+    :param port: port on which the node will listen
+    :param auth_host: authentication server ip address
+    :param auth_port: authentication server port
+    """
+    load("phagocyte_game_server:runserver")
+
+    def next_game():
+        """ waits for the arguments of the next game, None if the manager exited or doesn't need the node """
+        line = sys.stdin.readline()
+        if not line:
+            return None
+        return parse_args(["node", "-p", str(port), "-a", auth_host, "--auth-port", str(auth_port)] + json.loads(line))
+
+    node = next_game()
+    if node is not None:
+        load(node.pop("func"))(next_game=next_game, **node)
+
+
 def parse_args(_args):
     """
     parse the argument given in parameter
@@ -27,22 +64,44 @@ def parse_args(_args):
     subparsers = parser.add_subparsers(help="commands")
 
     server = subparsers.add_parser("runserver", help="Launch server manager", add_help=False)
-    server.set_defaults(func=runserver)
+    server.set_defaults(func="phagocyte_game_manager:runserver")
     server.add_argument("-?", "--help", action="help")
     server.add_argument("-h", "--host", default="127.0.0.1")
     server.add_argument("-p", "--port", default=5000)
     server.add_argument("-d", "--debug", action="store_true", help="enable the Werkzeug Debugger")
 
     node = subparsers.add_parser("node", help="Launch a new game node", add_help=False)
-    node.set_defaults(func=run_node)
+    node.set_defaults(func="phagocyte_game_server:runserver")
     node.add_argument("-?", "--help", action="help")
     node.add_argument("-p", "--port", dest="port", required=True, type=int, help="port on which to run the server")
     node.add_argument("-a", "--auth", "--authserver", dest="auth_host", required=True,
                       help="authentication server ip address")
     node.add_argument("--auth-port", default=8080, dest="auth_port", type=int, help="authentication server port")
     node.add_argument("--name", help="name of the node to create")
+    node.add_argument("--bind", default="", dest="interface", help="address of the interface on which to listen")
+    node.add_argument("--advertise", help="address to give to the players, found locally by default")
     node.add_argument("-d", "--debug", action="store_true", help="turn on debugging")
     node.add_argument("--token", help="Token used by the manager", required=True)
+    node.add_argument("--batch-io", action="store_true", dest="batch_io",
+                      help="send and receive datagrams with batched system calls (Linux only)")
+    node.add_argument("--listeners", default=1, type=int, help="number of sockets sharing the port")
+    node.add_argument("--rcvbuf", type=int, help="size in bytes of the kernel receive buffer of each socket")
+    node.add_argument("--sndbuf", type=int, help="size in bytes of the kernel send buffer of each socket")
+    node.add_argument("--split", action="store_true",
+                      help="run the network I/O and the simulation in separate processes")
+    node.add_argument("--profile-dir", dest="profile_dir",
+                      help="directory in which to write the profiles taken on SIGUSR1 (sampling) or SIGUSR2 (cProfile)")
+    node.add_argument("--tracemalloc", default=0, type=int, metavar="N",
+                      help="trace allocations and report the N lines of code holding the most memory")
+    node.add_argument("--gc-freeze", action="store_true", dest="gc_freeze",
+                      help="exclude the objects created at startup from garbage collections")
+    node.add_argument("--gc-thresholds", nargs=3, type=int, dest="gc_thresholds", metavar=("GEN0", "GEN1", "GEN2"),
+                      help="thresholds of the generations of the garbage collector")
+    node.add_argument("--gc-manual", action="store_true", dest="gc_manual",
+                      help="run garbage collections at the end of the ticks, when there is time left")
+    node.add_argument("--report-load", action="store_true", dest="report_load",
+                      help="report the load of the node on the standard output every second, for its manager")
+    node.add_argument("--control", metavar="PATH", help="Unix domain socket on which to listen for commands")
 
     for entry in ["capacity", "map_width", "min_radius", "food_production_rate",
                   "map_height", "max_speed", "max_hit_count", "win_size"]:
@@ -51,6 +110,54 @@ def parse_args(_args):
     for entry in ["eat_ratio"]:
         node.add_argument("--" + entry, type=float)
 
+    warm_node = subparsers.add_parser("standby", help="Launch a game node waiting for its game", add_help=False)
+    warm_node.set_defaults(func=standby)
+    warm_node.add_argument("-?", "--help", action="help")
+    warm_node.add_argument("-p", "--port", dest="port", required=True, type=int,
+                           help="port on which to run the server")
+    warm_node.add_argument("-a", "--auth", "--authserver", dest="auth_host", required=True,
+                           help="authentication server ip address")
+    warm_node.add_argument("--auth-port", default=8080, dest="auth_port", type=int,
+                           help="authentication server port")
+
+    bots = subparsers.add_parser("bots", help="Launch bots against a game node", add_help=False)
+    bots.set_defaults(func="phagocyte_game_bots:runbots")
+    bots.add_argument("-?", "--help", action="help")
+    bots.add_argument("-h", "--host", default="127.0.0.1", help="address of the game node")
+    bots.add_argument("-p", "--port", required=True, type=int, help="port of the game node")
+    bots.add_argument("-n", "--count", default=10, type=int, help="number of bots to launch")
+    bots.add_argument("--loss", default=0, type=float, help="ratio of incoming datagrams each bot drops")
+    bots.add_argument("--speed", default=40, type=float, help="speed at which the bots move")
+    bots.add_argument("--duration", type=int, help="time in seconds after which to stop the bots")
+    bots.add_argument("-d", "--debug", action="store_true", help="turn on debugging")
+    bots.add_argument("--inputs", action="store_true", help="send directions instead of positions")
+
+    simulation = subparsers.add_parser("simulate", help="Simulate a game faster than real time", add_help=False)
+    simulation.set_defaults(func="phagocyte_game_server.headless:runsimulation")
+    simulation.add_argument("-?", "--help", action="help")
+    simulation.add_argument("-n", "--players", default=20, type=int, help="number of scripted players")
+    simulation.add_argument("--duration", default=600, type=float, help="simulated time in seconds")
+    simulation.add_argument("--seed", default=0, type=int, help="seed of the random generators")
+
+    for entry, default in [("map_width", 5000), ("map_height", 5000), ("min_radius", 50), ("win_size", 500),
+                           ("max_speed", 400), ("food_production_rate", 5), ("max_hit_count", 10)]:
+        simulation.add_argument("--" + entry, default=default, type=int)
+
+    simulation.add_argument("--eat_ratio", default=1.2, type=float)
+
+    bench = subparsers.add_parser("benchmark", help="Run the microbenchmarks of the game", add_help=False)
+    bench.set_defaults(func="phagocyte_game_benchmarks:runbenchmarks")
+    bench.add_argument("-?", "--help", action="help")
+    bench.add_argument("names", nargs="*", help="benchmarks to run, all of them by default")
+    bench.add_argument("-o", "--output", help="file in which to save the results, as JSON")
+    bench.add_argument("-c", "--compare", dest="baseline", help="results of a previous run to compare against")
+    bench.add_argument("--threshold", default=0.1, type=float, help="relative slowdown considered as a regression")
+    bench.add_argument("--repeat", default=5, type=int, help="number of measures for each benchmark")
+    bench.add_argument("--min-time", default=0.05, dest="min_time", type=float,
+                       help="minimal duration of each measure, in seconds")
+    bench.add_argument("--imports", metavar="MODULE",
+                       help="report the slowest imports of the module, with -X importtime, instead of benchmarking")
+
     parsed_args = vars(parser.parse_args(_args))
 
     if not parsed_args.get("func", None):
@@ -62,6 +169,6 @@ def parse_args(_args):
 
 if __name__ == '__main__':
     args = parse_args(sys.argv[1:])
-    func = args["func"]
-    del args["func"]
+    func = args.pop("func")
+    func = load(func) if isinstance(func, str) else func
     func(**args)
@@ -0,0 +1,526 @@
+"""
+Microbenchmarks of the hot paths of Phagocytes game servers
+
+Each benchmark times a function of the game objects or a handler of the GameProtocol, for a range of
+entity counts. Handlers run against a fake transport, and all randomness is seeded so that two runs
+measure the same work.
+
+Results are saved as JSON, and two result files can be compared to find regressions before they ship.
+
+The startup benchmark spawns real game nodes instead, against a fake authentication server, and times
+how long they take to serve their first tick. The imports slowing it down can be listed with -X importtime.
+"""
+
+import collections
+import gc
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Dict, List, Tuple
+
+from twisted.internet import reactor
+
+from phagocyte_game_server import GameProtocol
+from phagocyte_game_server.custom_types import address, json_object
+from phagocyte_game_server.events import Event
+from phagocyte_game_server.headless import TICK, VirtualClock
+from phagocyte_game_server.game_objects import Bonus, Bullet, Food, GrabHook, Player, RandomPositionedGameObject
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+MAP_SIZE = 5000  # type: int
+PLAYER_COUNTS = (10, 50, 200)  # type: Tuple[int, ...]
+STARTUP_TIMEOUT = 10  # type: float
+BENCHMARKS = collections.OrderedDict()  # type: Dict[str, Tuple[Callable, Tuple[int, ...]]]
+
+
+def benchmark(name: str, counts: Tuple[int, ...]=(1,)) -> Callable:
+    """
+    registers a benchmark. The decorated function takes an entity count and returns the function to time
+
+    :param name: name of the benchmark
+    :param counts: entity counts for which to run the benchmark
+    """
+    def register(setup: Callable[[int], Callable[[], None]]) -> Callable:
+        BENCHMARKS[name] = (setup, counts)
+        return setup
+
+    return register
+
+
+class FakeTransport:
+    """
+    Transport counting the datagrams written instead of sending them
+    """
+    def __init__(self):
+        self.datagrams = 0  # type: int
+        self.bytes = 0  # type: int
+
+    def write(self, datagram: bytes, addr: address=None):
+        """ counts a datagram """
+        self.datagrams += 1
+        self.bytes += len(datagram)
+
+    def writeSequence(self, seq: List, addr: address=None):
+        """ counts a datagram made of several segments """
+        self.datagrams += 1
+        self.bytes += sum(len(segment) for segment in seq)
+
+
+def create_player(index: int, now: float) -> Player:
+    """
+    creates a player at a random position
+
+    :param index: index of the player, used for its name
+    :param now: current time
+    """
+    return Player(index, "player-{}".format(index), "#ffffff", 50, MAP_SIZE, MAP_SIZE, now)
+
+
+def create_protocol(players: int) -> GameProtocol:
+    """
+    creates a game protocol with the given number of players, with food, bullets and bonuses
+    in proportion, connected to a fake transport. The protocol runs on a virtual clock, advanced
+    by one tick every time one of its handlers is called
+
+    :param players: number of players in the game
+    """
+    logger = logging.getLogger("benchmarks")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    protocol = GameProtocol(
+        "127.0.0.1", 0, players, logger, token="benchmark", port=0, map_height=MAP_SIZE, map_width=MAP_SIZE,
+        max_speed=400, max_hit_count=10, eat_ratio=1.2, min_radius=50, food_production_rate=5,
+        win_size=MAP_SIZE * 2, clock=VirtualClock()
+    )
+    protocol.makeConnection(FakeTransport())
+    world = protocol.world
+    now = protocol.clock()
+
+    for index in range(players):
+        addr = ("10.0.{}.{}".format(index // 256, index % 256), 1000 + index)
+        world.players[addr] = create_player(index, now)
+
+    for _ in range(int(50 + 50 * players ** 1.1)):
+        x, y = random.randint(25, MAP_SIZE - 25), random.randint(25, MAP_SIZE - 25)
+        world.add_food(Food(random.randint(5, 25), x, y))
+
+    for player in list(world.players.values()):
+        for _ in range(5):
+            world.bullets.append(Bullet(random.uniform(0, 2 * math.pi), player, now))
+            world.add_bonus(Bonus(MAP_SIZE, MAP_SIZE))
+
+    # players have no link: the benchmarks measure the game, not the congestion control
+    return protocol
+
+
+def ticking(protocol: GameProtocol, handler: Callable[[], None]) -> Callable[[], None]:
+    """
+    get a function advancing the clock of the protocol by a tick before calling the handler
+
+    :param protocol: protocol to which the handler belongs
+    :param handler: handler to call
+    """
+    def tick():
+        protocol.clock.advance(TICK)
+        handler()
+
+    return tick
+
+
+@benchmark("collides_with")
+def bench_collides_with(count: int) -> Callable[[], None]:
+    player = create_player(0, time.time())
+    food = RandomPositionedGameObject(10, MAP_SIZE, MAP_SIZE)
+    return lambda: player.collides_with(food)
+
+
+@benchmark("update_size")
+def bench_update_size(count: int) -> Callable[[], None]:
+    player = create_player(0, time.time())
+    food = RandomPositionedGameObject(1, MAP_SIZE, MAP_SIZE)
+    return lambda: player.update_size(food)
+
+
+@benchmark("to_json.player")
+def bench_player_to_json(count: int) -> Callable[[], None]:
+    player = create_player(0, time.time())
+    player.hook = GrabHook(player, 1)
+    return player.to_json
+
+
+@benchmark("to_json.food")
+def bench_food_to_json(count: int) -> Callable[[], None]:
+    return Food(10, MAP_SIZE / 2, MAP_SIZE / 2).to_json
+
+
+@benchmark("to_json.bullet")
+def bench_bullet_to_json(count: int) -> Callable[[], None]:
+    now = time.time()
+    return Bullet(1, create_player(0, now), now).to_json
+
+
+@benchmark("Bullet")
+def bench_bullet(count: int) -> Callable[[], None]:
+    now = time.time()
+    player = create_player(0, now)
+
+    def shoot():
+        player.size = 1000
+        Bullet(1, player, now)
+
+    return shoot
+
+
+@benchmark("handle_players", PLAYER_COUNTS)
+def bench_handle_players(count: int) -> Callable[[], None]:
+    protocol = create_protocol(count)
+    players = list(protocol.players.items())
+
+    def handle_players():
+        for addr, player in players:
+            protocol.world.moves[addr] = (player.x + 1, player.y - 1)
+        protocol.handle_players()
+
+    return ticking(protocol, handle_players)
+
+
+@benchmark("handle_players.inputs", PLAYER_COUNTS)
+def bench_handle_players_inputs(count: int) -> Callable[[], None]:
+    protocol = create_protocol(count)
+    addresses = list(protocol.players)
+    seqs = itertools.count(1)
+
+    def handle_players():
+        seq = next(seqs)
+        for addr in addresses:
+            protocol.world.push_input(addr, seq, seq % 9)
+        protocol.handle_players()
+
+    return ticking(protocol, handle_players)
+
+
+@benchmark("handle_food", PLAYER_COUNTS)
+def bench_handle_food(count: int) -> Callable[[], None]:
+    protocol = create_protocol(count)
+    return ticking(protocol, protocol.handle_food)
+
+
+@benchmark("handle_new_bullets", PLAYER_COUNTS)
+def bench_handle_new_bullets(count: int) -> Callable[[], None]:
+    protocol = create_protocol(count)
+    players = list(protocol.players.items())
+
+    def handle_new_bullets():
+        for addr, player in players:
+            player.size = 1000
+            protocol.world.new_bullets[addr] = 1
+        protocol.handle_new_bullets()
+        protocol.world.bullets.clear()
+
+    return ticking(protocol, handle_new_bullets)
+
+
+@benchmark("handle_bullets", PLAYER_COUNTS)
+def bench_handle_bullets(count: int) -> Callable[[], None]:
+    protocol = create_protocol(count)
+    bullets = list(protocol.world.bullets)
+
+    def handle_bullets():
+        # the bullets are shot again on each tick, so that they stay in the game
+        for bullet in bullets:
+            bullet.spawn_time = protocol.clock()
+        protocol.world.bullets = collections.deque(bullets)
+        protocol.handle_bullets()
+
+    return ticking(protocol, handle_bullets)
+
+
+@benchmark("handle_bonuses", PLAYER_COUNTS)
+def bench_handle_bonuses(count: int) -> Callable[[], None]:
+    protocol = create_protocol(count)
+    return ticking(protocol, protocol.handle_bonuses)
+
+
+@benchmark("resync", PLAYER_COUNTS)
+def bench_resync(count: int) -> Callable[[], None]:
+    protocol = create_protocol(count)
+
+    def resync_all():
+        protocol.resync_requests.update(protocol.players)
+        protocol.send_resyncs()
+
+    return resync_all
+
+
+@benchmark("handle_hooks", PLAYER_COUNTS)
+def bench_handle_hooks(count: int) -> Callable[[], None]:
+    protocol = create_protocol(count)
+    players = list(protocol.players.values())
+
+    def handle_hooks():
+        for player in players:
+            if player.hook is None:
+                player.hook = GrabHook(player, 1)
+        protocol.handle_hooks()
+
+    return ticking(protocol, handle_hooks)
+
+
+@benchmark("handle_disconnects", PLAYER_COUNTS)
+def bench_handle_disconnects(count: int) -> Callable[[], None]:
+    protocol = create_protocol(count)
+    players = list(protocol.players.values())
+
+    def handle_disconnects():
+        # keeping the players alive, or they would all be gone after a minute of virtual time
+        for player in players:
+            player.timestamp = protocol.clock()
+        protocol.handle_disconnects()
+
+    return ticking(protocol, handle_disconnects)
+
+
+class FakeAuthHandler(BaseHTTPRequestHandler):
+    """
+    Authentication server accepting every game node that registers or unregisters
+    """
+    def do_POST(self):
+        """ accepts the registration """
+        self.send_response(200)
+        self.end_headers()
+
+    do_DELETE = do_POST
+
+    def log_message(self, *args):
+        """ keeps the output of the benchmarks clean """
+        pass
+
+
+@benchmark("startup")
+def bench_startup(count: int) -> Callable[[], None]:
+    auth = HTTPServer(("127.0.0.1", 0), FakeAuthHandler)
+    threading.Thread(target=auth.serve_forever, daemon=True).start()
+    probe = json.dumps({"event": Event.ALIVE}).encode("utf8")
+
+    def startup():
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        node = subprocess.Popen(
+            [sys.executable, "manage.py", "node", "-p", str(port), "-a", "127.0.0.1",
+             "--auth-port", str(auth.server_port), "--token", "benchmark", "--name", "benchmark"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL,
+        )
+
+        # the node only answers once its reactor runs, right when it serves its first tick
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(0.005)
+            deadline = time.perf_counter() + STARTUP_TIMEOUT
+            try:
+                while True:
+                    sock.sendto(probe, ("127.0.0.1", port))
+                    try:
+                        sock.recv(2048)
+                        return
+                    except (socket.timeout, ConnectionRefusedError):
+                        if node.poll() is not None or time.perf_counter() > deadline:
+                            raise RuntimeError("The game node didn't start")
+            finally:
+                node.kill()
+                node.wait()
+
+    return startup
+
+
+def import_times(module: str) -> List[Tuple[str, float]]:
+    """
+    imports the module in a new interpreter, with -X importtime, to find what slows down startup
+
+    :param module: module to import
+    :return: name and cumulative import time in seconds of each module imported, slowest first
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+
+    times = []
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            times.append((name.strip(), int(cumulative) / 1e6))
+
+    return sorted(times, key=lambda entry: entry[1], reverse=True)
+
+
+def time_benchmark(setup: Callable[[int], Callable[[], None]], count: int, repeat: int, min_time: float,
+                   seed: int) -> json_object:
+    """
+    times a benchmark for the given entity count
+
+    :param setup: function creating the function to time
+    :param count: number of entities
+    :param repeat: number of measures to take
+    :param min_time: minimal duration of each measure, in seconds
+    :param seed: seed of the random generator
+    :return: time per call, in seconds, for the best and median measure
+    """
+    random.seed(seed)
+    function = setup(count)
+
+    # like timeit, the garbage collector is disabled so that it doesn't add noise to the measures
+    gc.collect()
+    gc.disable()
+    try:
+        return measure(function, repeat, min_time)
+    finally:
+        gc.enable()
+        # the looping calls of the protocols created would keep them alive
+        for call in reactor.getDelayedCalls():
+            call.cancel()
+
+
+def measure(function: Callable[[], None], repeat: int, min_time: float) -> json_object:
+    """
+    calls the function repeatedly, as many times as needed for each measure to last long enough
+
+    :param function: function to time
+    :param repeat: number of measures to take
+    :param min_time: minimal duration of each measure, in seconds
+    :return: time per call, in seconds, for the best and median measure
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    measures = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        measures.append((time.perf_counter() - start) / number)
+
+    return {"min": min(measures), "median": statistics.median(measures), "number": number}
+
+
+def run(names: List[str]=None, repeat: int=5, min_time: float=0.05, seed: int=0) -> json_object:
+    """
+    runs the benchmarks
+
+    :param names: names of the benchmarks to run, all of them if None
+    :param repeat: number of measures to take for each benchmark
+    :param min_time: minimal duration of each measure, in seconds
+    :param seed: seed of the random generator
+    :return: results of the benchmarks and information about the machine they ran on
+    """
+    results = collections.OrderedDict()
+
+    for name, (setup, counts) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+
+        for count in counts:
+            key = name if counts == (1,) else "{}[{}]".format(name, count)
+            results[key] = time_benchmark(setup, count, repeat, min_time, seed)
+
+    return {
+        "machine": {"python": sys.version, "platform": platform.platform(), "date": time.time()},
+        "results": results,
+    }
+
+
+def compare(baseline: json_object, current: json_object, threshold: float) -> List[Tuple[str, float, float, bool]]:
+    """
+    compares two runs of the benchmarks, on their best time, which is the least noisy
+
+    :param baseline: results of the reference run
+    :param current: results of the new run
+    :param threshold: relative slowdown above which a benchmark is considered as a regression
+    :return: name, baseline time, current time and whether it regressed, for each benchmark in both runs
+    """
+    comparison = []
+
+    for name, result in current["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+        comparison.append((
+            name, reference["min"], result["min"], result["min"] > reference["min"] * (1 + threshold)
+        ))
+
+    return comparison
+
+
+def format_time(seconds: float) -> str:
+    """
+    formats a duration with a readable unit
+
+    :param seconds: duration to format
+    """
+    for unit, factor in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= factor:
+            return "{:.2f} {}".format(seconds / factor, unit)
+    return "{:.0f} ns".format(seconds * 1e9)
+
+
+def runbenchmarks(names: List[str], output: str, baseline: str, threshold: float, repeat: int, min_time: float,
+                  imports: str=None):
+    """
+    runs the benchmarks, prints their results and compares them to a previous run
+
+    :param names: names of the benchmarks to run, all of them if empty
+    :param output: file in which to save the results, None to not save them
+    :param baseline: file containing results to compare against, None to not compare
+    :param threshold: relative slowdown above which a benchmark is considered as a regression
+    :param repeat: number of measures to take for each benchmark
+    :param min_time: minimal duration of each measure, in seconds
+    :param imports: module of which to report the slowest imports instead of running the benchmarks, None to run them
+    """
+    if imports is not None:
+        for name, cumulative in import_times(imports)[:20]:
+            print("{:<50} {:>12}".format(name, format_time(cumulative)))
+        return
+
+    results = run(names, repeat, min_time)
+
+    if output is not None:
+        with open(output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if baseline is None:
+        for name, result in results["results"].items():
+            print("{:<30} {:>12}".format(name, format_time(result["min"])))
+        return
+
+    with open(baseline) as baseline_file:
+        comparison = compare(json.load(baseline_file), results, threshold)
+
+    for name, before, after, regressed in comparison:
+        print("{:<30} {:>12} {:>12} {:>+8.1%}{}".format(
+            name, format_time(before), format_time(after), after / before - 1, "  REGRESSION" if regressed else ""
+        ))
+
+    if any(regressed for *_, regressed in comparison):
+        exit(1)
@@ -0,0 +1,264 @@
+"""
+Load generator for Phagocytes game servers
+
+This spawns bots that connect anonymously to a game server, move randomly and shoot from time to time.
+An incoming loss ratio can be simulated, to see how the server adapts its sending rate to lossy clients.
+Bots either send their position, like the first clients did, or only the direction in which they move.
+"""
+
+import json
+import json.decoder
+import logging
+import random
+import time
+from math import pi
+
+from twisted.internet import reactor, task
+from twisted.internet.protocol import DatagramProtocol
+
+from phagocyte_game_server import create_logger
+from phagocyte_game_server.congestion import ReceiveWindow
+from phagocyte_game_server.events import Event
+from phagocyte_game_server.world import INPUT_STEP
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class BotStatistics:
+    """
+    Statistics shared by all bots, reported periodically
+    """
+    def __init__(self):
+        self.received = 0  # type: int
+        self.received_bytes = 0  # type: int
+        self.dropped = 0  # type: int
+        self.sent = 0  # type: int
+        self.sent_bytes = 0  # type: int
+        self.deaths = 0  # type: int
+        self.playing = 0  # type: int
+
+    def reset(self):
+        """
+        resets the counters, keeping the number of bots playing
+        """
+        self.received = self.received_bytes = self.dropped = self.sent = self.sent_bytes = self.deaths = 0
+
+
+class Bot(DatagramProtocol):
+    """
+    A bot playing on the game server
+
+    :param host: address of the game server
+    :param port: port of the game server
+    :param name: name of the bot
+    :param loss: ratio of incoming datagrams to drop, to simulate a lossy link
+    :param speed: speed at which the bot moves, per axis
+    :param stats: statistics to update
+    :param logger: logger to use
+    :param inputs: whether to send the direction in which the bot moves instead of its position
+    """
+    def __init__(self, host: str, port: int, name: str, loss: float, speed: float, stats: BotStatistics,
+                 logger: logging.Logger, inputs: bool=False):
+        self.host = host  # type: str
+        self.port = port  # type: int
+        self.name = name  # type: str
+        self.loss = loss  # type: float
+        self.speed = speed  # type: float
+        self.stats = stats  # type: BotStatistics
+        self.logger = logger  # type: logging.Logger
+        self.inputs = inputs  # type: bool
+        self.input_seq = 0  # type: int
+
+        self.window = ReceiveWindow()  # type: ReceiveWindow
+        self.x = self.y = 0  # type: float
+        self.max_x = self.max_y = 0  # type: int
+        self.direction_x = self.direction_y = 0  # type: int
+        self.playing = False  # type: bool
+        self.last_move = time.time()  # type: float
+
+        self.loops = [
+            (task.LoopingCall(self.move), INPUT_STEP if inputs else 1 / 20),
+            (task.LoopingCall(self.shoot), 1),
+            (task.LoopingCall(self.send_ack), 1 / 10),
+        ]
+
+    def startProtocol(self):
+        """
+        connects to the game server and registers the bot
+        """
+        self.transport.connect(self.host, self.port)
+        self.send_dict(event=Event.TOKEN, name=self.name)
+
+    def send_dict(self, **kwargs):
+        """
+        sends the given arguments as json to the game server
+        """
+        datagram = json.dumps(kwargs).encode("utf-8")
+        self.transport.write(datagram)
+        self.stats.sent += 1
+        self.stats.sent_bytes += len(datagram)
+
+    def datagramReceived(self, datagram: bytes, addr):
+        """
+        handles a datagram from the server, dropping some of them to simulate loss once playing
+
+        :param datagram: datagram received
+        :param addr: address of the server
+        """
+        if self.playing and random.random() < self.loss:
+            self.stats.dropped += 1
+            return
+
+        self.stats.received += 1
+        self.stats.received_bytes += len(datagram)
+
+        try:
+            data = json.loads(datagram.decode("utf-8"))
+        except json.decoder.JSONDecodeError:
+            self.logger.warning("Invalid json received : '{json}'".format(json=datagram.decode("utf-8")))
+            return
+
+        if data.get("seq") is not None:
+            self.window.receive(data["seq"], time.time())
+
+        event = data.get("event")
+
+        if event == Event.GAME_INFO:
+            self.x, self.y = data["x"], data["y"]
+            self.max_x, self.max_y = data["max_x"], data["max_y"]
+            self.start()
+        elif event == Event.STATE:
+            for update in data["updates"]:
+                if update["name"] == self.name and update.get("dirty"):
+                    self.x += update["dirty"][0]
+                    self.y += update["dirty"][1]
+        elif event == Event.PING:
+            self.send_dict(event=Event.PONG, t=data["t"], ct=time.time())
+        elif event == Event.DEATH:
+            self.send_dict(event=Event.DEATH)
+            self.stats.deaths += 1
+            self.stop()
+            reactor.callLater(1, self.send_dict, event=Event.TOKEN, name=self.name)
+        elif event == Event.FINISHED:
+            self.send_dict(event=Event.FINISHED)
+            self.stop()
+        elif event == Event.ERROR:
+            self.logger.error("Bot {name} got error {error}".format(name=self.name, error=data))
+
+    def start(self):
+        """
+        starts playing
+        """
+        if self.playing:
+            return
+
+        self.playing = True
+        self.stats.playing += 1
+        self.last_move = time.time()
+
+        for loop, interval in self.loops:
+            loop.start(interval)
+
+    def stop(self):
+        """
+        stops playing
+        """
+        if not self.playing:
+            return
+
+        self.playing = False
+        self.stats.playing -= 1
+
+        for loop, _ in self.loops:
+            loop.stop()
+
+    def move(self):
+        """
+        moves the bot randomly on the map
+        """
+        now = time.time()
+        dt = now - self.last_move
+        self.last_move = now
+
+        if random.random() < 0.05:
+            self.direction_x = random.choice([-1, 0, 1])
+            self.direction_y = random.choice([-1, 0, 1])
+
+        if self.inputs:
+            self.input_seq += 1
+            self.send_dict(event=Event.INPUT, s=self.input_seq, d=3 * (self.direction_x + 1) + self.direction_y + 1)
+            return
+
+        self.x = max(0, min(self.max_x, self.x + self.direction_x * self.speed * dt))
+        self.y = max(0, min(self.max_y, self.y + self.direction_y * self.speed * dt))
+
+        self.send_dict(event=Event.STATE, position=(self.x, self.y))
+
+    def shoot(self):
+        """
+        shoots a bullet in a random direction, from time to time
+        """
+        if random.random() < 0.3:
+            self.send_dict(event=Event.BULLETS, angle=random.uniform(-pi, pi))
+
+    def send_ack(self):
+        """
+        acknowledges the datagrams received, also subject to the simulated loss
+        """
+        if self.window.seq >= 0 and random.random() >= self.loss:
+            self.send_dict(event=Event.ACK, **self.window.to_json(time.time()))
+
+
+def report(stats: BotStatistics, interval: float, logger: logging.Logger):
+    """
+    logs the statistics of the bots since the last report
+
+    :param stats: statistics of the bots
+    :param interval: time elapsed since the last report
+    :param logger: logger to use
+    """
+    if stats.playing:
+        logger.info(
+            "{playing} bots playing, {received:.1f} datagrams/s/bot ({size:.1f} kB/s/bot), "
+            "{dropped:.1f} dropped/s/bot, {sent:.1f} sent/s/bot ({sent_size:.2f} kB/s/bot), {deaths} deaths".format(
+                playing=stats.playing, received=stats.received / interval / stats.playing,
+                size=stats.received_bytes / interval / stats.playing / 1000,
+                dropped=stats.dropped / interval / stats.playing, sent=stats.sent / interval / stats.playing,
+                sent_size=stats.sent_bytes / interval / stats.playing / 1000,
+                deaths=stats.deaths,
+            )
+        )
+    else:
+        logger.info("No bot playing")
+
+    stats.reset()
+
+
+def runbots(host: str, port: int, count: int, loss: float, speed: float, duration: int, debug: bool, inputs: bool):
+    """
+    launches the bots against the given game server
+
+    :param host: address of the game server
+    :param port: port of the game server
+    :param count: number of bots to launch
+    :param loss: ratio of incoming datagrams each bot drops
+    :param speed: speed at which the bots move
+    :param duration: time after which to stop, or None to run forever
+    :param debug: whether to turn on debugging or not
+    :param inputs: whether the bots send the direction in which they move instead of their position
+    """
+    logger = create_logger("bots", port, debug)
+    stats = BotStatistics()
+    report_interval = 5
+
+    for index in range(count):
+        bot = Bot(host, port, "bot-{}-{}".format(random.randrange(10000), index), loss, speed, stats, logger, inputs)
+        reactor.listenUDP(0, bot)
+
+    task.LoopingCall(report, stats, report_interval, logger).start(report_interval, now=False)
+
+    if duration is not None:
+        reactor.callLater(duration, reactor.stop)
+
+    reactor.run()
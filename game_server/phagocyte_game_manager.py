@@ -3,10 +3,31 @@ Game server manager for Phagocytes
 
 This is used to handle the creation on the fly of new server instance
 to allow multiple games to be run at the same time
+
+A pool of warm nodes is kept, already started and waiting for a game, so that creating a game doesn't
+wait for a new interpreter to start and import the server. Nodes go back to the pool once their game is over.
+
+Nodes report their load on their standard output, and the manager sends it to the authentication server
+in regular heartbeats, for it to place new games on the least loaded managers.
+
+Each node also listens on a Unix domain socket, through which the commands received on /games/control are
+passed to it, to get its stats, tune the running game, drain it or stop it.
+
+The manager hosts one game per CPU it may use, taking its CPU affinity and the CPU quota of its cgroup into
+account, and pins each node to its own CPU, on Linux, so that nodes don't disturb each other's ticks. Nodes
+split in two processes with SPLIT_NODES are only kept on the CPUs of the manager, their processes would
+otherwise compete for a single one.
 """
 
+import collections
+import json
 import multiprocessing
+import socket
 import subprocess
+import tempfile
+import threading
+import time
+from typing import Deque, Dict, List, Tuple
 
 import atexit
 import os
@@ -19,6 +40,44 @@ from flask import Flask, request, jsonify
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
 
 
+def cgroup_cpu_limit() -> float:
+    """
+    get the number of CPUs the processes of the manager's cgroup may use, from its CPU quota
+
+    :return: the number of CPUs, None if there is no quota
+    """
+    try:
+        with open("/proc/self/cgroup") as cgroup_file:
+            cgroup = next((line.strip()[3:] for line in cgroup_file if line.startswith("0::")), "/")
+        with open(os.path.join("/sys/fs/cgroup", cgroup.lstrip("/"), "cpu.max")) as quota_file:
+            quota, period = quota_file.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as quota_file:
+            quota = int(quota_file.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as period_file:
+            period = int(period_file.read())
+    except (OSError, ValueError):
+        return None
+
+    return quota / period if quota > 0 else None
+
+
+def available_cpus() -> List[int]:
+    """
+    get the CPUs on which the manager is allowed to run
+
+    :return: the CPUs, in order
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
 class FullCapacityException(Exception):
     """
     Error raised when a server is operating at full capacity
@@ -31,14 +90,31 @@ class NotifierFlask(Flask):
     This is a Flask server that is able of sending a token to another server before launch
     """
     token = None
-    capacity = multiprocessing.cpu_count()
-    ports_used = None
+    capacity = None  # type: int
+    # CPUs on which to pin the nodes, by index of their port
+    cpus = None  # type: List[int]
+    free_ports = None  # type: Deque[int]
+    processes = None  # type: Dict[int, subprocess.Popen]
+    warm_nodes = None  # type: Deque[Tuple[subprocess.Popen, int]]
+    games = None  # type: Dict[int, subprocess.Popen]
+    loads = None  # type: Dict[int, Dict]
+    lock = None  # type: threading.Lock
 
     def setup_ports(self):
         """
-        initializes which ports are available for this server
+        initializes which ports are available for this server, one for each CPU the server may use
         """
-        self.ports_used = [False] * self.capacity
+        cpus = available_cpus()
+        limit = cgroup_cpu_limit()
+        self.capacity = len(cpus) if limit is None else max(1, min(len(cpus), int(limit)))
+        self.cpus = cpus[:self.capacity]
+
+        self.free_ports = collections.deque(range(self.capacity))
+        self.processes = dict()
+        self.warm_nodes = collections.deque()
+        self.games = dict()
+        self.loads = dict()
+        self.lock = threading.Lock()
 
     def next_available_port(self) -> int:
         """
@@ -46,12 +122,10 @@ class NotifierFlask(Flask):
 
         :return: the index of the next available port
         """
-        for index in range(len(self.ports_used)):
-            if not self.ports_used[index]:
-                self.ports_used[index] = True
-                return index
-
-        raise FullCapacityException()
+        try:
+            return self.free_ports.popleft()
+        except IndexError:
+            raise FullCapacityException()
 
     def get_token(self, host: str, port: int):
         """
@@ -62,7 +136,7 @@ class NotifierFlask(Flask):
         """
         r = requests.post(
             "http://{}:{}/games/manager".format(app.config["AUTH_SERVER"], app.config["AUTH_SERVER_PORT"]),
-            json={"port": port, "host": host, "capacity": multiprocessing.cpu_count()}
+            json={"port": port, "host": host, "capacity": self.capacity}
         )
 
         if r.status_code == requests.codes.ok:
@@ -82,27 +156,313 @@ class NotifierFlask(Flask):
         """
         self.get_token(host, port)
         self.debug = debug
+        self.fill_pool()
+        threading.Thread(target=self.supervise, daemon=True).start()
+        threading.Thread(target=self.heartbeat, daemon=True).start()
         super().run(host, port, debug, **options)
 
-    def create_game_server(self, **kwargs):
+    def spawn(self, command: str, index: int, arguments: List[str]=(), **kwargs) -> subprocess.Popen:
         """
-        Creates a new game server
+        Launches a game node process, which keeps its port until it exits. Must be called with the lock held
 
-        :param kwargs: arguments to pass to the executable
+        :param command: manage.py command to run, "node" or "standby"
+        :param index: index of the port on which the node will listen
+        :param arguments: additional arguments to pass to the executable
+        :param kwargs: arguments to pass to the process
+        :return: the process
         """
         cmd = [sys.executable]
         if not getattr(sys, 'frozen', False):
             cmd.append("manage.py")
-        cmd.extend(
-            [
-                "node", "-p", str(self.config["PORT_GAMESERVER"] + self.next_available_port()),
-                "-a", str(app.config["AUTH_SERVER"]), "--auth-port", str(app.config["AUTH_SERVER_PORT"]),
-            ] + [entry for entries in [["--" + key, item] for key, item in kwargs.items()] for entry in entries])
+        cmd.extend([
+            command, "-p", str(self.config["PORT_GAMESERVER"] + index),
+            "-a", str(app.config["AUTH_SERVER"]), "--auth-port", str(app.config["AUTH_SERVER_PORT"]),
+        ])
+        cmd.extend(arguments)
+
+        process = subprocess.Popen(
+            cmd, cwd=os.path.dirname(os.path.abspath(__file__)), stderr=sys.stderr, stdout=subprocess.PIPE, **kwargs
+        )
+        self.processes[index] = process
+        self.pin(process, index)
+        threading.Thread(target=self.watch, args=(process, index), daemon=True).start()
+        return process
+
+    def pin(self, process: subprocess.Popen, index: int):
+        """
+        Pins a node to its CPU, unless disabled with PIN_NODES. The processes it starts inherit its affinity,
+        split nodes are thus allowed on all the CPUs of the manager for their two processes to run in parallel
+
+        :param process: the node
+        :param index: index of the port of the node
+        """
+        if not self.config.get("PIN_NODES", True) or not hasattr(os, "sched_setaffinity"):
+            return
+
+        cpus = set(self.cpus) if self.config.get("SPLIT_NODES", False) else {self.cpus[index]}
+
+        try:
+            os.sched_setaffinity(process.pid, cpus)
+        except OSError as e:
+            print("Couldn't pin game server to CPUs {}: {}".format(sorted(cpus), e), file=sys.stderr)
+
+    def watch(self, process: subprocess.Popen, index: int):
+        """
+        Reads the load reports of a node until it exits, forwarding anything else it writes
+
+        :param process: the node
+        :param index: index of the port of the node
+        """
+        for line in process.stdout:
+            try:
+                self.loads[index] = json.loads(line.decode("utf8"))["load"]
+            except (ValueError, KeyError, TypeError):
+                sys.stdout.write(line.decode("utf8", "replace"))
+
+        process.stdout.close()
+
+    def fill_pool(self):
+        """
+        Launches warm nodes until the pool is full or no port is left
+        """
+        with self.lock:
+            while len(self.warm_nodes) < self.config.get("WARM_NODES", 2):
+                try:
+                    index = self.next_available_port()
+                except FullCapacityException:
+                    return
+
+                self.warm_nodes.append((self.spawn("standby", index, stdin=subprocess.PIPE), index))
+
+    def take_warm_node(self) -> Tuple[subprocess.Popen, int]:
+        """
+        Takes a warm node out of the pool. Nodes that exited are left to the supervisor
+
+        :return: the node and the index of its port, None if the pool is empty
+        """
+        with self.lock:
+            while self.warm_nodes:
+                process, index = self.warm_nodes.popleft()
+                if process.poll() is None:
+                    return process, index
+
+        return None
+
+    def create_game_server(self, **kwargs):
+        """
+        Creates a new game server, handing the game to a warm node when there is one
+
+        :param kwargs: arguments to pass to the executable
+        """
+        args = [str(entry) for entries in [["--" + key, item] for key, item in kwargs.items()] for entry in entries]
+        args.append("--report-load")
 
         if self.debug:
-            cmd.append("-d")
+            args.append("-d")
+
+        if self.config.get("SPLIT_NODES", False):
+            args.append("--split")
+
+        while True:
+            warm_node = self.take_warm_node()
 
-        subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), stderr=sys.stderr, stdout=sys.stdout)
+            if warm_node is None:
+                with self.lock:
+                    index = self.next_available_port()
+                    self.games[index] = self.spawn("node", index, args + ["--control", self.control_path(index)])
+                break
+
+            process, index = warm_node
+            if self.hand_game(process, index, args + ["--control", self.control_path(index)]):
+                break
+
+        threading.Thread(target=self.fill_pool, daemon=True).start()
+
+    def hand_game(self, process: subprocess.Popen, index: int, args: List[str]) -> bool:
+        """
+        Gives a game to a warm node. Nodes that can't be reached anymore are killed, the supervisor frees their port
+
+        :param process: the warm node
+        :param index: index of the port of the node
+        :param args: arguments of the game
+        :return: whether the node took the game
+        """
+        try:
+            # the input stays open to give the node its next game once this one is over
+            process.stdin.write((json.dumps(args) + "\n").encode("utf8"))
+            process.stdin.flush()
+        except OSError as e:
+            print("Couldn't hand the game to the warm node on port {}: {}".format(
+                self.config["PORT_GAMESERVER"] + index, e
+            ), file=sys.stderr)
+            process.kill()
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            return False
+
+        with self.lock:
+            self.games[index] = process
+
+        return True
+
+    def control_path(self, index: int) -> str:
+        """
+        Get the path of the control socket of a node
+
+        :param index: index of the port of the node
+        """
+        port = self.config["PORT_GAMESERVER"] + index
+        return os.path.join(self.config.get("CONTROL_DIR", tempfile.gettempdir()), "phagocyte-{}.sock".format(port))
+
+    def control(self, port: int, command: Dict) -> Dict:
+        """
+        Sends a command to the node hosting the game on the given port
+
+        :param port: port of the game
+        :param command: command to send
+        :raise KeyError: if no game runs on this port
+        :raise OSError: if the node couldn't be reached
+        :return: the answer of the node
+        """
+        index = port - self.config["PORT_GAMESERVER"]
+        if index not in self.games:
+            raise KeyError(port)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(2)
+            sock.connect(self.control_path(index))
+            sock.sendall(json.dumps(command).encode("utf8") + b"\n")
+
+            answer = b""
+            while not answer.endswith(b"\n"):
+                data = sock.recv(65536)
+                if not data:
+                    raise ConnectionError("Connection closed by the game server")
+                answer += data
+
+        return json.loads(answer.decode("utf8"))
+
+    def release_port(self, port: int) -> bool:
+        """
+        Puts the node back in the pool if it can host another game and the pool isn't full, or lets it exit.
+        Its port is freed by the supervisor once it did
+
+        :param port: port of the game node that stopped
+        :return: whether the port was used by this manager or not
+        """
+        index = port - self.config["PORT_GAMESERVER"]
+
+        with self.lock:
+            process = self.games.pop(index, None)
+
+            if process is not None and process.stdin is not None and process.poll() is None:
+                if len(self.warm_nodes) < self.config.get("WARM_NODES", 2):
+                    self.warm_nodes.append((process, index))
+                else:
+                    process.stdin.close()
+
+            return index in self.processes
+
+    def reap(self) -> List[Tuple[int, int]]:
+        """
+        Waits on the game nodes that exited, so that they don't stay as zombies, and frees their port
+
+        :return: index of the port and exit code of the nodes that crashed while hosting a game
+        """
+        crashed = []
+
+        with self.lock:
+            for index, process in list(self.processes.items()):
+                if process.poll() is None:
+                    continue
+
+                del self.processes[index]
+                self.loads.pop(index, None)
+                self.free_ports.append(index)
+                if process.stdin is not None:
+                    process.stdin.close()
+
+                if self.games.pop(index, None) is not None and process.returncode != 0:
+                    crashed.append((index, process.returncode))
+
+            self.warm_nodes = collections.deque(
+                (process, index) for process, index in self.warm_nodes if process.returncode is None
+            )
+
+        return crashed
+
+    def report_crash(self, index: int, returncode: int):
+        """
+        Tells the authentication server that the game on the given port is gone
+
+        :param index: index of the port of the game
+        :param returncode: exit code of the node
+        """
+        port = self.config["PORT_GAMESERVER"] + index
+        print("Game server on port {} crashed with exit code {}".format(port, returncode), file=sys.stderr)
+
+        try:
+            requests.post(
+                "http://{}:{}/games/server/crash".format(app.config["AUTH_SERVER"], app.config["AUTH_SERVER_PORT"]),
+                json={"token": self.token, "port": port}
+            )
+        except requests.exceptions.ConnectionError:
+            print("Couldn't contact authentication server", file=sys.stderr)
+
+    def load(self) -> Dict:
+        """
+        Get the load of the games hosted by the manager, from the last reports of their nodes
+
+        :return: CPU use of the manager, of each of its CPUs and time spent in the handlers of the busiest game,
+                 as fractions, and number of players, of handlers that took longer than a tick and of games
+        """
+        with self.lock:
+            loads = {index: self.loads[index] for index in self.games if index in self.loads}
+
+        cores = collections.defaultdict(float)
+        for index, load in loads.items():
+            cores[self.cpus[index]] += load["cpu"]
+        loads = list(loads.values())
+
+        return {
+            "cpu": sum(load["cpu"] for load in loads) / self.capacity,
+            "cores": {str(cpu): cores[cpu] for cpu in self.cpus},
+            "busy": max([load["busy"] for load in loads] + [0]),
+            "players": sum(load["players"] for load in loads),
+            "overruns": sum(load["overruns"] for load in loads),
+            "games": len(loads),
+        }
+
+    def heartbeat(self):
+        """
+        Sends the load of the manager to the authentication server, every HEARTBEAT_INTERVAL seconds
+        """
+        while True:
+            time.sleep(self.config.get("HEARTBEAT_INTERVAL", 5))
+
+            try:
+                requests.post(
+                    "http://{}:{}/games/manager/heartbeat".format(
+                        app.config["AUTH_SERVER"], app.config["AUTH_SERVER_PORT"]
+                    ),
+                    json={"token": self.token, "load": self.load()}
+                )
+            except requests.exceptions.ConnectionError:
+                print("Couldn't contact authentication server", file=sys.stderr)
+
+    def supervise(self):
+        """
+        Reaps the game nodes every second, reports the ones that crashed and replaces the warm nodes that exited
+        """
+        while True:
+            time.sleep(self.config.get("SUPERVISION_INTERVAL", 1))
+
+            for index, returncode in self.reap():
+                self.report_crash(index, returncode)
+
+            self.fill_pool()
 
 
 app = NotifierFlask("phagocytes_game_manager")
@@ -149,19 +509,36 @@ def create():
 @app.route("/games", methods=["DELETE"])
 def remove():
     """
-    Marks the port as unused and available for a new server
+    Releases the node of a game that is over, for a new game
     """
     if request.json["token"] != app.token:
         return jsonify({"error": "unauthorized"}), 401
 
-    for index in range(len(app.ports_used)):
-        if app.config["PORT_GAMESERVER"] + index == request.json["port"]:
-            app.ports_used[index] = False
-            return "", 200
+    if app.release_port(request.json["port"]):
+        return "", 200
 
     return jsonify({"error": "port not found"}), 404
 
 
+@app.route("/games/control", methods=["POST"])
+def control():
+    """
+    Sends a command to the server of a game, see phagocyte_game_server.control for the commands
+
+    :return: the answer of the server, 404 if no game runs on the port, 502 if the server couldn't be reached
+    """
+    if request.json["token"] != app.token:
+        return jsonify({"error": "unauthorized"}), 401
+
+    try:
+        command = {key: value for key, value in request.json.items() if key not in ("token", "port")}
+        return jsonify(app.control(request.json["port"], command))
+    except KeyError:
+        return jsonify({"error": "port not found"}), 404
+    except (OSError, ValueError) as e:
+        return jsonify({"error": "couldn't reach the game server: {}".format(e)}), 502
+
+
 def runserver(host, port, debug=False):
     """
     runs the server
@@ -1,38 +1,51 @@
 """
 Phagocyte's game handler
 
-This module defines the controller for the Phagocyte's game.
+This module defines the controller for the Phagocyte's game, connecting the simulation to the network.
 """
 
 import json
 import json.decoder
 import logging
-import socket
 import sys
+import tempfile
 import time
 import uuid
-from math import ceil
-from typing import Dict, Set, Tuple
+from typing import Callable, Dict, Set, Tuple
 from typing import List
 
 import atexit
-import collections
 import random
 import requests
 from rainbow_logging_handler import RainbowLoggingHandler
-from twisted.internet import reactor, task
+from twisted.internet import reactor, task, threads
 from twisted.internet.error import CannotListenError
 from twisted.internet.protocol import DatagramProtocol
+from twisted.python.failure import Failure
 
+from phagocyte_game_server.batching import BatchedPort
+from phagocyte_game_server.congestion import CongestionController
+from phagocyte_game_server.control import listen_control
 from phagocyte_game_server.events import Event, Error
-from phagocyte_game_server.game_objects import Bonus, BonusTypes, RandomPositionedGameObject, Bullet, Player,\
-    RoundGameObject, GrabHook
+from phagocyte_game_server.frames import Frame
+from phagocyte_game_server.gc_control import GCController
+from phagocyte_game_server.latency import LatencyEstimator
+from phagocyte_game_server.load import LoadReporter
+from phagocyte_game_server.memory import MemoryTracker
+from phagocyte_game_server.metrics import Metrics
+from phagocyte_game_server.profiling import Profiler
+from phagocyte_game_server.sockets import advertised_address, listen, read_drops, read_udp_errors
+from phagocyte_game_server.game_objects import Player
+from phagocyte_game_server.world import TICK_INTERVAL, Broadcast, Death, DuplicateNameError, Stats, Win, World
 from phagocyte_game_server.custom_types import address, json_object
 
 
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
 
 
+RESYNC_DATAGRAM_SIZE = 1200  # maximum size of the datagrams of a resynchronization, in bytes, to stay under the MTU
+
+
 def create_logger(name: str, port: int, debug: bool) -> logging.Logger:
     """
     Setup a logger to use for the game server
@@ -74,24 +87,18 @@ def random_color() -> str:
     return "#%06x" % random.randint(0, 0xFFFFFF)
 
 
-def bonus_timeout(player: Player):
-    """ sets the given bonus to None """
-    player.bonus = None
-    player.bonus_callback = None
-
-
-def register(auth_host: str, auth_port: int, **kwargs: Dict) -> str:
+def register(auth_host: str, auth_port: int, interface: str="", advertise: str=None, **kwargs: Dict) -> str:
     """
     registers the game server against the authentication server
 
     :param auth_host: address of the authentication server
     :param auth_port: port of the authentication server
+    :param interface: address to which the server is bound, "" for all interfaces
+    :param advertise: address to give to the players, None to find it locally
     :param kwargs: arguments neeted to register the server
+    :return: the address under which the server was registered
     """
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect(("www.google.com", 80))
-    kwargs["ip"] = s.getsockname()[0]
-    s.close()
+    kwargs["ip"] = advertised_address(auth_host, auth_port, interface, advertise)
 
     r = requests.post("http://{}:{}/games/server".format(auth_host, auth_port), json=kwargs)
 
@@ -106,8 +113,8 @@ class GameProtocol(DatagramProtocol):
     """
     Implementation of the Game protocol for Phagocytes
 
-    This class contains the whole logic of the game and decides what is
-    or not valid in the context of the game
+    This class connects the game, simulated by a World, to the network: it authenticates the players,
+    passes their inputs to the world, steps it at regular intervals and sends the resulting events
 
     :param auth_host: host address of the authentication server
     :param auth_port: port of the authentication server
@@ -123,66 +130,154 @@ class GameProtocol(DatagramProtocol):
     :param min_radius: minimal size a player can have
     :param food_production_rate: rate at which new food appears on the screen
     :param win_size: size after which a player wins
+    :param clock: function giving the current time, in seconds
     """
     death_message = json.dumps({"event": Event.DEATH}).encode("utf-8")
+    error_messages = {code: json.dumps({"event": Event.ERROR, "code": code}).encode("utf-8") for code in Error}
 
     def __init__(self, auth_host: str, auth_port: int, capacity: int, logger: logging.Logger, token: str, port: int,
                  map_height: int, map_width: int, max_speed: int, max_hit_count: int, eat_ratio: float, min_radius: int,
-                 food_production_rate: float, win_size: int):
-        self.players = dict()  # type: Dict[address, Player]
-        self.moves = dict()  # type: Dict[address, Tuple[int, int]]
-        self.deaths = set()  # type: Set[address]
-        self.food = collections.deque()  # type: collections.deque[RandomPositionedGameObject]
-        self.bullets = collections.deque()  # type: collections.deque[Bullet]
-        self.bonuses = collections.deque()  # type: collections.deque[Bonus]
-
-        self.new_bullets = dict()  # type: Dict[address, float]
-
-        self.food_notify_index = 0  # type: int
-        self.bullet_notify_index = 0  # type: int
-        self.new_bullet_id = 0  # type: int
-        self.last_bullet_update = time.time()  # type: int
+                 food_production_rate: float, win_size: int, clock: Callable[[], float]=time.time):
+        self.clock = clock  # type: Callable[[], float]
+        self.world = World(
+            map_height, map_width, max_speed, max_hit_count, eat_ratio, min_radius, food_production_rate, win_size,
+            self.clock()
+        )  # type: World
+
+        self.links = dict()  # type: Dict[address, CongestionController]
+        self.latencies = dict()  # type: Dict[address, LatencyEstimator]
+
+        self.tick = 0  # type: int
+        self.seq = 0  # type: int
+        # time spent in the handlers of the game and handlers that took longer than a tick, for the load reports
+        self.busy = 0  # type: float
+        self.overruns = 0  # type: int
+        self.resyncs = 0  # type: int
+        self.resync_requests = set()  # type: Set[address]
+        self.resync_state = None  # type: Tuple[int, int, int, int]
+        self.resync_datagrams = []  # type: List[List[memoryview]]
 
         self.auth_host = auth_host  # type: str
         self.auth_port = auth_port  # type: int
         self.url = "http://{}:{}".format(self.auth_host, self.auth_port)  # type: str
         self.max_capacity = capacity  # type: int
 
-        self.max_x = map_width  # type: int
-        self.max_y = map_height  # type: int
-        self.default_radius = min_radius  # type: int
-        self.max_speed = max_speed  # type: int
-        self.eat_ratio = eat_ratio  # type: float
-
-        self.food_production_rate = food_production_rate  # type: int
-        self.new_bonuses_ratio = 3  # type: int
-
-        self.max_hit_count = max_hit_count  # type: int
-        self.bonus_time = 10  # type: int
-        self.win_size = win_size  # type: int
-
-        self.last_time = time.time()  # type: int
-
-        self.winning_player = None
-        self.finished = None
+        self.finished_message = None  # type: bytes
 
         self.logger = logger  # type: logging.Logger
         self.closing_call = None
+        self.closed = False  # type: bool
+        self.draining = False  # type: bool
         self.token = token
+        # called instead of stopping the reactor once the game is closed, to host another one
+        self.on_close = None  # type: Callable[[], None]
 
         self.port = port
         self.ip = None
 
-        task.LoopingCall(self.handle_players).start(1 / 30)
-        task.LoopingCall(self.handle_food).start(1 / 30)
-        task.LoopingCall(self.handle_new_bullets).start(1 / 3)
-        task.LoopingCall(self.handle_bullets).start(1 / 30)
-        task.LoopingCall(self.handle_bonuses).start(1 / 30)
-        task.LoopingCall(self.handle_hooks).start(1 / 30)
-        task.LoopingCall(self.handle_disconnects).start(5)
+        self.metrics = Metrics()  # type: Metrics
+        self.metrics.register("players", self.players_metrics)
+        self.metrics.register("entities", self.entities_metrics)
+
+        self.tick_interval = TICK_INTERVAL  # type: float
+        # controller of the garbage collector, running at the end of the ticks
+        self.gc_controller = None  # type: GCController
+        self.tick_loops = [
+            task.LoopingCall(self.timed, handler) for handler in [
+                self.handle_players, self.handle_food, self.handle_bullets, self.handle_bonuses, self.handle_hooks
+            ]
+        ]  # type: List[task.LoopingCall]
+        for loop in self.tick_loops:
+            loop.start(self.tick_interval)
+
+        task.LoopingCall(self.timed, self.handle_new_bullets).start(1 / 3)
+        task.LoopingCall(self.timed, self.handle_disconnects).start(5)
+        task.LoopingCall(self.handle_sync).start(1, now=False)
+        task.LoopingCall(self.handle_pings).start(1)
+        task.LoopingCall(self.report_metrics).start(30, now=False)
 
         task.LoopingCall(self.check_usage).start(60)
 
+    @property
+    def players(self) -> Dict[address, Player]:
+        """ players currently in the game, by address """
+        return self.world.players
+
+    @property
+    def finished(self) -> bool:
+        """ whether the game is finished or not """
+        return self.world.finished
+
+    def reset(self, capacity: int, token: str, map_height: int, map_width: int, max_speed: int, max_hit_count: int,
+              eat_ratio: float, min_radius: int, food_production_rate: float, win_size: int):
+        """
+        clears the game to host a new one, with new parameters, without starting a new process
+
+        :param capacity: max capacity of the server
+        :param token: the token used to authenticate the server
+        :param map_height: height of the map to handle
+        :param map_width: width of the map to handle
+        :param max_speed: maximum speed achievable by the players
+        :param max_hit_count: number of hits to take before loosing some matter
+        :param eat_ratio: size after which a player can eat another
+        :param min_radius: minimal size a player can have
+        :param food_production_rate: rate at which new food appears on the screen
+        :param win_size: size after which a player wins
+        """
+        if self.closing_call is not None and self.closing_call.active():
+            self.closing_call.cancel()
+
+        self.world = World(
+            map_height, map_width, max_speed, max_hit_count, eat_ratio, min_radius, food_production_rate, win_size,
+            self.clock()
+        )
+
+        self.links.clear()
+        self.latencies.clear()
+        self.resync_requests.clear()
+        self.resync_state = None
+        self.resync_datagrams = []
+
+        self.max_capacity = capacity
+        self.token = token
+        self.finished_message = None
+        self.closing_call = None
+        self.closed = False
+        self.draining = False
+        self.set_tick_interval(TICK_INTERVAL)
+
+    def set_tick_interval(self, interval: float):
+        """
+        changes the time between two ticks of the game, from the next tick. The simulation and the garbage
+        collector follow it, for the game to go at the same pace
+
+        :param interval: new time between two ticks, in seconds
+        """
+        self.tick_interval = interval
+        self.world.tick_interval = interval
+        for loop in self.tick_loops:
+            loop.interval = interval
+
+        if self.gc_controller is not None:
+            self.gc_controller.set_interval(interval)
+
+    def drain(self):
+        """
+        stops accepting new players, the game closes once the last one left
+        """
+        self.draining = True
+        if len(self.players) == 0:
+            self.close()
+
+    def stop(self):
+        """
+        closes the game right away, even if players are still in it
+        """
+        if self.closing_call is not None and self.closing_call.active():
+            self.closing_call.cancel()
+        self.closing_call = None
+        self.close()
+
     def authenticate(self, token: str) -> Tuple[str, str, str]:
         """
         tries to authenticate the user against the authentication server
@@ -206,12 +301,12 @@ class GameProtocol(DatagramProtocol):
         """
         if data.get("event") != Event.TOKEN:
             self.logger.warning("User from {addr} not registered tried to gain access".format(addr=addr))
-            self.send_to(addr, dict(event=Event.ERROR, code=Error.NO_TOKEN))
+            self.transport.write(self.error_messages[Error.NO_TOKEN], addr)
             return
 
-        elif len(self.players) >= self.max_capacity:
+        elif len(self.players) >= self.max_capacity or self.draining:
             self.logger.info("Refusing user due to too much people")
-            self.send_to(addr, dict(event=Event.ERROR, code=Error.MAX_CAPACITY))
+            self.transport.write(self.error_messages[Error.MAX_CAPACITY], addr)
             return
 
         elif data.get("token") is None:
@@ -226,27 +321,45 @@ class GameProtocol(DatagramProtocol):
                 self.send_to(addr, dict(event=Event.ERROR, error=e.msg["error"], code=Error.TOKEN_INVALID))
                 return
 
-        for player in self.players.values():
-            if player.name == name:
-                if time.time() - player.timestamp < 15:
-                    self.logger.warning("User from {addr} tried to connect as a user already playing".format(addr=addr))
-                    self.send_to(addr, dict(event=Event.ERROR, code=Error.DUPLICATE_USERNAME))
-                    return
+        try:
+            info = self.world.join(addr, uid, name, color, self.clock())
+        except DuplicateNameError:
+            self.logger.warning("User from {addr} tried to connect as a user already playing".format(addr=addr))
+            self.transport.write(self.error_messages[Error.DUPLICATE_USERNAME], addr)
+            return
 
-                else:
-                    client = player
-                    self.logger.warning("User {name} was reconnected".format(name=name))
-                    break
-        else:
-            self.logger.debug("Registered new user {name}".format(name=name))
-            client = Player(uid, name, color, self.default_radius, self.max_x, self.max_y)
+        self.logger.debug("Registered user {name}".format(name=name))
+        self.send_to(addr, info)
+        self.resync_requests.add(addr)
+
+        self.links[addr] = CongestionController()
+        self.latencies[addr] = LatencyEstimator()
 
-        self.send_to(addr, dict(
-            event=Event.GAME_INFO, name=name, max_x=self.max_x, max_y=self.max_y, win_size=self.win_size,
-            x=client.x, y=client.y, color=color, size=client.size, others=[p.to_json() for p in self.players.values()]
-        ))
+    def resume(self, data: json_object, addr: address):
+        """
+        gives a player back their disc after a network blip, with the token they got when joining,
+        sending them only what they need to catch up
 
-        self.players[addr] = client
+        :param data: data got from the client
+        :param addr: client address, which may have changed since the player joined
+        """
+        resumed = self.world.resume(data.get("token"), addr, self.clock())
+
+        if resumed is None:
+            self.transport.write(self.error_messages[Error.RESUME_INVALID], addr)
+            return
+
+        old_addr, catch_up = resumed
+        self.logger.debug("Resumed session of {old} from {addr}".format(old=old_addr, addr=addr))
+
+        if old_addr != addr:
+            # the path to the player changed, what we measured on the old one doesn't apply anymore
+            self.links.pop(old_addr, None)
+            self.latencies.pop(old_addr, None)
+            self.links[addr] = CongestionController()
+            self.latencies[addr] = LatencyEstimator()
+
+        self.send_to(addr, catch_up)
 
     def datagramReceived(self, datagram: bytes, addr: address):
         """
@@ -261,33 +374,56 @@ class GameProtocol(DatagramProtocol):
         except json.decoder.JSONDecodeError:
             self.logger.warning("Invalid json received : '{json}'".format(json=datagram.decode("utf-8")))
         else:
-            if self.finished:
-                if data["event"] == Event.FINISHED:
-                    self.players.pop(addr, None)
-                    if len(self.players) == 0:
-                        self.close()
-                else:
-                    self.send_to(addr, dict(event=Event.FINISHED, win=self.winning_player))
-            elif self.players.get(addr) is None:
-                if addr in self.deaths:
-                    if data["event"] == Event.DEATH:
-                        self.deaths.remove(addr)
-                    else:
-                        self.transport.write(self.death_message, addr)
+            self.handle_data(data, addr)
+
+    def handle_data(self, data: json_object, addr: address):
+        """
+        dispatches the decoded data received from a client to the correct handler
+
+        :param data: data received from the client
+        :param addr: client address
+        """
+        if self.finished:
+            if data["event"] == Event.FINISHED:
+                self.world.leave(addr)
+                if len(self.players) == 0:
+                    self.close()
+            else:
+                self.transport.write(self.finished_message, addr)
+        elif self.players.get(addr) is None:
+            if addr in self.world.deaths:
+                if data["event"] == Event.DEATH:
+                    del self.world.deaths[addr]
                 else:
-                    self.register(data, addr)
-            elif data["event"] == Event.STATE:
-                self.moves[addr] = data["position"]
-            elif data["event"] == Event.BULLETS:
-                self.new_bullets[addr] = data["angle"]
-            elif data["event"] == Event.HOOK:
-                player = self.players[addr]
-                if player.hook is None:
-                    player.hook = GrabHook(player, data["angle"])
-            elif data["event"] == "ALIVE":
-                self.players[addr].timestamp = time.time()
+                    self.transport.write(self.death_message, addr)
+            elif data["event"] == Event.RESUME:
+                self.resume(data, addr)
             else:
-                logging.error("Received invalid action: {json}".format(json=data))
+                self.register(data, addr)
+        elif data["event"] == Event.RESUME:
+            self.resume(data, addr)
+        elif data["event"] == Event.INPUT:
+            self.world.push_input(addr, data["s"], data["d"])
+        elif data["event"] == Event.STATE:
+            self.world.move(addr, data["position"])
+        elif data["event"] == Event.ACK:
+            link = self.links.get(addr)
+            if link is not None:
+                link.on_ack(data["seq"], data.get("mask", 0), data.get("delay", 0), self.clock())
+        elif data["event"] == Event.PONG:
+            latency = self.latencies.get(addr)
+            if latency is not None:
+                self.metrics.histogram("rtt").observe(latency.on_pong(data["t"], data["ct"], self.clock()))
+        elif data["event"] == Event.RESYNC:
+            self.resync_requests.add(addr)
+        elif data["event"] == Event.BULLETS:
+            self.world.shoot(addr, data["angle"])
+        elif data["event"] == Event.HOOK:
+            self.world.throw_hook(addr, data["angle"])
+        elif data["event"] == "ALIVE":
+            self.world.keep_alive(addr, self.clock())
+        else:
+            logging.error("Received invalid action: {json}".format(json=data))
 
     def send_to(self, addr: address, data: json_object):
         """
@@ -298,354 +434,251 @@ class GameProtocol(DatagramProtocol):
         """
         self.transport.write(json.dumps(data).encode("utf8"), addr)
 
-    def send_all_players(self, data: json_object):
+    def send_segments(self, addr: address, segments: List[memoryview]):
         """
-        Sends the given data to all users connected
+        Sends a datagram made of the given segments to the user identified by the given address
 
-        :param data: data to send
+        :param addr: address to which to send the data
+        :param segments: slices of buffers forming the datagram
         """
-        json_data = json.dumps(data).encode("utf-8")
-        for client in self.players.keys():
-            self.transport.write(json_data, addr=client)
+        if len(segments) == 1:
+            self.transport.write(segments[0], addr)
+        else:
+            self.transport.writeSequence(segments, addr)
 
-    def handle_new_bullets(self):
+    def send_all_players(self, header: json_object, field: str, records: List[json_object], droppable: bool=False):
         """
-        handles the addition of new bullets
-        """
-        for addr, angle in self.new_bullets.items():
-            player = self.players.get(addr)
-            if player is not None and player.size > player.initial_size:
-                self.bullets.append(Bullet(angle, player))
+        Sends the given records to all users connected
 
-        self.new_bullets = dict()  # type: Dict[address, float]
+        Records are encoded once in a frame shared by all players. Each frame is given a sequence
+        number that clients acknowledge. Droppable frames, that only carry state that will be sent
+        again on a later tick, are skipped or truncated for clients whose link is congested.
 
-    def handle_bullets(self):
-        """
-        handles new bullets, checks for collisions and updates results
+        :param header: data to send along with the records
+        :param field: name of the field under which the records are sent
+        :param records: records to send
+        :param droppable: whether congested clients can skip part of this message or not
         """
-        step = 50
-        new_time = time.time()
-        dt = new_time - self.last_bullet_update
+        header["seq"] = self.seq
+        targets = []  # type: List[Tuple[address, int, int]]
+        now = self.clock()
 
-        for i in range(0, len(self.bullets), step):
-            data_to_send = []
-            deleted_bullets = []
-            max_boundary = min(step, len(self.bullets) - step * i)
-
-            for j in range(max_boundary):
-                has_hit = False
-
-                bullet = self.bullets.popleft()
-                bullet.x = min(self.max_x - bullet.radius, max(bullet.radius, bullet.x + bullet.speed_x * dt))
-                bullet.y = min(self.max_y - bullet.radius, max(bullet.radius, bullet.y + bullet.speed_y * dt))
-
-                for player in self.players.values():
-                    if player != bullet.player and player.collides_with(bullet):
-                        has_hit = True
-
-                        if player.bonus == BonusTypes.SHIELD:
-                            deleted_bullets.append(bullet.uid)
-                            break
-
-                        player.hit_count += ceil((bullet.size / 10)**.5)
-                        if player.hit_count >= self.max_hit_count:
-                            player.hit_count = 0
-
-                            if player.size >= player.initial_size:
-                                lost_size = player.size / 3
-                                player.matter_lost += lost_size
-                                player.size = max(player.initial_size, player.size - lost_size)
-                                player.radius = player.size / 2
-                                self.throw_food(int(lost_size), player.x, player.y, player.radius)
-
-                        deleted_bullets.append(bullet.uid)
-                        break
-
-                if not has_hit and not (bullet.x == self.max_x - bullet.radius or bullet.x == bullet.radius or
-                                        bullet.y == self.max_y - bullet.radius or bullet.y == bullet.radius):
-                    self.bullets.append(bullet)
-
-                data_to_send.append(bullet.to_json())
+        for client in self.players.keys():
+            link = self.links.get(client)
 
-            self.send_all_players(dict(event=Event.BULLETS, bullets=data_to_send, deleted=deleted_bullets))
+            if link is None:
+                targets.append((client, 0, None))
+                continue
+            elif droppable:
+                if not link.should_send(self.tick):
+                    continue
+                start, count = link.payload(len(records))
+            else:
+                start, count = 0, None
 
-        self.last_bullet_update = new_time
+            link.on_send(self.seq, now)
+            targets.append((client, start, count))
 
-    def throw_food(self, size_to_dispatch: float, player_x: float, player_y: float, player_radius: float):
-        """
-        Throwss some food around the player
+        self.send_frame(header, field, records, targets)
+        self.seq += 1
 
-        :param size_to_dispatch: quantity of food to throw
-        :param player_x: position of the player on the x axis
-        :param player_y: position of the player on the y axis
-        :param player_radius: radius of the player
+    def send_frame(self, header: json_object, field: str, records: List[json_object],
+                   targets: List[Tuple[address, int, int]]):
         """
-        while size_to_dispatch > 10:
-            size = random.randint(10, size_to_dispatch)
-            size_to_dispatch -= size
-            radius = size / 2
-            f = RoundGameObject(radius)
-            f.x = max(radius, (min(self.max_x - radius, random.randint(
-                int(player_x - 5 * player_radius), int(5 * player_radius + player_x)
-            ))))
-            f.y = max(radius, (min(self.max_y - radius, random.randint(
-                int(player_y - 5 * player_radius), int(5 * player_radius + player_y)
-            ))))
-            self.food.appendleft(f)
+        Encodes the records once in a frame and sends it to the given targets
 
-    def handle_players(self):
+        :param header: data to send along with the records
+        :param field: name of the field under which the records are sent
+        :param records: records to send
+        :param targets: address of each recipient, with the index of the first record and the number of
+                        records to send it, None for all of them
         """
-        checks moves from all the players and handle collisions between them
-        """
-        data = []  # type: List[json_object]
+        frame = Frame(header, field, records)
 
-        for addr, update in self.moves.items():
-            if update is None:
-                continue
+        for addr, start, count in targets:
+            self.send_segments(addr, frame.segments(start, count))
 
-            timestamp = time.time()
-            player = self.players[addr]
-
-            factor_x = factor_y = 0
+    def send_resyncs(self):
+        """
+        Sends all the food and bonuses of the game to the players who asked for them since the last tick,
+        in datagrams of at most RESYNC_DATAGRAM_SIZE bytes
 
-            delta_x = update[0] - player.x
-            delta_y = update[1] - player.y
-            speed_x = abs(delta_x / (timestamp - player.timestamp))
-            speed_y = abs(delta_y / (timestamp - player.timestamp))
+        Each chunk tells the total number of records of its kind, for the player to know when it got all of
+        them. Chunks that are lost will be noticed on the next synchronization, which triggers a new resync.
+        Players who missed some events usually notice it on the same synchronization, their requests are
+        thus answered together. The datagrams are encoded once, and kept until the food or bonuses change.
+        """
+        targets = [addr for addr in self.resync_requests if addr in self.players]
+        self.resync_requests = set()  # type: Set[address]
 
-            max_speed = player.max_speed * 1.5 if player.bonus == BonusTypes.SPEEDUP else player.max_speed
+        if not targets:
+            return
 
-            if speed_x > max_speed:
-                factor_x = delta_x * max_speed / speed_x
-                player.x = min(self.max_x - player.radius, max(
-                    player.radius, player.x + factor_x
-                ))
-            else:
-                player.x = min(self.max_x - player.radius, max(player.radius, update[0]))
+        state = (len(self.world.food), self.world.food_checksum, len(self.world.bonuses), self.world.bonuses_checksum)
 
-            if speed_y > max_speed:
-                factor_y = delta_y * max_speed / speed_y
-                player.y = min(self.max_y - player.radius, max(
-                    player.radius, player.y + factor_y
-                ))
-            else:
-                player.y = min(self.max_y - player.radius, max(player.radius, update[1]))
+        if state != self.resync_state:
+            self.resyncs += 1
+            self.resync_state = state
+            self.resync_datagrams = [
+                segments
+                for field, records in self.world.snapshot().items()
+                for segments in Frame(
+                    dict(event=Event.RESYNC, id=self.resyncs, kind=field, total=len(records)), field, records
+                ).chunks(RESYNC_DATAGRAM_SIZE)
+            ]
 
-            _json = player.to_json()
-            if factor_x or factor_y or player.grabbed_x or player.grabbed_y:
-                _json["dirty"] = (factor_x + player.grabbed_x - delta_x, factor_y + player.grabbed_y - delta_y)
-                player.grabbed_x = player.grabbed_y = 0
+        for addr in targets:
+            for segments in self.resync_datagrams:
+                self.send_segments(addr, segments)
 
-            data.append(_json)
-            self.moves[addr] = None
-            player.timestamp = timestamp
+    def post_stats(self, uid: str, stats: json_object):
+        """
+        saves the statistics of a player on the authentication server
 
-        deaths = set()  # type: Set[address]
+        :param uid: unique id of the player
+        :param stats: statistics to save
+        """
+        stats["token"] = self.token
+        try:
+            requests.post("{}/account/{}".format(self.url, uid), json=stats)
+        except Exception as e:
+            self.logger.error("Couldn't post stats for player, got " + str(e))
 
-        for eater_addr, eater in self.players.items():
-            for eaten_addr, eaten in self.players.items():
-                if eaten_addr in deaths or eater_addr in deaths:
-                    continue
+    def dispatch(self, events: List):
+        """
+        acts upon the events returned by the world
 
-                if eaten.size > eater.size * self.eat_ratio:
-                    # the eaten is bigger than the eater, let's inverse roles
-                    eater, eaten = eaten, eater
-                    eater_addr, eaten_addr = eaten_addr, eater_addr
-                elif eater.size < eaten.size * self.eat_ratio:
-                    # eater is not big enough to eat the eaten, we go on
-                    continue
+        :param events: events to handle
+        """
+        for event in events:
+            if isinstance(event, Broadcast):
+                self.send_all_players(event.header, event.field, event.records, droppable=event.droppable)
+            elif isinstance(event, Death):
+                self.transport.write(self.death_message, addr=event.addr)
+            elif isinstance(event, Stats):
+                self.post_stats(event.uid, event.stats)
+            elif isinstance(event, Win):
+                self.finished_message = json.dumps(dict(event=Event.FINISHED, win=event.name)).encode("utf-8")
+                for addr in self.players.keys():
+                    self.transport.write(self.finished_message, addr)
 
-                if eater.collides_with(eaten):
-                    eater.update_size(eaten)
-                    deaths.add(eaten_addr)
+    def timed(self, handler: Callable[[], None]):
+        """
+        runs a handler of the game, reporting its duration in the tick histograms
 
-                    if eaten.uid is not None:
-                        try:
-                            stats = eaten.get_stats(died=True)
-                            stats["token"] = self.token
-                            requests.post(
-                                "{}/account/{}".format(self.url, eaten.uid),
-                                json=stats
-                            )
-                        except Exception as e:
-                            self.logger.error("Couldn't post stats for player, got" + str(e))
+        :param handler: handler to run
+        """
+        start = time.perf_counter()
+        handler()
+        elapsed = time.perf_counter() - start
+        self.metrics.histogram("tick." + handler.__name__).observe(elapsed)
 
-                    if eater.size > self.win_size:
-                        self.win(eater)
+        self.busy += elapsed
+        if elapsed > self.tick_interval:
+            self.overruns += 1
 
-        corpses = []
-        for death in deaths:
-            corpses.append(self.players.pop(death).name)
-            self.transport.write(self.death_message, addr=death)
+    def handle_new_bullets(self):
+        """
+        handles the addition of new bullets
+        """
+        self.dispatch(self.world.step_new_bullets(self.clock()))
 
-        self.deaths |= deaths  # add the users dead this turn to the list of dead
+    def handle_bullets(self):
+        """
+        handles new bullets, checks for collisions and updates results
+        """
+        self.dispatch(self.world.step_bullets(self.clock()))
 
-        if len(data) or len(corpses):
-            self.send_all_players(dict(event=Event.STATE, updates=data, deaths=corpses))
+    def handle_players(self):
+        """
+        checks moves from all the players and handle collisions between them
+        """
+        self.tick += 1
+        self.dispatch(self.world.step_players(self.clock()))
 
     def handle_food(self):
         """
-        randomly adds new food and checks for collisions against all players
+        randomly adds new food, checks for collisions against all players and answers the requests
+        for resynchronization
         """
-        deletions = []  # type: json_object
-        food_to_send = []  # type: json_object
-
-        if random.randrange(100) < self.food_production_rate and len(self.food) < 50 + 50 * len(self.players)**1.1:
-            self.food.appendleft(RandomPositionedGameObject(random.randint(5, 25), self.max_x, self.max_y))
-
-        for i in range(min(len(self.food), 70)):
-            food = self.food.popleft()
-            for player in self.players.values():
-                if player.collides_with(food):
-                    player.update_size(food)
-                    deletions.append(food.to_json())
-                    if player.size > self.win_size:
-                        self.win(player)
-                    break
-            else:
-                self.food.append(food)
-                food_to_send.append(food.to_json())
-
-        self.send_all_players(dict(event=Event.FOOD, food=food_to_send, deleted=deletions))
+        self.dispatch(self.world.step_food(self.clock()))
+        self.send_resyncs()
 
     def handle_bonuses(self):
         """
         randomly adds new bonuses in the game and checks for collisions against all players
         """
-        deletions = []  # type: json_object
-        bonuses_to_send = []  # type: json_object
-
-        if random.randrange(1000) < self.new_bonuses_ratio and len(self.bonuses) < 5 * len(self.players) ** 1.1:
-            self.bonuses.append(Bonus(self.max_x, self.max_y))
-
-        for i in range(min(len(self.bonuses), 70)):
-            bonus = self.bonuses.popleft()
-            for player in self.players.values():
-                if player.collides_with(bonus):
-                    if player.bonus_callback is not None:
-                        player.bonus_callback.cancel()
-
-                    player.bonus = bonus.bonus
-                    player.bonus_callback = reactor.callLater(10, bonus_timeout, player)
-                    deletions.append(bonus.to_json())
-                    player.bonuses_taken += 1
-                    break
-            else:
-                self.bonuses.append(bonus)
-                bonuses_to_send.append(bonus.to_json())
-
-        self.send_all_players(dict(event=Event.BONUS, bonus=bonuses_to_send, deleted=deletions))
+        self.dispatch(self.world.step_bonuses(self.clock()))
 
     def handle_hooks(self):
         """
         handles the movements and throwing of grab hooks
         """
-        for player1 in self.players.values():
-            hook = player1.hook
-            if hook is None:
-                continue
-            elif hook.hooked_player is None:
-                # we need to find if a player is hit by the hook
-                for player2 in self.players.values():
-                    if player2 == player1:
-                        continue
-
-                    if player2.collides_with(hook):
-                        hook.hooked_player = player2
-                        player1.successful_hooks += 1
-                        break
-
-                else:
-                    hook.x = max(0, min(self.max_x, hook.x + 2 * player1.initial_max_speed * hook.ratio_x * (1 / 30)))
-                    hook.y = max(0, min(self.max_y, hook.y + 2 * player1.initial_max_speed * hook.ratio_y * (1 / 30)))
-
-                    if (hook.x - player1.x) ** 2 + (hook.y - player1.y) ** 2 >= (2 * player1.size) ** 2:
-                        player1.hook = None
-
-            else:
-                # we need to move the players closer from each other
-                player2 = hook.hooked_player
+        self.dispatch(self.world.step_hooks())
 
-                move_ratio1 = player1.size / (player1.size + player2.size)
-                move_ratio2 = 1 - move_ratio1
-
-                total_movement = (player1.max_speed + player2.max_speed) / 30
+    def handle_disconnects(self):
+        """
+        handles all users that were not connected for too long
+        """
+        events = self.world.step_disconnects(self.clock())
 
-                x_delta = player1.x - player2.x
-                y_delta = player1.y - player2.y
+        for addr in [addr for addr in self.links if addr not in self.players]:
+            del self.links[addr]
+            self.latencies.pop(addr, None)
 
-                x_ratio = abs(x_delta) / (abs(x_delta) + abs(y_delta))
-                y_ratio = 1 - x_ratio
+        self.dispatch(events)
 
-                if x_delta > 0:
-                    movement_x = min(total_movement * x_ratio, x_delta)
-                else:
-                    movement_x = max(-total_movement * x_ratio, x_delta)
-
-                if y_delta > 0:
-                    movement_y = min(total_movement * y_ratio, y_delta)
-                else:
-                    movement_y = max(-total_movement * y_ratio, y_delta)
+        if len(self.players) == 0 and (self.finished or self.draining):
+            self.close()
 
-                player1.grabbed_x -= movement_x * move_ratio1
-                player1.grabbed_y -= movement_y * move_ratio1
+    def handle_sync(self):
+        """
+        sends the checksums of the food and bonuses, for players to detect the spawns and despawns they missed
+        """
+        self.dispatch(self.world.step_sync())
 
-                player2.grabbed_x += movement_x * move_ratio2
-                player2.grabbed_y += movement_y * move_ratio2
+    def handle_pings(self):
+        """
+        pings all players to measure their latency, telling them the latency measured so far
+        """
+        now = self.clock()
 
-                hook.moves += 1
-                if hook.moves >= 15:
-                    player1.hook = None
-                else:
-                    hook.x = player2.x
-                    hook.y = player2.y
+        for addr in self.players.keys():
+            latency = self.latencies.get(addr)
+            if latency is not None:
+                self.send_to(addr, dict(event=Event.PING, t=now, rtt=latency.rtt, jitter=latency.jitter))
 
-    def handle_disconnects(self):
-        """
-        handles all users that were not connected for too long
+    def players_metrics(self) -> json_object:
         """
-        alives = []
-        deads = []
+        get the metrics about each player connected
 
-        now = time.time()
+        :return: latency and link state of each player, by name
+        """
+        report = dict()
 
         for addr, player in self.players.items():
-            if now - player.timestamp > 60:
-                deads.append(addr)
-            else:
-                alives.append(player.to_json())
+            latency = self.latencies.get(addr)
+            link = self.links.get(addr)
+            report[player.name] = {
+                "latency": latency.to_json() if latency is not None else None,
+                "link": link.to_json() if link is not None else None,
+            }
 
-        for dead in deads:
-            self.players.pop(dead)
+        return report
 
-        self.send_all_players(dict(event=Event.ALIVE, alives=alives))
-
-        if len(self.players) == 0 and self.finished:
-            self.close()
-
-    def win(self, winner: Player):
+    def entities_metrics(self) -> json_object:
         """
-        notify all players that a player has won
+        get the number of entries in each container of the node, to track the memory used
 
-        :param winner: player that won
+        :return: size of each container, by name
         """
-        self.finished = True
-        self.winning_player = winner.name
-
-        self.send_all_players(dict(event=Event.FINISHED, win=winner.name))
+        return dict(self.world.sizes(), links=len(self.links), latencies=len(self.latencies))
 
-        for player in self.players.values():
-            if player.uid is None:
-                continue
-            try:
-                stats = player.get_stats(won=(player == winner))
-                stats["token"] = self.token
-                requests.post(
-                    "{}/account/{}".format(self.url, player.uid),
-                    json=stats
-                )
-            except Exception as e:
-                self.logger.error("Couldn't log information for player, got " + str(e))
+    def report_metrics(self):
+        """
+        logs the metrics of the node, resetting the histograms
+        """
+        self.logger.info("metrics: {}".format(json.dumps(self.metrics.to_json(reset=True))))
 
     def check_usage(self):
         """
@@ -665,7 +698,10 @@ class GameProtocol(DatagramProtocol):
             self.closing_call.cancel()
             self.closing_call = None
             return
+        elif self.closed:
+            return
 
+        self.closed = True
         r = requests.delete(
             "http://{}:{}/games/server".format(self.auth_host, self.auth_port),
             json=dict(token=self.token, port=self.port, ip=self.ip)
@@ -674,13 +710,19 @@ class GameProtocol(DatagramProtocol):
         if r.status_code != requests.codes.ok:
             self.logger.error("Couldn't unregister successfully")
 
-        if reactor.running:
+        if self.on_close is not None:
+            self.on_close()
+        elif reactor.running:
             reactor.stop()
 
         atexit.unregister(self.close)
 
 
-def runserver(port: int, auth_host: str, auth_port: int, name: str, capacity: int, debug: bool, **kwargs):
+def runserver(port: int, auth_host: str, auth_port: int, name: str, capacity: int, debug: bool, batch_io: bool,
+              listeners: int, rcvbuf: int, sndbuf: int, split: bool, profile_dir: str, tracemalloc: int,
+              gc_freeze: bool, gc_thresholds: Tuple[int, int, int], gc_manual: bool, interface: str="",
+              advertise: str=None, next_game: Callable[[], json_object]=None, report_load: bool=False,
+              control: str=None, **kwargs):
     """
     launches the game server
 
@@ -690,13 +732,37 @@ def runserver(port: int, auth_host: str, auth_port: int, name: str, capacity: in
     :param name: name of the game server
     :param capacity: capacity of the game server
     :param debug: whether to turn on debugging or not
+    :param batch_io: whether to send and receive datagrams with batched system calls, on Linux
+    :param listeners: number of sockets sharing the port, with SO_REUSEPORT
+    :param rcvbuf: size of the kernel receive buffer of each socket, None for the system default
+    :param sndbuf: size of the kernel send buffer of each socket, None for the system default
+    :param split: whether to run the network I/O and the simulation in separate processes or not
+    :param profile_dir: directory in which to write the profiles taken on demand, None for the temporary directory
+    :param tracemalloc: number of lines of code allocating the most memory to report, 0 to not trace allocations
+    :param gc_freeze: whether to exclude the objects alive after startup from the garbage collections or not
+    :param gc_thresholds: thresholds of the generations of the garbage collector, None to keep the default ones
+    :param gc_manual: whether to run the garbage collections at the end of the ticks or not
+    :param interface: address of the interface on which to listen, "" for all of them
+    :param advertise: address to give to the players, None to find it locally
+    :param next_game: blocking function giving the arguments of the next game to host once this one is closed,
+                      or None when there is none. None to stop after the first game, as in split mode
+    :param report_load: whether to report the load of the node on the standard output, for its manager
+    :param control: path of the Unix domain socket on which to listen for commands, None to not listen
     :param kwargs: additional arguments to pass to the GameProtocol
     """
+    if split:
+        from phagocyte_game_server.split import run_split_node
+        run_split_node(port, auth_host, auth_port, name, capacity, debug, batch_io, listeners, rcvbuf, sndbuf,
+                       profile_dir, tracemalloc, gc_freeze, gc_thresholds, gc_manual, interface=interface,
+                       advertise=advertise, report_load=report_load, control=control, **kwargs)
+        return
+
     logger = create_logger(name, port, debug)
 
     try:
         game_protocol = GameProtocol(auth_host, auth_port, capacity, logger, port=port, **kwargs)
-        reactor.listenUDP(port, game_protocol)
+        listening_ports = listen(port, game_protocol, listeners, rcvbuf, sndbuf, batched=batch_io,
+                                 interface=interface)
     except CannotListenError as e:
         if isinstance(e.socketError, PermissionError):
             logger.error("Permission denied. Do you have the right to open port {} ?".format(port))
@@ -705,8 +771,56 @@ def runserver(port: int, auth_host: str, auth_port: int, name: str, capacity: in
         else:
             raise e.socketError
     else:
+        if isinstance(listening_ports[0], BatchedPort):
+            game_protocol.metrics.register("io", lambda: [p.to_json() for p in listening_ports])
+        elif batch_io:
+            logger.warning("Batched system calls are not available on this platform")
+
+        game_protocol.metrics.register("udp", lambda: dict(read_drops(port), **read_udp_errors()))
+        game_protocol.metrics.register("memory", MemoryTracker(tracemalloc).to_json)
+
+        gc_controller = GCController(game_protocol.metrics, thresholds=gc_thresholds, manual=gc_manual)
+        gc_controller.install()
+        game_protocol.gc_controller = gc_controller
+        if gc_freeze:
+            reactor.callWhenRunning(gc_controller.freeze)
+
+        Profiler(profile_dir or tempfile.gettempdir(), "{}-{}".format(name, port), logger).install()
+
+        if report_load:
+            LoadReporter(game_protocol).install()
+
+        if control is not None:
+            listen_control(control, game_protocol)
+
+        def host_next_game(game: json_object):
+            """ resets the node for the next game, or stops it if there is none """
+            if game is None:
+                reactor.stop()
+                return
+
+            parameters = {key: game[key] for key in kwargs}
+            game_protocol.reset(game["capacity"], **parameters)
+            game_protocol.ip = register(
+                auth_host, auth_port, interface, advertise, name=game["name"], capacity=game["capacity"], port=port,
+                **parameters
+            )
+            logger.info("hosting game {}".format(game["name"]))
+
+        def stop_node(failure: Failure):
+            """ stops the node when the next game couldn't be hosted, for its manager to replace it """
+            logger.error("Couldn't host the next game, stopping\n{}".format(failure.getTraceback()))
+            reactor.stop()
+
+        def wait_next_game():
+            """ waits for the next game in a thread, not to block the reactor meanwhile """
+            threads.deferToThread(next_game).addCallback(host_next_game).addErrback(stop_node)
+
+        if next_game is not None:
+            game_protocol.on_close = wait_next_game
+
         logger.info("server launched")
-        ip = register(auth_host, auth_port, name=name, capacity=capacity, port=port, **kwargs)
+        ip = register(auth_host, auth_port, interface, advertise, name=name, capacity=capacity, port=port, **kwargs)
         game_protocol.ip = ip
         reactor.run()
 
@@ -0,0 +1,326 @@
+"""
+Batched UDP transport for Linux
+
+The default Twisted UDP port makes one system call per datagram sent or received. This port queues
+the datagrams written during a reactor iteration and sends them all at once with sendmmsg, and reads
+all pending datagrams with recvmmsg. Datagrams made of several segments are sent with scatter/gather
+io, without joining them first.
+
+The system calls are accessed through ctypes, and this port is only available on Linux.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import socket
+import struct
+import sys
+from typing import Dict, List, Tuple
+
+from twisted.internet import reactor, udp
+from twisted.internet.error import MessageLengthError
+
+from phagocyte_game_server.custom_types import address
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+MSG_DONTWAIT = 0x40
+SOCKADDR_SIZE = 128  # size of a struct sockaddr_storage
+
+
+class IOVec(ctypes.Structure):
+    """ struct iovec """
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    """ struct msghdr """
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class MMsgHdr(ctypes.Structure):
+    """ struct mmsghdr """
+    _fields_ = [("msg_hdr", MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def load_libc():
+    """
+    loads the C library if it provides sendmmsg and recvmmsg
+
+    :return: the C library, or None if batched calls are not available
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+libc = load_libc()
+
+
+def pack_address(family: int, addr: address) -> bytes:
+    """
+    transforms the given address to a struct sockaddr
+
+    :param family: family of the socket
+    :param addr: address to transform
+    :return: the sockaddr structure
+    """
+    if family == socket.AF_INET6:
+        return struct.pack("=H", family) + struct.pack("!HI", addr[1], 0) + \
+            socket.inet_pton(socket.AF_INET6, addr[0]) + struct.pack("=I", 0)
+
+    return struct.pack("=H", family) + struct.pack("!H", addr[1]) + socket.inet_aton(addr[0]) + bytes(8)
+
+
+def unpack_address(data: bytes) -> address:
+    """
+    transforms the given struct sockaddr to an address
+
+    :param data: sockaddr structure
+    :return: the address
+    """
+    family, = struct.unpack_from("=H", data)
+    port, = struct.unpack_from("!H", data, 2)
+
+    if family == socket.AF_INET6:
+        return socket.inet_ntop(socket.AF_INET6, data[8:24]), port
+
+    return socket.inet_ntoa(data[4:8]), port
+
+
+class BatchedPort(udp.Port):
+    """
+    UDP port sending and receiving datagrams in batches
+
+    :param batch_size: maximum number of datagrams handled by each system call
+    """
+    def __init__(self, *args, batch_size: int=64, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_size = batch_size  # type: int
+        self.queue = []  # type: List[Tuple[List, address]]
+        self.flush_call = None
+        self.addresses = dict()  # type: Dict[address, bytes]
+
+        self.datagrams_sent = 0  # type: int
+        self.send_calls = 0  # type: int
+        self.datagrams_received = 0  # type: int
+        self.receive_calls = 0  # type: int
+
+        self.messages = (MMsgHdr * batch_size)()
+        self.vectors = (IOVec * batch_size)()
+        self.names = ctypes.create_string_buffer(SOCKADDR_SIZE * batch_size)
+        self.buffers = ctypes.create_string_buffer(self.maxPacketSize * batch_size)
+
+    @staticmethod
+    def available() -> bool:
+        """
+        tells whether batched system calls can be used on this platform
+        """
+        return libc is not None
+
+    def write(self, datagram: bytes, addr: address=None):
+        """
+        queues a datagram, to be sent at the end of the reactor iteration
+
+        :param datagram: datagram to send
+        :param addr: address to which to send it
+        """
+        self.writeSequence([datagram], addr)
+
+    def writeSequence(self, seq: List, addr: address=None):
+        """
+        queues a datagram made of the given segments, to be sent at the end of the reactor iteration
+
+        :param seq: segments of the datagram to send
+        :param addr: address to which to send it
+        """
+        self.queue.append((seq, addr))
+        if self.flush_call is None:
+            self.flush_call = reactor.callLater(0, self.flush)
+
+    def flush(self):
+        """
+        sends all queued datagrams
+        """
+        self.flush_call = None
+        queue, self.queue = self.queue, []
+
+        while queue:
+            batch = queue[:self.batch_size]
+            sent = self.send_batch(batch)
+            queue = queue[sent:]
+
+    def address(self, addr: address) -> bytes:
+        """
+        get the sockaddr structure for the given address, caching it
+
+        :param addr: address to transform
+        """
+        packed = self.addresses.get(addr)
+        if packed is None:
+            if len(self.addresses) > 4096:
+                self.addresses.clear()
+            packed = self.addresses[addr] = pack_address(self.addressFamily, addr)
+        return packed
+
+    def send_batch(self, batch: List[Tuple[List, address]]) -> int:
+        """
+        sends the given datagrams with a single sendmmsg call
+
+        :param batch: datagrams to send, with their destination
+        :return: the number of datagrams handled, sent or dropped on error
+        """
+        keep_alive = []
+        vectors = (IOVec * sum(len(segments) for segments, _ in batch))()
+        vector_index = 0
+
+        for index, (segments, addr) in enumerate(batch):
+            header = self.messages[index].msg_hdr
+            header.msg_iov = ctypes.cast(ctypes.addressof(vectors) + vector_index * ctypes.sizeof(IOVec),
+                                         ctypes.POINTER(IOVec))
+            header.msg_iovlen = len(segments)
+            header.msg_control = None
+            header.msg_controllen = 0
+            header.msg_flags = 0
+
+            for segment in segments:
+                buffer = self.buffer(segment)
+                keep_alive.append(buffer)
+                vectors[vector_index].iov_base = ctypes.cast(buffer, ctypes.c_void_p).value
+                vectors[vector_index].iov_len = len(segment)
+                vector_index += 1
+
+            if addr is None or self._connectedAddr:
+                header.msg_name = None
+                header.msg_namelen = 0
+            else:
+                name = ctypes.c_char_p(self.address(addr))
+                keep_alive.append(name)
+                header.msg_name = ctypes.cast(name, ctypes.c_void_p).value
+                header.msg_namelen = 28 if self.addressFamily == socket.AF_INET6 else 16
+
+        self.send_calls += 1
+        sent = libc.sendmmsg(self.socket.fileno(), self.messages, len(batch), 0)
+
+        if sent >= 0:
+            self.datagrams_sent += sent
+            return max(sent, 1)
+
+        error = ctypes.get_errno()
+        if error == errno.EINTR:
+            return 0
+        elif error == errno.EMSGSIZE:
+            logging.error(str(MessageLengthError("message too long")))
+        elif error not in (errno.ECONNREFUSED, errno.EAGAIN, errno.ENOBUFS):
+            raise OSError(error, "sendmmsg failed")
+
+        # the first datagram of the batch could not be sent, it is dropped
+        return 1
+
+    @staticmethod
+    def buffer(segment) -> ctypes.Array:
+        """
+        get a ctypes object pointing to the given segment, without copying it when possible
+
+        :param segment: bytes-like object
+        """
+        if isinstance(segment, bytes):
+            return ctypes.c_char_p(segment)
+
+        try:
+            return (ctypes.c_char * len(segment)).from_buffer(segment)
+        except TypeError:
+            # read-only buffers cannot be shared with ctypes
+            return ctypes.c_char_p(bytes(segment))
+
+    def doRead(self):
+        """
+        reads all pending datagrams, by batches, and dispatches them to the protocol
+        """
+        read = 0
+        fd = self.socket.fileno()
+
+        for index in range(self.batch_size):
+            header = self.messages[index].msg_hdr
+            self.vectors[index].iov_base = ctypes.addressof(self.buffers) + index * self.maxPacketSize
+            self.vectors[index].iov_len = self.maxPacketSize
+            header.msg_iov = ctypes.pointer(self.vectors[index])
+            header.msg_iovlen = 1
+            header.msg_control = None
+            header.msg_controllen = 0
+
+        while read < self.maxThroughput:
+            for index in range(self.batch_size):
+                header = self.messages[index].msg_hdr
+                header.msg_name = ctypes.addressof(self.names) + index * SOCKADDR_SIZE
+                header.msg_namelen = SOCKADDR_SIZE
+                header.msg_flags = 0
+
+            self.receive_calls += 1
+            received = libc.recvmmsg(fd, self.messages, self.batch_size, MSG_DONTWAIT, None)
+
+            if received < 0:
+                error = ctypes.get_errno()
+                if error in udp._sockErrReadIgnore:
+                    return
+                elif error in udp._sockErrReadRefuse:
+                    if self._connectedAddr:
+                        self.protocol.connectionRefused()
+                    return
+                raise OSError(error, "recvmmsg failed")
+
+            self.datagrams_received += received
+
+            for index in range(received):
+                length = self.messages[index].msg_len
+                data = ctypes.string_at(ctypes.addressof(self.buffers) + index * self.maxPacketSize, length)
+                addr = unpack_address(ctypes.string_at(ctypes.addressof(self.names) + index * SOCKADDR_SIZE,
+                                                       SOCKADDR_SIZE))
+                read += length
+
+                try:
+                    self.protocol.datagramReceived(data, addr)
+                except BaseException:
+                    logging.exception("Error while handling datagram")
+
+            if received < self.batch_size:
+                return
+
+    def stopListening(self):
+        """
+        sends the datagrams still queued before stopping
+        """
+        if self.flush_call is not None:
+            self.flush_call.cancel()
+            self.flush()
+
+        return super().stopListening()
+
+    def to_json(self) -> Dict[str, int]:
+        """ get statistics about the system calls made, for reporting """
+        return {
+            "datagrams_sent": self.datagrams_sent,
+            "send_calls": self.send_calls,
+            "datagrams_received": self.datagrams_received,
+            "receive_calls": self.receive_calls,
+        }
+
@@ -0,0 +1,207 @@
+"""
+Congestion control for the game protocol
+
+Every datagram broadcast by the server carries a sequence number. Clients periodically acknowledge
+the last sequence they received, along with a bitmask of the ones preceding it. This lets the server
+estimate the loss and the round trip time for each client and slow down the updates it sends to
+clients whose link is congested.
+"""
+
+import collections
+from typing import Dict, Tuple
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+ACK_WINDOW = 64  # number of sequence numbers covered by the mask of an acknowledgement
+ACK_MASK = (1 << ACK_WINDOW) - 1
+
+
+class ReceiveWindow:
+    """
+    Keeps track of the sequence numbers received, in order to acknowledge them
+    """
+    __slots__ = ["seq", "mask", "received_at"]
+
+    def __init__(self):
+        self.seq = -1  # type: int
+        self.mask = 0  # type: int
+        self.received_at = 0  # type: float
+
+    def receive(self, seq: int, now: float):
+        """
+        marks the given sequence number as received
+
+        :param seq: sequence number received
+        :param now: time at which it was received
+        """
+        if seq > self.seq:
+            if self.seq >= 0:
+                shift = seq - self.seq
+                self.mask = ((self.mask << shift) | (1 << (shift - 1))) & ACK_MASK
+            self.seq = seq
+            self.received_at = now
+        elif 0 < self.seq - seq <= ACK_WINDOW:
+            self.mask |= 1 << (self.seq - seq - 1)
+
+    def to_json(self, now: float) -> Dict[str, float]:
+        """
+        transforms the window to a dictionary to be sent on the wire
+
+        :param now: time at which the acknowledgement is sent
+        """
+        return {"seq": self.seq, "mask": self.mask, "delay": now - self.received_at}
+
+
+class CongestionController:
+    """
+    Tracks the state of the link to a client and decides how often droppable updates are sent to it,
+    and how many of their records are sent
+
+    The rate follows an additive increase, multiplicative decrease scheme : the interval between
+    two updates doubles when congestion is detected and shrinks by one when the link is healthy.
+    Once the interval reached its maximum, the number of records sent in each update is halved instead.
+
+    :param max_interval: maximum number of ticks between two updates sent to the client
+    :param min_records: minimum number of records to send in each update
+    :param full_records: number of records under which all records are sent again
+    :param loss_threshold: loss ratio above which the link is considered congested
+    :param recovery_threshold: loss ratio under which the link is considered healthy
+    :param rtt_factor: factor of the minimal rtt above which the link is considered congested
+    :param sample_size: number of datagrams acknowledged or lost before re-evaluating the rate
+    """
+    __slots__ = [
+        "max_interval", "loss_threshold", "recovery_threshold", "rtt_factor", "sample_size",
+        "min_records", "full_records", "interval", "max_records", "cursor", "in_flight", "acked", "lost", "rtt",
+        "min_rtt", "loss", "last_ack",
+    ]
+
+    def __init__(self, max_interval: int=8, min_records: int=8, full_records: int=64, loss_threshold: float=0.1,
+                 recovery_threshold: float=0.02, rtt_factor: float=3, sample_size: int=30):
+        self.max_interval = max_interval  # type: int
+        self.min_records = min_records  # type: int
+        self.full_records = full_records  # type: int
+        self.loss_threshold = loss_threshold  # type: float
+        self.recovery_threshold = recovery_threshold  # type: float
+        self.rtt_factor = rtt_factor  # type: float
+        self.sample_size = sample_size  # type: int
+
+        self.interval = 1  # type: int
+        self.max_records = None  # type: int
+        self.cursor = 0  # type: int
+        # sequence numbers are sent in increasing order, the oldest is always first
+        self.in_flight = collections.OrderedDict()  # type: Dict[int, float]
+        self.acked = 0  # type: int
+        self.lost = 0  # type: int
+        self.rtt = None  # type: float
+        self.min_rtt = None  # type: float
+        self.loss = 0  # type: float
+        self.last_ack = -1  # type: int
+
+    def should_send(self, tick: int) -> bool:
+        """
+        tells whether a droppable update should be sent to the client on the given tick
+
+        :param tick: current tick of the game
+        :return: True if the update should be sent
+        """
+        return tick % self.interval == 0
+
+    def payload(self, total: int) -> Tuple[int, int]:
+        """
+        get which records of a droppable update to send to the client. When the payload is limited,
+        successive updates start where the previous one stopped, so that all records end up being sent
+
+        :param total: number of records in the update
+        :return: index of the first record to send and number of records to send, None for all of them
+        """
+        if self.max_records is None or total <= self.max_records:
+            return 0, None
+
+        start = self.cursor % total
+        self.cursor = start + self.max_records
+        return start, self.max_records
+
+    def on_send(self, seq: int, now: float):
+        """
+        registers that the datagram with the given sequence number was sent
+
+        :param seq: sequence number of the datagram
+        :param now: time at which it was sent
+        """
+        self.in_flight[seq] = now
+
+        if len(self.in_flight) > 2 * ACK_WINDOW:
+            # the client stopped acknowledging, everything too old is considered lost. Clients that
+            # never acknowledged anything don't support it and are left at the full rate
+            while len(self.in_flight) > 2 * ACK_WINDOW:
+                self.in_flight.popitem(last=False)
+                if self.last_ack >= 0:
+                    self.lost += 1
+            self.evaluate()
+
+    def on_ack(self, seq: int, mask: int, delay: float, now: float):
+        """
+        handles an acknowledgement received from the client
+
+        :param seq: last sequence number received by the client
+        :param mask: bitmask of the sequence numbers received before seq
+        :param delay: time the client waited between receiving seq and acknowledging it
+        :param now: time at which the acknowledgement was received
+        """
+        if seq <= self.last_ack:
+            return
+
+        self.last_ack = seq
+
+        sent = self.in_flight.get(seq)
+        if sent is not None:
+            sample = max(0, now - sent - delay)
+            self.rtt = sample if self.rtt is None else 0.875 * self.rtt + 0.125 * sample
+            self.min_rtt = sample if self.min_rtt is None else min(self.min_rtt, sample)
+
+        while self.in_flight and next(iter(self.in_flight)) <= seq:
+            pending, _ = self.in_flight.popitem(last=False)
+
+            if pending == seq or (seq - pending <= ACK_WINDOW and mask & (1 << (seq - pending - 1))):
+                self.acked += 1
+            else:
+                self.lost += 1
+
+        self.evaluate()
+
+    def evaluate(self):
+        """
+        updates the sending interval once enough datagrams were acknowledged or lost
+        """
+        total = self.acked + self.lost
+        if total < self.sample_size:
+            return
+
+        self.loss = self.lost / total
+        self.acked = self.lost = 0
+
+        delayed = self.rtt is not None and self.rtt > self.rtt_factor * max(self.min_rtt, 0.01)
+
+        if self.loss > self.loss_threshold or delayed:
+            if self.interval < self.max_interval:
+                self.interval = min(self.max_interval, self.interval * 2)
+            else:
+                self.max_records = max(self.min_records, (self.max_records or self.full_records) // 2)
+        elif self.loss < self.recovery_threshold:
+            if self.max_records is not None:
+                self.max_records *= 2
+                if self.max_records >= self.full_records:
+                    self.max_records = None
+            elif self.interval > 1:
+                self.interval -= 1
+
+    def to_json(self) -> Dict[str, float]:
+        """ transforms the link state to a dictionary, for reporting """
+        return {
+            "interval": self.interval,
+            "max_records": self.max_records,
+            "loss": self.loss,
+            "rtt": self.rtt,
+        }
@@ -0,0 +1,171 @@
+"""
+Control socket of game nodes
+
+Each node can listen on a Unix domain socket, on which its manager sends commands as JSON objects, one per line.
+The node answers each of them with one JSON object, on one line. The commands are:
+
+    - {"command": "stats"}: get the metrics, the number of players and the tunables of the node
+    - {"command": "set", "tunables": {...}}: change some tunables of the running game
+    - {"command": "drain"}: stop accepting new players, and close the game once the last one left
+    - {"command": "stop"}: close the game right away
+
+Errors are answered as {"error": message}.
+"""
+
+import json
+import json.decoder
+import os
+from typing import Callable, Dict
+
+from twisted.internet import reactor
+from twisted.internet.protocol import Factory
+from twisted.internet.unix import Port
+from twisted.protocols.basic import LineOnlyReceiver
+
+from phagocyte_game_server.custom_types import json_object
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+TUNABLES = {
+    "capacity": int,
+    "tick_rate": float,
+    "max_hit_count": int,
+    "eat_ratio": float,
+    "food_production_rate": float,
+}  # type: Dict[str, Callable]
+
+
+def get_tunables(game) -> json_object:
+    """
+    get the current value of the tunables of the game
+
+    :param game: the GameProtocol
+    """
+    return {
+        "capacity": game.max_capacity,
+        "tick_rate": 1 / game.tick_interval,
+        "max_hit_count": game.world.max_hit_count,
+        "eat_ratio": game.world.eat_ratio,
+        "food_production_rate": game.world.food_production_rate,
+    }
+
+
+def set_tunable(game, name: str, value):
+    """
+    changes a tunable of the running game
+
+    :param game: the GameProtocol
+    :param name: name of the tunable
+    :param value: its new value, already converted
+    """
+    if name == "capacity":
+        game.max_capacity = value
+    elif name == "tick_rate":
+        game.set_tick_interval(1 / value)
+    else:
+        setattr(game.world, name, value)
+
+
+class ControlProtocol(LineOnlyReceiver):
+    """
+    Connection of the manager to the control socket of a node
+    """
+    delimiter = b"\n"
+
+    def lineReceived(self, line: bytes):
+        """
+        runs the command received and sends back its result
+
+        :param line: command, as JSON
+        """
+        try:
+            request = json.loads(line.decode("utf8"))
+            command = request["command"]
+        except (json.decoder.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+            self.reply(error="invalid command")
+            return
+
+        handler = getattr(self, "command_" + str(command), None)
+        if handler is None:
+            self.reply(error="unknown command {}".format(command))
+        else:
+            handler(request)
+
+    def reply(self, **data):
+        """
+        sends an answer to the manager
+
+        :param data: data to send
+        """
+        self.sendLine(json.dumps(data).encode("utf8"))
+
+    def command_stats(self, request: json_object):
+        """ sends the metrics of the node """
+        game = self.factory.game
+        self.reply(
+            metrics=game.metrics.to_json(), players=len(game.players), tunables=get_tunables(game),
+            draining=game.draining
+        )
+
+    def command_set(self, request: json_object):
+        """ changes the tunables given, all or none of them """
+        tunables = request.get("tunables", {})
+        if not isinstance(tunables, dict):
+            self.reply(error="invalid value")
+            return
+
+        try:
+            values = {name: TUNABLES[name](value) for name, value in tunables.items()}
+        except KeyError as e:
+            self.reply(error="unknown tunable {}".format(e.args[0]))
+            return
+        except (TypeError, ValueError):
+            self.reply(error="invalid value")
+            return
+
+        if any(value <= 0 for value in values.values()):
+            self.reply(error="tunables must be positive")
+            return
+
+        for name, value in values.items():
+            set_tunable(self.factory.game, name, value)
+
+        self.reply(tunables=get_tunables(self.factory.game))
+
+    def command_drain(self, request: json_object):
+        """ stops accepting new players """
+        self.factory.game.drain()
+        self.reply(draining=True)
+
+    def command_stop(self, request: json_object):
+        """ closes the game once the answer is sent """
+        self.reply(stopping=True)
+        reactor.callLater(0, self.factory.game.stop)
+
+
+class ControlFactory(Factory):
+    """
+    Factory of the connections to the control socket
+
+    :param game: the GameProtocol to control
+    """
+    protocol = ControlProtocol
+
+    def __init__(self, game):
+        self.game = game
+
+
+def listen_control(path: str, game) -> Port:
+    """
+    listens for commands on a Unix domain socket, replacing the socket left by a previous node on the same path
+
+    :param path: path of the socket
+    :param game: the GameProtocol to control
+    :return: the listening port
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+
+    return reactor.listenUNIX(path, ControlFactory(game), mode=0o600)
@@ -23,6 +23,13 @@ class Event(enum.IntEnum):
     HOOK = 8
     ALIVE = 9
     FINISHED = 10
+    ACK = 11
+    PING = 12
+    PONG = 13
+    SYNC = 14
+    RESYNC = 15
+    INPUT = 16
+    RESUME = 17
 
 
 @enum.unique
@@ -34,3 +41,4 @@ class Error(enum.IntEnum):
     MAX_CAPACITY = 1
     NO_TOKEN = 2
     DUPLICATE_USERNAME = 3
+    RESUME_INVALID = 4
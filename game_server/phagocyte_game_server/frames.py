@@ -0,0 +1,117 @@
+"""
+Assembly of the frames broadcast to players
+
+A frame is a message containing a list of records, like the food or the players' positions. Each record
+is encoded only once in a buffer shared by every recipient of the frame. Datagrams sent to each player
+are then built from slices of this buffer, without copying it, which allows sending only part of the
+records to some players.
+"""
+
+import json
+from typing import List
+
+from phagocyte_game_server.custom_types import json_object
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+SEPARATOR = b", "
+
+
+class Frame:
+    """
+    Message containing a list of records, encoded once for all its recipients
+
+    :param header: fields of the message, apart from the records
+    :param field: name of the field under which the records are sent
+    :param records: records to send
+    """
+    __slots__ = ["view", "head", "tail", "starts", "ends"]
+
+    def __init__(self, header: json_object, field: str, records: List[json_object]):
+        head = json.dumps(header).encode("utf-8")[:-1]
+        if header:
+            head += SEPARATOR
+        head += json.dumps(field).encode("utf-8") + b": ["
+
+        parts = [head]
+        self.starts = []  # type: List[int]
+        self.ends = []  # type: List[int]
+        offset = len(head)
+
+        for record in records:
+            if self.starts:
+                parts.append(SEPARATOR)
+                offset += len(SEPARATOR)
+
+            encoded = json.dumps(record).encode("utf-8")
+            parts.append(encoded)
+            self.starts.append(offset)
+            offset += len(encoded)
+            self.ends.append(offset)
+
+        parts.append(b"]}")
+
+        # the buffer is kept writable so that it can be shared with batched system calls without copies
+        self.view = memoryview(bytearray().join(parts))  # type: memoryview
+        self.head = self.view[:len(head)]  # type: memoryview
+        self.tail = self.view[offset:]  # type: memoryview
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def records(self, start: int, end: int) -> memoryview:
+        """
+        get the slice of the buffer containing the given records, with their separators
+
+        :param start: index of the first record
+        :param end: index after the last record
+        """
+        return self.view[self.starts[start]:self.ends[end - 1]]
+
+    def segments(self, start: int=0, count: int=None) -> List[memoryview]:
+        """
+        get the segments forming a datagram containing only part of the records.
+        The records are taken from start, wrapping around at the end of the list.
+
+        :param start: index of the first record to send
+        :param count: number of records to send, None to send all of them
+        :return: list of slices of the buffer to send, in order
+        """
+        total = len(self.starts)
+
+        if count is None or count >= total:
+            return [self.view]
+        elif count <= 0:
+            return [self.head, self.tail]
+
+        end = start + count
+        if end <= total:
+            return [self.head, self.records(start, end), self.tail]
+
+        return [self.head, self.records(start, total), memoryview(SEPARATOR), self.records(0, end - total), self.tail]
+
+    def chunks(self, max_size: int) -> List[List[memoryview]]:
+        """
+        splits the frame in datagrams of at most max_size bytes each, except for records too big to fit alone in one.
+        Each datagram holds the header and consecutive records, and at least one is returned even without records
+
+        :param max_size: maximum size of a datagram, in bytes
+        :return: segments forming each datagram, in order
+        """
+        overhead = len(self.head) + len(self.tail)
+        total = len(self.starts)
+        chunks = []  # type: List[List[memoryview]]
+        start = 0
+
+        while True:
+            end = start
+            while end < total and (end == start or overhead + self.ends[end] - self.starts[start] <= max_size):
+                end += 1
+
+            chunks.append([self.head, self.records(start, end), self.tail] if end > start else [self.head, self.tail])
+            start = end
+
+            if start >= total:
+                return chunks
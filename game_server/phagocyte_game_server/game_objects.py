@@ -6,7 +6,7 @@ import enum
 import itertools
 from math import sin, cos
 import random
-import time
+import weakref
 
 from phagocyte_game_server.custom_types import json_object
 
@@ -90,6 +90,33 @@ class RandomPositionedGameObject(RoundGameObject):
         self.y = random.randint(self.radius, max_y - self.radius)
 
 
+class Food(RoundGameObject):
+    """
+    Represents a piece of food, identified to be spawned and despawned on the clients
+
+    :param radius: radius of the food
+    :param x: position of the food on the x axis
+    :param y: position of the food on the y axis
+    """
+    __slots__ = ["uid"]
+    id_counter = itertools.count()  # type: itertools.count
+
+    def __init__(self, radius: float, x: float, y: float):
+        super().__init__(radius)
+        self.x = x  # type: float
+        self.y = y  # type: float
+        self.uid = next(self.id_counter)  # type: int
+
+    def to_json(self) -> json_object:
+        """ transforms the object to a dictionary to be sent on the wire """
+        return {
+            "uid": self.uid,
+            "size": self.size,
+            "x": int(self.x),
+            "y": int(self.y)
+        }
+
+
 class Player(RandomPositionedGameObject):
     """
     Represents a player in the game
@@ -100,28 +127,35 @@ class Player(RandomPositionedGameObject):
     :param radius: radius of the disc representing the player
     :param max_x: maximum width of the map
     :param max_y: maximum height of the map
+    :param now: time at which the player joined
     """
     __slots__ = [
-        "name", "color", "timestamp", "initial_size", "max_speed", "hit_count", "bonus", "bonus_callback",
+        "name", "color", "timestamp", "initial_size", "max_speed", "hit_count", "bonus", "bonus_expiry",
         "hook", "grabbed_x", "grabbed_y", "timestamp", "uid", "matter_gained", "matter_lost", "players_eaten",
-        "bonuses_taken", "bullets_shot", "successful_hooks", "start_time", "initial_max_speed",
+        "bonuses_taken", "bullets_shot", "successful_hooks", "start_time", "initial_max_speed", "input_seq",
+        "input_credit", "resume_token", "resend_at",
     ]
 
-    def __init__(self, uid: str, name: str, color: str, radius: float, max_x: int, max_y: int):
+    def __init__(self, uid: str, name: str, color: str, radius: float, max_x: int, max_y: int, now: float):
         super().__init__(radius, max_x, max_y)
         self.initial_size = self.size  # type: int
         self.name = name  # type: str
         self.color = color  # type: str
-        self.timestamp = time.time()  # type: int
+        self.timestamp = now  # type: float
         self.initial_max_speed = 50 * self.initial_size / self.initial_size ** 0.5  # type: float
         self.max_speed = 50 * self.initial_size / self.size ** 0.5  # type: float
         self.hit_count = 0  # type: int
         self.bonus = None  # type: Bonus
-        self.bonus_callback = None  # type: callable
+        self.bonus_expiry = None  # type: float
         self.hook = None  # type: GrabHook
         self.grabbed_x = 0  # type: float
         self.grabbed_y = 0  # type: float
-        self.timestamp = time.time()
+        # last input applied and number of inputs that can still be applied, for players sending inputs
+        self.input_seq = None  # type: int
+        self.input_credit = 0  # type: float
+        # time from which the position is sent again, even if the player didn't move
+        self.resend_at = now  # type: float
+        self.resume_token = None  # type: str
 
         self.uid = uid  # type: int
         self.matter_gained = 0  # type: float
@@ -130,7 +164,7 @@ class Player(RandomPositionedGameObject):
         self.bonuses_taken = 0  # type: int
         self.bullets_shot = 0  # type: int
         self.successful_hooks = 0  # type: int
-        self.start_time = time.time()  # type: float
+        self.start_time = now  # type: float
 
     def to_json(self) -> json_object:
         """ transforms the object to a dictionary to be sent on the wire """
@@ -144,10 +178,11 @@ class Player(RandomPositionedGameObject):
             "hook": self.hook.to_json() if self.hook is not None else None
         }
 
-    def get_stats(self, died: bool=False, won: bool=False) -> json_object:
+    def get_stats(self, now: float, died: bool=False, won: bool=False) -> json_object:
         """
         get the statistics about the current player
 
+        :param now: current time
         :param died: whether this player died or not
         :param won: whether the player won or not
         """
@@ -160,7 +195,7 @@ class Player(RandomPositionedGameObject):
             "bonuses_taken": self.bonuses_taken,
             "bullets_shot": self.bullets_shot,
             "successful_hooks": self.successful_hooks,
-            "time_played": time.time() - self.start_time
+            "time_played": now - self.start_time
         }
 
     def update_size(self, obj: RoundGameObject):
@@ -192,13 +227,17 @@ class Bullet(RoundGameObject):
     """
     Represents a bullet in game
 
+    Bullets move in a straight line at constant speed: their position only depends on where and when they
+    were shot, which lets the clients simulate them from their spawn.
+
     :param angle: angle at which the bullet is moving
     :param player: player that shot the bullet
+    :param now: time at which the bullet is shot
     """
-    __slots__ = ["uid", "color", "speed_x", "speed_y", "player"]
+    __slots__ = ["uid", "color", "speed_x", "speed_y", "player", "origin_x", "origin_y", "spawn_time"]
     id_counter = itertools.count()  # type: itertools.count
 
-    def __init__(self, angle: float, player: Player):
+    def __init__(self, angle: float, player: Player, now: float):
         size = player.size / 100
         player.size -= size
         player.radius = player.size / 2
@@ -210,24 +249,39 @@ class Bullet(RoundGameObject):
 
         super().__init__(size * 10)
 
-        self.x = player.x  # type: int
-        self.y = player.y  # type: int
+        self.x = self.origin_x = player.x  # type: int
+        self.y = self.origin_y = player.y  # type: int
+        self.spawn_time = now  # type: float
         self.color = player.color  # type: str
         self.speed_x = 2 * sin(angle) * player.max_speed  # type: float
         self.speed_y = 2 * cos(angle) * player.max_speed  # type: float
         self.uid = next(self.id_counter)  # type: int
-        self.player = player
+        # bullets outlive their shooter, they should not keep dead players in memory
+        self.player = weakref.ref(player)  # type: weakref.ref
+
+    def move(self, now: float, max_x: int, max_y: int):
+        """
+        moves the bullet to where it is at the given time, without leaving the map
+
+        :param now: current time
+        :param max_x: size of the x axis of the world
+        :param max_y: size of the y axis of the world
+        """
+        elapsed = now - self.spawn_time
+        self.x = min(max_x - self.radius, max(self.radius, self.origin_x + self.speed_x * elapsed))
+        self.y = min(max_y - self.radius, max(self.radius, self.origin_y + self.speed_y * elapsed))
 
     def to_json(self):
-        """ transforms the object to a dictionary to be sent on the wire """
+        """ transforms the object to a dictionary to be sent on the wire, with where and when it was shot """
         return {
             "uid": self.uid,
             "color": self.color,
-            "x": int(self.x),
-            "y": int(self.y),
+            "x": self.origin_x,
+            "y": self.origin_y,
             "speed_x": self.speed_x,
             "speed_y": self.speed_y,
-            "size": self.size
+            "size": self.size,
+            "t": self.spawn_time,
         }
 
 
@@ -238,13 +292,24 @@ class Bonus(RandomPositionedGameObject):
     :param max_x: maximum position on the x axis where the bonus can be
     :param max_y maximum position on the y axis where the bonus can be
     """
-    __slots__ = ["bonus"]
+    __slots__ = ["bonus", "uid"]
 
     bonus_number = len(list(BonusTypes))  # type: int
+    id_counter = itertools.count()  # type: itertools.count
 
     def __init__(self, max_x: int, max_y: int):
         super().__init__(15, max_x, max_y)
         self.bonus = random.randrange(self.bonus_number)  # type: int
+        self.uid = next(self.id_counter)  # type: int
+
+    def to_json(self) -> json_object:
+        """ transforms the object to a dictionary to be sent on the wire """
+        return {
+            "uid": self.uid,
+            "size": self.size,
+            "x": int(self.x),
+            "y": int(self.y)
+        }
 
 
 class GrabHook(GameObject):
@@ -0,0 +1,157 @@
+"""
+Control of the garbage collector of game nodes
+
+Python's cyclic garbage collector runs whenever enough objects were allocated, which can be in the middle
+of a tick, delaying it by several milliseconds. This controller can:
+
+    - freeze all objects alive once the node started, so that collections don't walk through them again
+    - tune the thresholds of the collector
+    - take over the collections, running them at the end of the tick when there is enough time left
+      before the next one. Collections only run without time left when too many objects are pending
+
+Every collection is timed, and the pauses are reported in the metrics of the node.
+"""
+
+import gc
+import time
+from typing import Dict, List, Tuple
+
+from twisted.internet import task
+
+from phagocyte_game_server.custom_types import json_object
+from phagocyte_game_server.metrics import Metrics
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class GCController:
+    """
+    Controller of the garbage collector
+
+    :param metrics: metrics in which to report the pauses
+    :param interval: duration of a tick, in seconds
+    :param thresholds: thresholds of the three generations, None to keep the current ones
+    :param manual: whether to run the collections at the end of the ticks instead of letting Python decide
+    :param overflow: ratio of the threshold of the youngest generation after which a collection is run
+                     even if there is no time left in the tick
+    """
+    def __init__(self, metrics: Metrics, interval: float=1 / 30, thresholds: Tuple[int, int, int]=None,
+                 manual: bool=False, overflow: float=10):
+        self.metrics = metrics  # type: Metrics
+        self.interval = interval  # type: float
+        self.thresholds = thresholds  # type: Tuple[int, int, int]
+        self.manual = manual  # type: bool
+        self.overflow = overflow  # type: float
+
+        self.started = None  # type: float
+        # estimated duration of a collection of each generation
+        self.estimates = [0.0, 0.0, 0.0]  # type: List[float]
+        self.collections = [0, 0, 0]  # type: List[int]
+        self.deferred = 0  # type: int
+        self.forced = 0  # type: int
+        self.frozen = 0  # type: int
+        self.loop = None  # type: task.LoopingCall
+
+    def install(self):
+        """
+        configures the collector and starts timing its collections
+        """
+        if self.thresholds is not None:
+            gc.set_threshold(*self.thresholds)
+
+        gc.callbacks.append(self.on_collection)
+        self.metrics.register("gc", self.to_json)
+
+        if self.manual:
+            gc.disable()
+            self.loop = task.LoopingCall(self.end_of_tick)
+            self.loop.start(self.interval, now=False)
+
+    def set_interval(self, interval: float):
+        """
+        follows a change of the duration of the ticks
+
+        :param interval: new duration of a tick, in seconds
+        """
+        self.interval = interval
+        if self.loop is not None:
+            self.loop.interval = interval
+
+    def freeze(self):
+        """
+        moves all objects currently alive to a permanent generation, ignored by the collections
+        """
+        gc.collect()
+        gc.freeze()
+        self.frozen = gc.get_freeze_count()
+
+    def on_collection(self, phase: str, info: Dict[str, int]):
+        """
+        times the collections, called by the garbage collector
+
+        :param phase: "start" or "stop"
+        :param info: information about the collection, with its generation
+        """
+        if phase == "start":
+            self.started = time.perf_counter()
+        elif self.started is not None:
+            pause = time.perf_counter() - self.started
+            generation = info["generation"]
+            self.started = None
+            self.collections[generation] += 1
+            self.estimates[generation] = pause if not self.estimates[generation] else \
+                0.8 * self.estimates[generation] + 0.2 * pause
+            self.metrics.histogram("gc.pause").observe(pause)
+            self.metrics.histogram("gc.gen{}".format(generation)).observe(pause)
+
+    def pending_generation(self) -> int:
+        """
+        get the oldest generation that needs to be collected, like the collector would
+
+        :return: the generation, or None if no collection is needed
+        """
+        counts = gc.get_count()
+        thresholds = gc.get_threshold()
+
+        for generation in (2, 1, 0):
+            if thresholds[generation] and counts[generation] > thresholds[generation]:
+                return generation
+        return None
+
+    def spare_time(self) -> float:
+        """
+        get the time left before the next tick
+
+        The controller runs with the same interval as the ticks and was started after them, so it runs
+        right after the handlers of each tick
+        """
+        elapsed = (self.loop.clock.seconds() - self.loop.starttime) % self.interval
+        return self.interval - elapsed
+
+    def end_of_tick(self):
+        """
+        collects the generations that need it if there is time left in the tick
+        """
+        generation = self.pending_generation()
+        if generation is None:
+            return
+
+        if self.estimates[generation] < self.spare_time():
+            gc.collect(generation)
+        elif gc.get_count()[0] > gc.get_threshold()[0] * self.overflow:
+            self.forced += 1
+            gc.collect(generation)
+        else:
+            self.deferred += 1
+
+    def to_json(self) -> json_object:
+        """ get statistics about the collections, for reporting """
+        return {
+            "manual": self.manual,
+            "thresholds": gc.get_threshold(),
+            "frozen": self.frozen,
+            "collections": self.collections,
+            "deferred": self.deferred,
+            "forced": self.forced,
+        }
@@ -0,0 +1,200 @@
+"""
+Headless simulation of games
+
+This runs a World without network nor reactor, with scripted players, on a virtual clock. The game is
+stepped as fast as the CPU allows, which allows simulating minutes of play in seconds to check the
+balance of the game or the performance of the simulation.
+"""
+
+import collections
+import json
+import math
+import random
+import time
+from typing import Dict, List
+
+from phagocyte_game_server.custom_types import address, json_object
+from phagocyte_game_server.world import Broadcast, Death, Win, World
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+TICK = 1 / 30  # type: float
+NEW_BULLETS_TICKS = 10  # type: int
+DISCONNECTS_TICKS = 150  # type: int
+SYNC_TICKS = 30  # type: int
+
+
+class VirtualClock:
+    """
+    Clock that only moves forward when told to
+
+    :param now: time at which the clock starts
+    """
+    def __init__(self, now: float=0):
+        self.now = now  # type: float
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, delta: float):
+        """
+        moves the clock forward
+
+        :param delta: time to add, in seconds
+        """
+        self.now += delta
+
+
+class ScriptedPlayer:
+    """
+    Player wandering randomly on the map, shooting from time to time
+
+    :param addr: fake address of the player
+    :param name: name of the player
+    :param rng: random generator to use for the decisions of the player
+    :param shoot_rate: probability to shoot on each tick
+    """
+    def __init__(self, addr: address, name: str, rng: random.Random, shoot_rate: float=0.01):
+        self.addr = addr  # type: address
+        self.name = name  # type: str
+        self.rng = rng  # type: random.Random
+        self.shoot_rate = shoot_rate  # type: float
+        self.target = None  # type: List[float]
+
+    def play(self, world: World, now: float):
+        """
+        sends the inputs of the player for this tick, joining the game again if the player died
+
+        :param world: world in which to play
+        :param now: current time
+        """
+        if self.addr in world.deaths:
+            del world.deaths[self.addr]
+
+        player = world.players.get(self.addr)
+        if player is None:
+            world.join(self.addr, None, self.name, "#%06x" % self.rng.randint(0, 0xFFFFFF), now)
+            return
+
+        if self.target is None or math.hypot(self.target[0] - player.x, self.target[1] - player.y) < player.radius:
+            self.target = [self.rng.uniform(0, world.max_x), self.rng.uniform(0, world.max_y)]
+
+        angle = math.atan2(self.target[0] - player.x, self.target[1] - player.y)
+        distance = player.max_speed * TICK
+        world.move(self.addr, (player.x + distance * math.sin(angle), player.y + distance * math.cos(angle)))
+
+        if self.rng.random() < self.shoot_rate:
+            world.shoot(self.addr, self.rng.uniform(0, 2 * math.pi))
+
+
+def run_headless(world: World, clock: VirtualClock, players: List[ScriptedPlayer], duration: float,
+                 stop_on_win: bool=True) -> json_object:
+    """
+    steps the world as fast as possible, with the same cadence as a game node
+
+    :param world: world to simulate
+    :param clock: clock used by the world
+    :param players: scripted players taking part in the game
+    :param duration: simulated time after which to stop, in seconds
+    :param stop_on_win: whether to stop as soon as someone won or not
+    :return: report of the simulation
+    """
+    events = collections.Counter()  # type: Dict[str, int]
+    records = 0
+    ticks = 0
+    winner = None
+    start = time.perf_counter()
+
+    while ticks < round(duration / TICK):
+        for player in players:
+            player.play(world, clock())
+
+        if ticks % NEW_BULLETS_TICKS == 0:
+            tick_events = world.step_new_bullets(clock())
+        else:
+            tick_events = []
+
+        tick_events.extend(world.step(clock()))
+
+        if ticks % DISCONNECTS_TICKS == 0:
+            tick_events.extend(world.step_disconnects(clock()))
+
+        if ticks % SYNC_TICKS == 0:
+            tick_events.extend(world.step_sync())
+
+        for event in tick_events:
+            events[type(event).__name__] += 1
+            if isinstance(event, Broadcast):
+                records += len(event.records)
+            elif isinstance(event, Win):
+                winner = event.name
+
+        ticks += 1
+        clock.advance(TICK)
+
+        if winner is not None and stop_on_win:
+            break
+
+    elapsed = time.perf_counter() - start
+    simulated = ticks * TICK
+
+    return {
+        "ticks": ticks,
+        "simulated": simulated,
+        "elapsed": elapsed,
+        "speedup": simulated / elapsed if elapsed else None,
+        "tick_mean": elapsed / ticks if ticks else None,
+        "events": dict(events),
+        "records": records,
+        "deaths": events[Death.__name__],
+        "winner": winner,
+        "players": sorted(
+            ({"name": p.name, "size": p.size} for p in world.players.values()), key=lambda p: -p["size"]
+        ),
+        "food": len(world.food),
+        "bullets": len(world.bullets),
+        "bonuses": len(world.bonuses),
+    }
+
+
+def simulate(players: int, duration: float, seed: int, map_height: int, map_width: int, max_speed: int,
+             max_hit_count: int, eat_ratio: float, min_radius: int, food_production_rate: float, win_size: int,
+             **kwargs) -> json_object:
+    """
+    simulates a game with scripted players, faster than real time
+
+    :param players: number of scripted players
+    :param duration: simulated time, in seconds
+    :param seed: seed of the random generators, to replay the same game
+    :param map_height: height of the map to handle
+    :param map_width: width of the map to handle
+    :param max_speed: maximum speed achievable by the players
+    :param max_hit_count: number of hits to take before loosing some matter
+    :param eat_ratio: size after which a player can eat another
+    :param min_radius: minimal size a player can have
+    :param food_production_rate: rate at which new food appears on the screen
+    :param win_size: size after which a player wins
+    :param kwargs: additional arguments, ignored
+    :return: report of the simulation
+    """
+    random.seed(seed)
+    rng = random.Random(seed)
+    clock = VirtualClock()
+
+    world = World(
+        map_height, map_width, max_speed, max_hit_count, eat_ratio, min_radius, food_production_rate, win_size, clock()
+    )
+    scripted = [ScriptedPlayer(("10.0.0.1", 1000 + i), "bot-{}".format(i), rng) for i in range(players)]
+
+    return run_headless(world, clock, scripted, duration)
+
+
+def runsimulation(**kwargs):
+    """
+    simulates a game and prints its report
+
+    :param kwargs: arguments of the simulation, see simulate
+    """
+    print(json.dumps(simulate(**kwargs), indent=2))
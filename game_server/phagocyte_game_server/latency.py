@@ -0,0 +1,76 @@
+"""
+Latency measurement between the game server and its clients
+
+The server periodically pings each client with its own timestamp. Clients echo it back immediately,
+along with the time at which they received the ping on their own clock. This gives the round trip
+time and its jitter, and an estimate of the latency in each direction.
+"""
+
+from phagocyte_game_server.custom_types import json_object
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class LatencyEstimator:
+    """
+    Estimates the latency between the server and a client from ping/pong exchanges
+
+    Clocks of the client and the server are not synchronized. The offset between them is estimated
+    on the exchange with the smallest round trip time, assuming the path was symmetric for it. One way
+    latencies of the other exchanges are then measured relative to it.
+    """
+    __slots__ = ["rtt", "jitter", "last_sample", "min_rtt", "offset", "upstream", "downstream"]
+
+    def __init__(self):
+        self.rtt = None  # type: float
+        self.jitter = 0  # type: float
+        self.last_sample = None  # type: float
+        self.min_rtt = None  # type: float
+        self.offset = 0  # type: float
+        self.upstream = None  # type: float
+        self.downstream = None  # type: float
+
+    def on_pong(self, sent: float, client_time: float, now: float) -> float:
+        """
+        handles the response to a ping
+
+        :param sent: time at which the ping was sent, on the server clock
+        :param client_time: time at which the client received the ping, on its clock
+        :param now: time at which the response was received, on the server clock
+        :return: the round trip time of this exchange
+        """
+        sample = now - sent
+
+        if self.rtt is None:
+            self.rtt = sample
+        else:
+            # smoothing as done in RFC 3550 for the jitter and RFC 6298 for the rtt
+            self.jitter += (abs(sample - self.last_sample) - self.jitter) / 16
+            self.rtt = 0.875 * self.rtt + 0.125 * sample
+
+        self.last_sample = sample
+
+        if self.min_rtt is None or sample <= self.min_rtt:
+            self.min_rtt = sample
+            self.offset = client_time - sent - sample / 2
+
+        downstream = max(0, min(sample, client_time - sent - self.offset))
+        upstream = sample - downstream
+
+        if self.downstream is None:
+            self.downstream, self.upstream = downstream, upstream
+        else:
+            self.downstream = 0.875 * self.downstream + 0.125 * downstream
+            self.upstream = 0.875 * self.upstream + 0.125 * upstream
+
+        return sample
+
+    def to_json(self) -> json_object:
+        """ transforms the estimation to a dictionary, for reporting """
+        return {
+            "rtt": self.rtt,
+            "jitter": self.jitter,
+            "upstream": self.upstream,
+            "downstream": self.downstream,
+        }
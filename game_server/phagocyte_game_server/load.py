@@ -0,0 +1,79 @@
+"""
+Load reports of game nodes
+
+Nodes started by a manager report their load on their standard output, as one JSON object per line, so that
+the manager can tell the authentication server how loaded it really is. Each report covers the time since
+the previous one and holds:
+
+    - the number of players and the capacity of the game
+    - the CPU time used by the node, as a fraction of a core
+    - the time spent in the handlers of the game, as a fraction of the time elapsed
+    - the number of handlers that took longer than a tick
+"""
+
+import json
+import sys
+import time
+from typing import IO
+
+from twisted.internet import task
+
+from phagocyte_game_server.custom_types import json_object
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class LoadReporter:
+    """
+    Reporter of the load of a game node
+
+    :param protocol: protocol of the game, a GameProtocol
+    :param output: stream on which to write the reports
+    :param interval: time between two reports, in seconds
+    """
+    def __init__(self, protocol, output: IO[str]=sys.stdout, interval: float=1):
+        self.protocol = protocol
+        self.output = output  # type: IO[str]
+        self.interval = interval  # type: float
+
+        self.started = time.perf_counter()  # type: float
+        self.cpu = time.process_time()  # type: float
+
+    def install(self):
+        """
+        starts reporting the load regularly
+        """
+        task.LoopingCall(self.report).start(self.interval, now=False)
+
+    def load(self) -> json_object:
+        """
+        get the load of the node since the previous call, and resets the counters
+
+        :return: the load of the node
+        """
+        now = time.perf_counter()
+        cpu = time.process_time()
+        elapsed = max(now - self.started, 1e-9)
+
+        load = {
+            "players": len(self.protocol.players),
+            "capacity": self.protocol.max_capacity,
+            "cpu": (cpu - self.cpu) / elapsed,
+            "busy": self.protocol.busy / elapsed,
+            "overruns": self.protocol.overruns,
+        }
+
+        self.started = now
+        self.cpu = cpu
+        self.protocol.busy = 0
+        self.protocol.overruns = 0
+
+        return load
+
+    def report(self):
+        """
+        writes a report of the load on the output
+        """
+        self.output.write(json.dumps({"load": self.load()}) + "\n")
+        self.output.flush()
@@ -0,0 +1,95 @@
+"""
+Memory accounting of game nodes
+
+The resident memory of the process is always reported. Allocations can additionally be traced with
+tracemalloc, in which case each report contains the lines of code holding the most memory, and those
+whose allocations grew the most since the previous report, which points to leaks on long matches.
+Tracing allocations slows the node down, and is therefore only enabled on demand.
+"""
+
+import gc
+import os
+import resource
+import sys
+import tracemalloc
+from typing import List
+
+from phagocyte_game_server.custom_types import json_object
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+PROC_STATM_FILE = "/proc/self/statm"
+
+
+def resident_memory() -> int:
+    """
+    get the memory used by the process
+
+    :return: resident memory in bytes, or the peak resident memory if the current one is not available
+    """
+    try:
+        with open(PROC_STATM_FILE) as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, IndexError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # the peak is given in kilobytes on Linux, and in bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryTracker:
+    """
+    Collector of the memory metrics of a node
+
+    :param top: number of lines of code to report when tracing allocations, 0 to not trace them
+    """
+    def __init__(self, top: int=0):
+        self.top = top  # type: int
+        self.previous = None  # type: tracemalloc.Snapshot
+
+        if top and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def snapshot(self) -> tracemalloc.Snapshot:
+        """
+        get a snapshot of the memory allocated, ignoring the allocations of tracemalloc itself
+        """
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+
+    @staticmethod
+    def format(statistics: List) -> List[json_object]:
+        """
+        transforms tracemalloc statistics to dictionaries
+
+        :param statistics: statistics or statistic differences to transform
+        """
+        return [
+            dict(
+                {"line": str(stat.traceback[0]), "size": stat.size, "count": stat.count},
+                **({"growth": stat.size_diff} if hasattr(stat, "size_diff") else {})
+            )
+            for stat in statistics
+        ]
+
+    def to_json(self) -> json_object:
+        """ get the memory metrics, for reporting """
+        report = {"rss": resident_memory(), "gc_objects": len(gc.get_objects())}
+
+        if not self.top or not tracemalloc.is_tracing():
+            return report
+
+        snapshot = self.snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        report["traced"] = current
+        report["traced_peak"] = peak
+        report["top"] = self.format(snapshot.statistics("lineno")[:self.top])
+
+        if self.previous is not None:
+            report["growth"] = self.format(snapshot.compare_to(self.previous, "lineno")[:self.top])
+
+        self.previous = snapshot
+        return report
@@ -0,0 +1,131 @@
+"""
+Metrics collected on a game node
+
+Metrics are either histograms, updated as events happen, or collectors, functions that are called
+to get the current value of a metric whenever a report is made.
+"""
+
+import bisect
+from typing import Callable, Dict, List
+
+from phagocyte_game_server.custom_types import json_object
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+# bucket bounds, in seconds, going from half a millisecond to a bit more than 4 seconds
+TIME_BUCKETS = [0.0005 * 2 ** i for i in range(14)]  # type: List[float]
+
+
+class Histogram:
+    """
+    Histogram of values, with fixed buckets
+
+    :param bounds: upper bounds of the buckets, sorted. Values above the last bound go in an overflow bucket
+    """
+    __slots__ = ["bounds", "counts", "count", "total", "max"]
+
+    def __init__(self, bounds: List[float]=TIME_BUCKETS):
+        self.bounds = bounds  # type: List[float]
+        self.counts = [0] * (len(bounds) + 1)  # type: List[int]
+        self.count = 0  # type: int
+        self.total = 0  # type: float
+        self.max = 0  # type: float
+
+    def observe(self, value: float):
+        """
+        adds a new value to the histogram
+
+        :param value: value to add
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, ratio: float) -> float:
+        """
+        get the upper bound of the bucket containing the given percentile
+
+        :param ratio: percentile to get, between 0 and 1
+        :return: upper bound of the bucket, capped by the maximum value seen
+        """
+        if not self.count:
+            return 0
+
+        rank = ratio * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+
+        return self.max
+
+    def reset(self):
+        """
+        clears all values from the histogram
+        """
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def to_json(self) -> json_object:
+        """ transforms the histogram to a dictionary, for reporting """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """
+    Registry of all metrics of a game node
+    """
+    def __init__(self):
+        self.histograms = dict()  # type: Dict[str, Histogram]
+        self.collectors = dict()  # type: Dict[str, Callable[[], json_object]]
+
+    def histogram(self, name: str, bounds: List[float]=TIME_BUCKETS) -> Histogram:
+        """
+        get the histogram with the given name, creating it if needed
+
+        :param name: name of the histogram
+        :param bounds: bounds of the buckets, if the histogram needs to be created
+        :return: the histogram
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(bounds)
+        return histogram
+
+    def register(self, name: str, collector: Callable[[], json_object]):
+        """
+        registers a function to call to get the value of a metric
+
+        :param name: name of the metric
+        :param collector: function returning the current value of the metric
+        """
+        self.collectors[name] = collector
+
+    def to_json(self, reset: bool=False) -> json_object:
+        """
+        get the value of all metrics
+
+        :param reset: whether to reset the histograms after reading them or not
+        :return: dictionary of all metrics
+        """
+        report = {name: collector() for name, collector in self.collectors.items()}
+        report.update((name, histogram.to_json()) for name, histogram in self.histograms.items())
+
+        if reset:
+            for histogram in self.histograms.values():
+                histogram.reset()
+
+        return report
@@ -0,0 +1,180 @@
+"""
+On demand profiling of running game nodes
+
+A node can be profiled without stopping the game, by sending it a signal:
+
+    - SIGUSR1 samples the call stack of the process a few hundred times per second of CPU time, and
+      writes the stacks in the folded format used by flamegraph.pl, speedscope and most flame graph tools
+    - SIGUSR2 runs cProfile, and writes its statistics, readable with pstats, snakeviz or flameprof
+
+Profiles last a fixed time, after which the results are written and the time spent in each handler of
+the game is logged. Nothing is installed apart from the two signal handlers while no profile is running,
+so profiling costs nothing when it is off.
+"""
+
+import cProfile
+import collections
+import logging
+import os
+import signal
+import time
+from typing import Dict, List, Tuple
+
+from twisted.internet import reactor
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+SAMPLE = "sample"
+CPROFILE = "cprofile"
+
+
+def frame_name(code) -> str:
+    """
+    get the name under which a function appears in the profiles
+
+    :param code: code object of the function
+    """
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class Profiler:
+    """
+    Profiler of the reactor thread, started on demand
+
+    :param directory: directory in which to write the profiles
+    :param prefix: prefix of the names of the files written
+    :param logger: logger to use to report the profiles written
+    :param duration: duration of each profile, in seconds
+    :param interval: time between two samples, in seconds of CPU time
+    """
+    def __init__(self, directory: str, prefix: str, logger: logging.Logger, duration: float=30,
+                 interval: float=0.005):
+        self.directory = directory  # type: str
+        self.prefix = prefix  # type: str
+        self.logger = logger  # type: logging.Logger
+        self.duration = duration  # type: float
+        self.interval = interval  # type: float
+
+        self.mode = None  # type: str
+        self.samples = collections.Counter()  # type: Dict[Tuple, int]
+        self.profile = None  # type: cProfile.Profile
+        self.previous_handler = None
+
+    def install(self):
+        """
+        installs the signal handlers starting the profiles
+        """
+        signal.signal(signal.SIGUSR1, lambda signum, frame: reactor.callFromThread(self.start, SAMPLE))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: reactor.callFromThread(self.start, CPROFILE))
+
+    @property
+    def running(self) -> bool:
+        """ whether a profile is being taken or not """
+        return self.mode is not None
+
+    def start(self, mode: str=SAMPLE, duration: float=None) -> bool:
+        """
+        starts a profile, that stops by itself after its duration
+
+        :param mode: SAMPLE to sample the call stacks, CPROFILE to use cProfile
+        :param duration: duration of the profile in seconds, None for the default duration
+        :return: False if a profile was already running
+        """
+        if self.running:
+            self.logger.warning("A profile is already running")
+            return False
+
+        self.mode = mode
+
+        if mode == SAMPLE:
+            self.samples.clear()
+            self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+        self.logger.info("Started profiling for {} seconds".format(duration or self.duration))
+        reactor.callLater(duration or self.duration, self.stop)
+        return True
+
+    def sample(self, signum: int, frame):
+        """
+        records the call stack interrupted by the profiling timer
+        """
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        self.samples[tuple(stack)] += 1
+
+    def stop(self) -> str:
+        """
+        stops the profile running and writes its results
+
+        :return: path of the file written
+        """
+        if self.mode == SAMPLE:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+            path = self.write_samples()
+            self.logger.info("Time spent in handlers: {}".format(self.handlers_summary()))
+        else:
+            self.profile.disable()
+            path = self.path("prof")
+            self.profile.dump_stats(path)
+            self.profile = None
+
+        self.mode = None
+        self.logger.info("Profile written to {}".format(path))
+        return path
+
+    def path(self, extension: str) -> str:
+        """
+        get the path of a new profile file
+
+        :param extension: extension of the file
+        """
+        return os.path.join(self.directory, "{}-{}.{}".format(self.prefix, time.strftime("%Y%m%d-%H%M%S"), extension))
+
+    def folded(self) -> List[str]:
+        """
+        get the stacks sampled in the folded format: frames from the root separated by semicolons,
+        followed by the number of samples
+
+        :return: one line by distinct stack
+        """
+        return [
+            "{} {}".format(";".join(frame_name(code) for code in reversed(stack)), count)
+            for stack, count in self.samples.items()
+        ]
+
+    def write_samples(self) -> str:
+        """
+        writes the stacks sampled, for flame graph tools
+
+        :return: path of the file written
+        """
+        path = self.path("folded")
+        with open(path, "w") as profile_file:
+            profile_file.write("\n".join(self.folded()) + "\n")
+        return path
+
+    def handlers_summary(self) -> Dict[str, float]:
+        """
+        attributes the samples to the handlers of the game protocol
+
+        :return: ratio of the samples taken in each handler
+        """
+        total = sum(self.samples.values())
+        handlers = collections.Counter()
+
+        for stack, count in self.samples.items():
+            for code in stack:
+                if code.co_name.startswith("handle_") or code.co_name == "datagramReceived":
+                    handlers[code.co_name] += count
+                    break
+
+        return {name: round(count / total, 3) for name, count in handlers.most_common()} if total else {}
@@ -0,0 +1,219 @@
+"""
+Ring buffers in shared memory, to exchange messages between the processes of a game node
+
+Each ring has a single producer and a single consumer. Messages are pickled objects, prefixed by their
+length. Since the consumer cannot wait on shared memory, the producer rings a doorbell, a pipe the consumer
+watches in its reactor, once per reactor iteration in which it wrote something.
+"""
+
+import logging
+import os
+import pickle
+import struct
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Iterator
+
+from twisted.internet import reactor
+from twisted.internet.error import ConnectionDone
+from twisted.internet.interfaces import IReadDescriptor
+from zope.interface import implementer
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+POSITIONS = struct.Struct("=QQ")  # total bytes written and read since the creation of the ring
+LENGTH = struct.Struct("=I")
+
+
+class RingBuffer:
+    """
+    Single producer, single consumer ring buffer of messages in shared memory
+
+    :param memory: shared memory in which the ring lives
+    """
+    def __init__(self, memory: SharedMemory):
+        self.memory = memory  # type: SharedMemory
+        self.capacity = memory.size - POSITIONS.size  # type: int
+        self.dropped = 0  # type: int
+
+    @classmethod
+    def create(cls, size: int) -> "RingBuffer":
+        """
+        creates a new ring in a new segment of shared memory
+
+        :param size: size of the ring, in bytes
+        """
+        memory = SharedMemory(create=True, size=size + POSITIONS.size)
+        POSITIONS.pack_into(memory.buf, 0, 0, 0)
+        return cls(memory)
+
+    @classmethod
+    def attach(cls, name: str) -> "RingBuffer":
+        """
+        attaches to a ring created by another process
+
+        :param name: name of the shared memory of the ring
+        """
+        return cls(SharedMemory(name))
+
+    @property
+    def name(self) -> str:
+        """ the name of the shared memory, to attach to it from another process """
+        return self.memory.name
+
+    def copy_in(self, position: int, data: bytes):
+        """
+        copies the data in the ring at the given position, wrapping around its end
+
+        :param position: absolute position at which to write
+        :param data: data to write
+        """
+        start = POSITIONS.size + position % self.capacity
+        first = min(len(data), POSITIONS.size + self.capacity - start)
+        self.memory.buf[start:start + first] = data[:first]
+        if first < len(data):
+            self.memory.buf[POSITIONS.size:POSITIONS.size + len(data) - first] = data[first:]
+
+    def copy_out(self, position: int, length: int) -> bytes:
+        """
+        copies data out of the ring from the given position, wrapping around its end
+
+        :param position: absolute position from which to read
+        :param length: number of bytes to read
+        """
+        start = POSITIONS.size + position % self.capacity
+        first = min(length, POSITIONS.size + self.capacity - start)
+        data = bytes(self.memory.buf[start:start + first])
+        if first < length:
+            data += bytes(self.memory.buf[POSITIONS.size:POSITIONS.size + length - first])
+        return data
+
+    def put(self, message: Any) -> bool:
+        """
+        adds a message to the ring, if there is enough space for it
+
+        :param message: message to add, must be picklable
+        :return: True if the message was added, False if it was dropped
+        """
+        data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        written, read = POSITIONS.unpack_from(self.memory.buf)
+
+        if self.capacity - (written - read) < LENGTH.size + len(data):
+            self.dropped += 1
+            return False
+
+        self.copy_in(written, LENGTH.pack(len(data)))
+        self.copy_in(written + LENGTH.size, data)
+        # publishing the message only once it is completely written
+        struct.pack_into("=Q", self.memory.buf, 0, written + LENGTH.size + len(data))
+        return True
+
+    def drain(self) -> Iterator[Any]:
+        """
+        removes all messages from the ring
+
+        :return: iterator on the messages, in the order in which they were added
+        """
+        written, read = POSITIONS.unpack_from(self.memory.buf)
+
+        while read < written:
+            length, = LENGTH.unpack(self.copy_out(read, LENGTH.size))
+            message = self.copy_out(read + LENGTH.size, length)
+            read += LENGTH.size + length
+            struct.pack_into("=Q", self.memory.buf, 8, read)
+            yield pickle.loads(message)
+
+    def close(self, unlink: bool=False):
+        """
+        detaches from the shared memory
+
+        :param unlink: whether to also destroy the shared memory or not, for the process that created it
+        """
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class RingWriter:
+    """
+    Producer side of a ring, ringing the doorbell of the consumer once per reactor iteration
+
+    :param ring: ring in which to write
+    :param doorbell: connection on which to notify the consumer
+    """
+    def __init__(self, ring: RingBuffer, doorbell: Connection):
+        self.ring = ring  # type: RingBuffer
+        self.doorbell = doorbell  # type: Connection
+        self.notify_call = None
+
+        os.set_blocking(doorbell.fileno(), False)
+
+    def put(self, message: Any):
+        """
+        adds the message to the ring, dropping it if the ring is full
+
+        :param message: message to add
+        """
+        if self.ring.put(message) and self.notify_call is None:
+            self.notify_call = reactor.callLater(0, self.notify)
+
+    def notify(self):
+        """
+        rings the doorbell of the consumer
+        """
+        self.notify_call = None
+        try:
+            os.write(self.doorbell.fileno(), b"\0")
+        except BlockingIOError:
+            # the consumer already has notifications pending
+            pass
+
+
+@implementer(IReadDescriptor)
+class RingReader:
+    """
+    Consumer side of a ring, draining it every time the doorbell rings
+
+    :param ring: ring from which to read
+    :param doorbell: connection on which the producer notifies new messages
+    :param callback: function called with each message
+    :param on_close: function called when the producer closed the doorbell
+    """
+    def __init__(self, ring: RingBuffer, doorbell: Connection, callback: Callable[[Any], None],
+                 on_close: Callable[[], None]):
+        self.ring = ring  # type: RingBuffer
+        self.doorbell = doorbell  # type: Connection
+        self.callback = callback
+        self.on_close = on_close
+
+        os.set_blocking(doorbell.fileno(), False)
+
+    def fileno(self) -> int:
+        """ the file descriptor of the doorbell """
+        return self.doorbell.fileno()
+
+    def doRead(self):
+        """
+        drains the ring after the doorbell rang
+        """
+        try:
+            if not os.read(self.doorbell.fileno(), 4096):
+                return ConnectionDone()
+        except BlockingIOError:
+            pass
+
+        for message in self.ring.drain():
+            try:
+                self.callback(message)
+            except Exception:
+                logging.exception("Error while handling message")
+
+    def connectionLost(self, reason):
+        """ called when the producer closed the doorbell """
+        self.on_close()
+
+    def logPrefix(self) -> str:
+        """ prefix used in the logs of the reactor """
+        return self.__class__.__name__
@@ -0,0 +1,215 @@
+"""
+Socket layer of the game nodes
+
+This handles the creation of the UDP sockets on which a node listens, with tunable kernel buffers.
+Several sockets can share the same port with SO_REUSEPORT, in which case the kernel spreads the clients
+between them, each socket having its own receive queue.
+
+Drop counters of the kernel are read from /proc, on Linux, to report datagrams lost before reaching
+the game.
+
+The address advertised to the players is found locally, without any outside connection.
+"""
+
+import logging
+import socket
+from typing import Dict, List
+
+from twisted.internet import reactor, udp
+from twisted.internet.error import CannotListenError
+from twisted.internet.protocol import DatagramProtocol
+
+from phagocyte_game_server.batching import BatchedPort
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+PROC_UDP_FILES = ["/proc/net/udp", "/proc/net/udp6"]
+PROC_SNMP_FILE = "/proc/net/snmp"
+
+
+class ListenerProtocol(DatagramProtocol):
+    """
+    Protocol forwarding the datagrams received on an additional socket to the main protocol
+
+    :param protocol: protocol handling the datagrams
+    """
+    def __init__(self, protocol: DatagramProtocol):
+        self.protocol = protocol
+
+    def datagramReceived(self, datagram: bytes, addr):
+        """ forwards the datagram to the main protocol """
+        self.protocol.datagramReceived(datagram, addr)
+
+
+def set_buffer_size(sock: socket.socket, option: int, force_option: int, size: int) -> int:
+    """
+    sets the size of a kernel buffer of the socket, bypassing the system maximum when allowed to
+
+    :param sock: socket to configure
+    :param option: socket option of the buffer
+    :param force_option: socket option to bypass the system maximum, or None if not available
+    :param size: size in bytes wanted for the buffer
+    :return: the size given by the kernel
+    """
+    try:
+        if force_option is None:
+            raise PermissionError()
+        sock.setsockopt(socket.SOL_SOCKET, force_option, size)
+    except PermissionError:
+        sock.setsockopt(socket.SOL_SOCKET, option, size)
+
+    return sock.getsockopt(socket.SOL_SOCKET, option)
+
+
+def advertised_address(auth_host: str, auth_port: int, interface: str="", advertise: str=None) -> str:
+    """
+    get the address under which the players can reach the node, in order of preference:
+
+        - the address explicitly given
+        - the address to which the node is bound, if it isn't bound to all interfaces
+        - the address of the interface routing to the authentication server
+
+    Connecting a UDP socket only asks the kernel for the route, nothing is sent on the network.
+
+    :param auth_host: address of the authentication server
+    :param auth_port: port of the authentication server
+    :param interface: address to which the node is bound, "" for all interfaces
+    :param advertise: address to advertise, None to find it
+    :return: the address to advertise
+    """
+    if advertise:
+        return advertise
+    elif interface not in ("", "0.0.0.0"):
+        return interface
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.connect((auth_host, auth_port))
+        return sock.getsockname()[0]
+
+
+def create_socket(port: int, rcvbuf: int=None, sndbuf: int=None, reuse_port: bool=False,
+                  interface: str="") -> socket.socket:
+    """
+    creates a non blocking UDP socket bound to the given port
+
+    :param port: port on which to bind
+    :param rcvbuf: size of the receive buffer, None to keep the system default
+    :param sndbuf: size of the send buffer, None to keep the system default
+    :param reuse_port: whether to allow other sockets to bind to the same port or not
+    :param interface: address of the interface on which to bind, "" for all of them
+    :raise CannotListenError: if the socket cannot be bound
+    :return: the socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    try:
+        sock.setblocking(False)
+
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        if rcvbuf is not None:
+            given = set_buffer_size(sock, socket.SO_RCVBUF, getattr(socket, "SO_RCVBUFFORCE", None), rcvbuf)
+            if given < rcvbuf:
+                logging.warning("Receive buffer limited to {} bytes by the system".format(given))
+
+        if sndbuf is not None:
+            given = set_buffer_size(sock, socket.SO_SNDBUF, getattr(socket, "SO_SNDBUFFORCE", None), sndbuf)
+            if given < sndbuf:
+                logging.warning("Send buffer limited to {} bytes by the system".format(given))
+
+        sock.bind((interface, port))
+    except OSError as e:
+        sock.close()
+        raise CannotListenError(interface, port, e)
+
+    return sock
+
+
+def listen(port: int, protocol: DatagramProtocol, listeners: int=1, rcvbuf: int=None, sndbuf: int=None,
+           batched: bool=False, interface: str="") -> List[udp.Port]:
+    """
+    listens on the given port with one or more sockets. The main protocol sends through the first one
+
+    :param port: port on which to listen
+    :param protocol: protocol handling the datagrams
+    :param listeners: number of sockets to open on the port
+    :param rcvbuf: size of the receive buffer of each socket, None to keep the system default
+    :param sndbuf: size of the send buffer of each socket, None to keep the system default
+    :param batched: whether to use batched system calls or not, when available
+    :param interface: address of the interface on which to listen, "" for all of them
+    :raise CannotListenError: if the port cannot be opened
+    :return: the ports listening
+    """
+    ports = []
+
+    for index in range(listeners):
+        sock = create_socket(port, rcvbuf, sndbuf, reuse_port=listeners > 1, interface=interface)
+        listener = protocol if index == 0 else ListenerProtocol(protocol)
+
+        try:
+            if batched and BatchedPort.available():
+                listening_port = BatchedPort._fromListeningDescriptor(
+                    reactor, sock.fileno(), sock.family, listener, maxPacketSize=8192
+                )
+                listening_port.startListening()
+            else:
+                listening_port = reactor.adoptDatagramPort(sock.fileno(), sock.family, listener)
+        finally:
+            # the port works on a duplicate of the file descriptor
+            sock.close()
+
+        ports.append(listening_port)
+
+    return ports
+
+
+def read_drops(port: int) -> Dict[str, int]:
+    """
+    reads the kernel counters of the sockets bound to the given port
+
+    :param port: port of the sockets
+    :return: datagrams dropped and bytes waiting in the queues of the sockets, empty if not available
+    """
+    counters = {"drops": 0, "rx_queue": 0, "tx_queue": 0}
+    local_port = ":{:04X}".format(port)
+
+    try:
+        for path in PROC_UDP_FILES:
+            with open(path) as proc_file:
+                next(proc_file)
+                for line in proc_file:
+                    fields = line.split()
+                    if not fields[1].endswith(local_port):
+                        continue
+                    tx_queue, rx_queue = fields[4].split(":")
+                    counters["tx_queue"] += int(tx_queue, 16)
+                    counters["rx_queue"] += int(rx_queue, 16)
+                    counters["drops"] += int(fields[12])
+    except (OSError, IndexError, ValueError):
+        return {}
+
+    return counters
+
+
+def read_udp_errors() -> Dict[str, int]:
+    """
+    reads the system wide UDP error counters
+
+    :return: errors by name, empty if not available
+    """
+    try:
+        with open(PROC_SNMP_FILE) as proc_file:
+            lines = [line.split() for line in proc_file if line.startswith("Udp:")]
+    except OSError:
+        return {}
+
+    if len(lines) < 2:
+        return {}
+
+    return {
+        name: int(value) for name, value in zip(lines[0][1:], lines[1][1:])
+        if name in ["InErrors", "RcvbufErrors", "SndbufErrors"]
+    }
@@ -0,0 +1,315 @@
+"""
+Game node split between an I/O process and a simulation process
+
+The I/O process owns the sockets. It decodes the datagrams received and passes them to the simulation
+process, and encodes and sends the messages the simulation asks it to send. Broadcast frames are sent
+to the I/O process as records, with the list of their recipients, and encoded only once there.
+
+The simulation process runs the game itself, without ever touching a socket or encoding JSON for the
+network, which keeps the tick free from the I/O work when there are many players.
+
+Both processes exchange their messages over ring buffers in shared memory.
+"""
+
+import json
+import json.decoder
+import logging
+import multiprocessing
+import tempfile
+from multiprocessing.connection import Connection
+from typing import Any, List, Tuple
+
+import atexit
+from twisted.internet import reactor, task
+from twisted.internet.error import CannotListenError
+from twisted.internet.protocol import DatagramProtocol
+
+from phagocyte_game_server import GameProtocol, create_logger, register
+from phagocyte_game_server.batching import BatchedPort
+from phagocyte_game_server.control import listen_control
+from phagocyte_game_server.custom_types import address, json_object
+from phagocyte_game_server.frames import Frame
+from phagocyte_game_server.gc_control import GCController
+from phagocyte_game_server.load import LoadReporter
+from phagocyte_game_server.memory import MemoryTracker
+from phagocyte_game_server.metrics import Metrics
+from phagocyte_game_server.profiling import Profiler
+from phagocyte_game_server.ring import RingBuffer, RingReader, RingWriter
+from phagocyte_game_server.sockets import listen, read_drops, read_udp_errors
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+RING_SIZE = 4 * 1024 * 1024  # type: int
+
+
+class IOProtocol(DatagramProtocol):
+    """
+    Protocol of the I/O process, forwarding datagrams to the simulation and sending its messages
+
+    :param logger: logger instance to use to report errors
+    :param writer: writer of the ring going to the simulation process
+    """
+    def __init__(self, logger: logging.Logger, writer: RingWriter):
+        self.logger = logger  # type: logging.Logger
+        self.writer = writer  # type: RingWriter
+
+    def datagramReceived(self, datagram: bytes, addr: address):
+        """
+        decodes the datagram received and forwards it to the simulation
+
+        :param datagram: datagram received from the client
+        :param addr: client address
+        """
+        try:
+            data = json.loads(datagram.decode("utf8"))
+        except json.decoder.JSONDecodeError:
+            self.logger.warning("Invalid json received : '{json}'".format(json=datagram.decode("utf-8")))
+        else:
+            self.writer.put((data, addr))
+
+    def handle_message(self, message: Tuple):
+        """
+        sends a message coming from the simulation
+
+        :param message: kind of the message followed by its content
+        """
+        kind = message[0]
+
+        if kind == "raw":
+            self.transport.write(message[1], message[2])
+        elif kind == "json":
+            self.transport.write(json.dumps(message[1]).encode("utf8"), message[2])
+        elif kind == "frame":
+            _, header, field, records, targets = message
+            frame = Frame(header, field, records)
+
+            for addr, start, count in targets:
+                segments = frame.segments(start, count)
+                if len(segments) == 1:
+                    self.transport.write(segments[0], addr)
+                else:
+                    self.transport.writeSequence(segments, addr)
+        else:
+            self.logger.error("Received invalid message from the simulation: {}".format(kind))
+
+
+class RingTransport:
+    """
+    Transport of the simulation process, passing the datagrams to the I/O process
+
+    :param writer: writer of the ring going to the I/O process
+    """
+    def __init__(self, writer: RingWriter):
+        self.writer = writer  # type: RingWriter
+
+    def write(self, datagram: bytes, addr: address=None):
+        """
+        sends a datagram already encoded
+
+        :param datagram: datagram to send
+        :param addr: address to which to send it
+        """
+        self.writer.put(("raw", bytes(datagram), addr))
+
+    def writeSequence(self, seq: List, addr: address=None):
+        """
+        sends a datagram made of the given segments
+
+        :param seq: segments of the datagram to send
+        :param addr: address to which to send it
+        """
+        self.write(b"".join(seq), addr)
+
+
+class SimulationProtocol(GameProtocol):
+    """
+    Game protocol leaving the encoding of its messages to the I/O process
+    """
+    def send_to(self, addr: address, data: json_object):
+        """
+        Sends the given data to the user identified by the given address
+
+        :param addr: address to which to send the data
+        :param data: data to send
+        """
+        self.transport.writer.put(("json", data, addr))
+
+    def send_frame(self, header: json_object, field: str, records: List[json_object],
+                   targets: List[Tuple[address, int, int]]):
+        """
+        Sends the records to the I/O process, that encodes them once for all targets
+
+        :param header: data to send along with the records
+        :param field: name of the field under which the records are sent
+        :param records: records to send
+        :param targets: address of each recipient, with the index of the first record and the number of
+                        records to send it, None for all of them
+        """
+        if targets:
+            self.transport.writer.put(("frame", header, field, records, targets))
+
+
+def stop_reactor():
+    """ stops the reactor if it is still running """
+    if reactor.running:
+        reactor.stop()
+
+
+def run_simulation(input_name: str, input_doorbell: Connection, output_name: str, output_doorbell: Connection,
+                   ip: str, port: int, auth_host: str, auth_port: int, name: str, capacity: int, debug: bool,
+                   profile_dir: str, tracemalloc: int, gc_freeze: bool, gc_thresholds: Tuple[int, int, int],
+                   gc_manual: bool, report_load: bool, control: str, **kwargs: Any):
+    """
+    entry point of the simulation process
+
+    :param input_name: name of the ring on which the I/O process sends the data received
+    :param input_doorbell: connection on which the I/O process notifies new data
+    :param output_name: name of the ring on which to send messages to the I/O process
+    :param output_doorbell: connection on which to notify the I/O process of new messages
+    :param ip: address under which the node was registered
+    :param port: port on which the node listens
+    :param auth_host: hostname of the authentication server
+    :param auth_port: port of the authentication server
+    :param name: name of the game server
+    :param capacity: capacity of the game server
+    :param debug: whether to turn on debugging or not
+    :param profile_dir: directory in which to write the profiles taken on demand
+    :param tracemalloc: number of lines of code allocating the most memory to report, 0 to not trace allocations
+    :param gc_freeze: whether to exclude the objects alive after startup from the garbage collections or not
+    :param gc_thresholds: thresholds of the generations of the garbage collector, None to keep the default ones
+    :param gc_manual: whether to run the garbage collections at the end of the ticks or not
+    :param report_load: whether to report the load of the simulation on the standard output, for the manager
+    :param control: path of the Unix domain socket on which to listen for commands, None to not listen
+    :param kwargs: additional arguments to pass to the GameProtocol
+    """
+    logger = create_logger(name + "-simulation", port, debug)
+
+    input_ring = RingBuffer.attach(input_name)
+    output_ring = RingBuffer.attach(output_name)
+    writer = RingWriter(output_ring, output_doorbell)
+
+    game_protocol = SimulationProtocol(auth_host, auth_port, capacity, logger, port=port, **kwargs)
+    game_protocol.ip = ip
+    game_protocol.makeConnection(RingTransport(writer))
+    game_protocol.metrics.register("ring", lambda: {"dropped": output_ring.dropped})
+    game_protocol.metrics.register("memory", MemoryTracker(tracemalloc).to_json)
+
+    gc_controller = GCController(game_protocol.metrics, thresholds=gc_thresholds, manual=gc_manual)
+    gc_controller.install()
+    game_protocol.gc_controller = gc_controller
+    if gc_freeze:
+        reactor.callWhenRunning(gc_controller.freeze)
+
+    Profiler(profile_dir, "{}-{}-simulation".format(name, port), logger).install()
+
+    if report_load:
+        LoadReporter(game_protocol).install()
+
+    if control is not None:
+        listen_control(control, game_protocol)
+
+    reactor.addReader(RingReader(input_ring, input_doorbell, lambda message: game_protocol.handle_data(*message),
+                                 on_close=stop_reactor))
+
+    logger.info("simulation launched")
+    reactor.run()
+
+    atexit.register(game_protocol.close)
+    input_ring.close()
+    output_ring.close()
+
+
+def run_split_node(port: int, auth_host: str, auth_port: int, name: str, capacity: int, debug: bool,
+                   batch_io: bool, listeners: int, rcvbuf: int, sndbuf: int, profile_dir: str=None,
+                   tracemalloc: int=0, gc_freeze: bool=False, gc_thresholds: Tuple[int, int, int]=None,
+                   gc_manual: bool=False, ring_size: int=RING_SIZE, interface: str="", advertise: str=None,
+                   report_load: bool=False, control: str=None, **kwargs: Any):
+    """
+    launches the game server as an I/O process, this one, and a simulation process
+
+    :param port: port on which to listen
+    :param auth_host: hostname of the authentication server to which to refer
+    :param auth_port: port of the authentication server to which to refer
+    :param name: name of the game server
+    :param capacity: capacity of the game server
+    :param debug: whether to turn on debugging or not
+    :param batch_io: whether to send and receive datagrams with batched system calls, on Linux
+    :param listeners: number of sockets sharing the port, with SO_REUSEPORT
+    :param rcvbuf: size of the kernel receive buffer of each socket, None for the system default
+    :param sndbuf: size of the kernel send buffer of each socket, None for the system default
+    :param profile_dir: directory in which to write the profiles taken on demand, None for the temporary directory
+    :param tracemalloc: number of lines of code allocating the most memory to report, 0 to not trace allocations
+    :param gc_freeze: whether to exclude the objects alive after startup from the garbage collections or not,
+                      in the simulation process
+    :param gc_thresholds: thresholds of the generations of the garbage collector of the simulation process,
+                          None to keep the default ones
+    :param gc_manual: whether to run the garbage collections at the end of the ticks in the simulation or not
+    :param ring_size: size in bytes of each ring between the processes
+    :param interface: address of the interface on which to listen, "" for all of them
+    :param advertise: address to give to the players, None to find it locally
+    :param report_load: whether to report the load of the simulation on the standard output, for the manager
+    :param control: path of the Unix domain socket on which the simulation listens for commands, None to not listen
+    :param kwargs: additional arguments to pass to the GameProtocol
+    """
+    logger = create_logger(name, port, debug)
+
+    input_ring = RingBuffer.create(ring_size)
+    output_ring = RingBuffer.create(ring_size)
+    input_reader, input_writer = multiprocessing.Pipe(duplex=False)
+    output_reader, output_writer = multiprocessing.Pipe(duplex=False)
+
+    try:
+        io_protocol = IOProtocol(logger, RingWriter(input_ring, input_writer))
+        listening_ports = listen(port, io_protocol, listeners, rcvbuf, sndbuf, batched=batch_io, interface=interface)
+    except CannotListenError as e:
+        input_ring.close(unlink=True)
+        output_ring.close(unlink=True)
+
+        if isinstance(e.socketError, PermissionError):
+            logger.error("Permission denied. Do you have the right to open port {} ?".format(port))
+        elif isinstance(e.socketError, OSError):
+            logger.error("Couldn't listen on port {}. Port is already used.".format(port))
+        else:
+            raise e.socketError
+        return
+
+    metrics = Metrics()
+    metrics.register("udp", lambda: dict(read_drops(port), **read_udp_errors()))
+    metrics.register("ring", lambda: {"dropped": input_ring.dropped})
+    metrics.register("memory", MemoryTracker(tracemalloc).to_json)
+
+    if isinstance(listening_ports[0], BatchedPort):
+        metrics.register("io", lambda: [p.to_json() for p in listening_ports])
+    elif batch_io:
+        logger.warning("Batched system calls are not available on this platform")
+
+    profile_dir = profile_dir or tempfile.gettempdir()
+    Profiler(profile_dir, "{}-{}".format(name, port), logger).install()
+
+    ip = register(auth_host, auth_port, interface, advertise, name=name, capacity=capacity, port=port, **kwargs)
+
+    simulation = multiprocessing.get_context("spawn").Process(
+        target=run_simulation, name=name + "-simulation",
+        args=(input_ring.name, input_reader, output_ring.name, output_writer, ip, port, auth_host, auth_port, name,
+              capacity, debug, profile_dir, tracemalloc, gc_freeze, gc_thresholds, gc_manual, report_load,
+              control),
+        kwargs=kwargs,
+    )
+    simulation.start()
+
+    # only the simulation keeps these ends open, so that each process sees the other one exiting
+    input_reader.close()
+    output_writer.close()
+
+    reactor.addReader(RingReader(output_ring, output_reader, io_protocol.handle_message, on_close=stop_reactor))
+    task.LoopingCall(lambda: logger.info("metrics: {}".format(json.dumps(metrics.to_json())))).start(30, now=False)
+
+    logger.info("server launched")
+    reactor.run()
+
+    input_writer.close()
+    simulation.join()
+    input_ring.close(unlink=True)
+    output_ring.close(unlink=True)
@@ -0,0 +1,828 @@
+"""
+Simulation core of the Phagocyte's game
+
+The world holds the whole state of a game and applies its rules. It knows nothing about the network,
+the reactor or the authentication server: inputs of the players are given to it, the game is advanced
+by calling its step functions with the current time, and those return the events that happened, for
+the caller to send or act upon.
+
+Food and bonuses never move: they are only sent to the players when they spawn or disappear. A checksum
+of the ids of those alive is kept up to date and sent periodically, so that players who missed some
+of these events can notice it and ask for the whole list again.
+"""
+
+import bisect
+import collections
+import random
+import uuid
+from math import ceil
+from typing import Dict, List, Set, Tuple
+
+from phagocyte_game_server.custom_types import address, json_object
+from phagocyte_game_server.events import Event
+from phagocyte_game_server.game_objects import Bonus, BonusTypes, Bullet, Food, GrabHook, Player
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+# records to send to all players, under the given field
+Broadcast = collections.namedtuple("Broadcast", ["header", "field", "records", "droppable"])
+# the player at the given address was eaten
+Death = collections.namedtuple("Death", ["addr"])
+# statistics to save for the player with the given uid
+Stats = collections.namedtuple("Stats", ["uid", "stats"])
+# the player with the given name won the game
+Win = collections.namedtuple("Win", ["name"])
+
+
+TICK_INTERVAL = 1 / 30  # type: float
+RECONNECTION_DELAY = 15  # type: int
+DISCONNECTION_DELAY = 60  # type: int
+DEATH_TTL = 60  # type: int
+INPUT_STEP = 1 / 30  # type: float
+INPUT_BURST = 4  # type: int
+MAX_PENDING_INPUTS = 10  # type: int
+IDLE = 4  # type: int
+IDLE_RESEND = 1  # type: float
+
+
+def checksum(uid: int) -> int:
+    """
+    get the contribution of an object to the checksum of its collection, combined with a xor
+
+    The id is scrambled so that ids close to each other don't cancel each other out.
+
+    :param uid: unique id of the object
+    """
+    return (uid * 2654435761) & 0xFFFFFFFF
+
+
+class DuplicateNameError(Exception):
+    """
+    Exception raised when a player tries to join with the name of someone still playing
+
+    :param name: name of the player
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+
+class World:
+    """
+    State and rules of a game
+
+    :param map_height: height of the map to handle
+    :param map_width: width of the map to handle
+    :param max_speed: maximum speed achievable by the players
+    :param max_hit_count: number of hits to take before loosing some matter
+    :param eat_ratio: size after which a player can eat another
+    :param min_radius: minimal size a player can have
+    :param food_production_rate: rate at which new food appears on the screen
+    :param win_size: size after which a player wins
+    :param now: time at which the world is created
+    """
+    def __init__(self, map_height: int, map_width: int, max_speed: int, max_hit_count: int, eat_ratio: float,
+                 min_radius: int, food_production_rate: float, win_size: int, now: float):
+        self.players = dict()  # type: Dict[address, Player]
+        self.moves = dict()  # type: Dict[address, Tuple[int, int]]
+        self.inputs = dict()  # type: Dict[address, collections.deque[Tuple[int, int]]]
+        # address of the player to which each resume token was given
+        self.sessions = dict()  # type: Dict[str, address]
+        self.deaths = dict()  # type: Dict[address, float]
+        self.food = collections.deque()  # type: collections.deque[Food]
+        self.bullets = collections.deque()  # type: collections.deque[Bullet]
+        self.bonuses = collections.deque()  # type: collections.deque[Bonus]
+        self.new_bullets = dict()  # type: Dict[address, float]
+        self.spawned_food = []  # type: List[Food]
+        self.food_checksum = 0  # type: int
+        self.bonuses_checksum = 0  # type: int
+        self.last_players_update = now  # type: float
+
+        self.max_x = map_width  # type: int
+        self.max_y = map_height  # type: int
+        self.default_radius = min_radius  # type: int
+        self.max_speed = max_speed  # type: int
+        self.eat_ratio = eat_ratio  # type: float
+
+        # chances of spawning food and bonuses on a tick of TICK_INTERVAL, scaled for the actual interval
+        self.food_production_rate = food_production_rate  # type: int
+        self.new_bonuses_ratio = 3  # type: int
+        self.tick_interval = TICK_INTERVAL  # type: float
+
+        self.max_hit_count = max_hit_count  # type: int
+        self.bonus_time = 10  # type: int
+        self.win_size = win_size  # type: int
+
+        self.winning_player = None  # type: str
+        self.finished = None  # type: bool
+
+    # inputs of the players
+
+    def join(self, addr: address, uid: str, name: str, color: str, now: float) -> json_object:
+        """
+        adds a player to the game, or gives them back their disc if they were disconnected
+
+        :param addr: address of the player
+        :param uid: unique id of the player, None for anonymous players
+        :param name: name of the player
+        :param color: color of the player
+        :param now: current time
+        :raise DuplicateNameError: if someone with the same name is still playing
+        :return: information about the game to send to the player, with the token to resume their session
+        """
+        for old_addr, player in self.players.items():
+            if player.name == name:
+                if now - player.timestamp < RECONNECTION_DELAY:
+                    raise DuplicateNameError(name)
+                # the new client numbers its inputs from scratch, what the previous one sent is meaningless
+                client = self.rekey(old_addr, addr, keep_inputs=False)
+                client.input_seq = None
+                self.sessions.pop(client.resume_token, None)
+                break
+        else:
+            client = Player(uid, name, color, self.default_radius, self.max_x, self.max_y, now)
+            self.players[addr] = client
+
+        client.resume_token = uuid.uuid4().hex
+        self.sessions[client.resume_token] = addr
+
+        info = dict(
+            event=Event.GAME_INFO, name=name, max_x=self.max_x, max_y=self.max_y, win_size=self.win_size,
+            x=client.x, y=client.y, color=color, size=client.size,
+            others=[p.to_json() for p in self.players.values() if p is not client], resume=client.resume_token,
+        )
+
+        return info
+
+    def resume(self, token: str, addr: address, now: float) -> Tuple[address, json_object]:
+        """
+        gives a player back their disc, from a new address if it changed, without going through the whole join
+
+        :param token: token given to the player when they joined
+        :param addr: address of the player
+        :param now: current time
+        :return: previous address of the player and what they need to catch up, None if the token is unknown
+                 or the player left the game
+        """
+        old_addr = self.sessions.get(token)
+        if old_addr not in self.players:
+            return None
+
+        player = self.rekey(old_addr, addr, keep_inputs=True)
+        self.sessions[token] = addr
+        player.timestamp = now
+
+        you = player.to_json()
+        you["ack"] = player.input_seq
+
+        # the other players and the bullets will come with the next updates, the player only needs to know who
+        # left, and whether they missed spawns or despawns of the food and bonuses
+        return old_addr, dict(
+            event=Event.RESUME, t=now, you=you, players=[p.name for p in self.players.values()], sync=self.checksums()
+        )
+
+    def move(self, addr: address, position: Tuple[int, int]):
+        """
+        records the position a player wants to go to, applied on the next step
+
+        :param addr: address of the player
+        :param position: position wanted by the player
+        """
+        self.moves[addr] = position
+
+    def push_input(self, addr: address, seq: int, direction: int):
+        """
+        records a direction in which a player wants to move, applied for INPUT_STEP seconds on a next step
+
+        Clients predict the movement of their player from their own inputs, and correct it with the position
+        sent back with the sequence number of the last input applied.
+
+        :param addr: address of the player
+        :param seq: sequence number of the input, increasing for each input sent by the player
+        :param direction: direction on both axes, encoded as 3 * (x + 1) + (y + 1), with x and y in -1, 0, 1
+        """
+        player = self.players[addr]
+        if direction not in range(9) or (player.input_seq is not None and seq <= player.input_seq):
+            return
+
+        inputs = self.inputs.get(addr)
+        if inputs is None:
+            inputs = self.inputs[addr] = collections.deque(maxlen=MAX_PENDING_INPUTS)
+        elif inputs and seq <= inputs[-1][0]:
+            return
+
+        inputs.append((seq, direction))
+
+    def shoot(self, addr: address, angle: float):
+        """
+        records a bullet shot by a player
+
+        :param addr: address of the player
+        :param angle: angle at which the bullet is shot
+        """
+        self.new_bullets[addr] = angle
+
+    def throw_hook(self, addr: address, angle: float):
+        """
+        throws the hook of a player, if it is not already thrown
+
+        :param addr: address of the player
+        :param angle: angle at which the hook is thrown
+        """
+        player = self.players[addr]
+        if player.hook is None:
+            player.hook = GrabHook(player, angle)
+
+    def keep_alive(self, addr: address, now: float):
+        """
+        notes that a player is still connected
+
+        :param addr: address of the player
+        :param now: current time
+        """
+        self.players[addr].timestamp = now
+
+    def leave(self, addr: address):
+        """
+        removes a player from the game
+
+        :param addr: address of the player
+        """
+        self.players.pop(addr, None)
+        self.forget_inputs(addr)
+
+    def rekey(self, old_addr: address, addr: address, keep_inputs: bool) -> Player:
+        """
+        moves a player to a new address
+
+        :param old_addr: previous address of the player
+        :param addr: new address of the player
+        :param keep_inputs: whether the inputs not applied yet follow the player, or are dropped
+        :return: the player
+        """
+        player = self.players.pop(old_addr)
+        self.players[addr] = player
+
+        for inputs in [self.moves, self.inputs, self.new_bullets]:
+            if keep_inputs and old_addr in inputs:
+                inputs[addr] = inputs.pop(old_addr)
+            else:
+                inputs.pop(old_addr, None)
+
+        return player
+
+    def forget_inputs(self, addr: address):
+        """
+        drops the inputs received from an address that were not applied yet
+
+        :param addr: address of the player
+        """
+        for inputs in [self.moves, self.inputs, self.new_bullets]:
+            inputs.pop(addr, None)
+
+    # steps of the simulation
+
+    def step(self, now: float) -> List:
+        """
+        advances all parts of the game that are updated on every tick
+
+        :param now: current time
+        :return: events that happened
+        """
+        events = self.step_players(now)
+        events.extend(self.step_food(now))
+        events.extend(self.step_bullets(now))
+        events.extend(self.step_bonuses(now))
+        events.extend(self.step_hooks())
+        return events
+
+    def step_new_bullets(self, now: float) -> List:
+        """
+        adds the bullets shot since the last call
+
+        Bullets are only sent to the players when they are shot, and when they hit something or leave the
+        map: players simulate their path in the meantime.
+
+        :param now: current time
+        :return: events that happened
+        """
+        spawned = []  # type: List[json_object]
+
+        for addr, angle in self.new_bullets.items():
+            player = self.players.get(addr)
+            if player is not None and player.size > player.initial_size:
+                bullet = Bullet(angle, player, now)
+                self.bullets.append(bullet)
+                spawned.append(bullet.to_json())
+
+        self.new_bullets = dict()  # type: Dict[address, float]
+
+        if spawned:
+            return [Broadcast(dict(event=Event.BULLETS, deleted=[], t=now), "bullets", spawned, False)]
+        return []
+
+    def step_bullets(self, now: float) -> List:
+        """
+        moves the bullets, checks for collisions and updates results
+
+        :param now: current time
+        :return: events that happened
+        """
+        deleted_bullets = []  # type: List[int]
+
+        # players sorted on the x axis, to only check the bullets against those close enough to be hit
+        players = sorted(self.players.values(), key=lambda p: p.x)
+        positions = [player.x for player in players]
+        reach = max((player.radius for player in players), default=0)
+
+        for i in range(len(self.bullets)):
+            bullet = self.bullets.popleft()
+            bullet.move(now, self.max_x, self.max_y)
+
+            start = bisect.bisect_left(positions, bullet.x - reach)
+            end = bisect.bisect_right(positions, bullet.x + reach, start)
+
+            for player in players[start:end]:
+                if player is not bullet.player() and player.collides_with(bullet):
+                    if player.bonus != BonusTypes.SHIELD:
+                        self.hit(player, bullet)
+
+                    deleted_bullets.append(bullet.uid)
+                    break
+            else:
+                if bullet.x == self.max_x - bullet.radius or bullet.x == bullet.radius or \
+                        bullet.y == self.max_y - bullet.radius or bullet.y == bullet.radius:
+                    deleted_bullets.append(bullet.uid)
+                else:
+                    self.bullets.append(bullet)
+
+        if deleted_bullets:
+            return [Broadcast(dict(event=Event.BULLETS, deleted=deleted_bullets, t=now), "bullets", [], False)]
+        return []
+
+    def hit(self, player: Player, bullet: Bullet):
+        """
+        makes a player lose some matter, thrown around them as food, once hit by enough bullets
+
+        :param player: player that was hit
+        :param bullet: bullet that hit the player
+        """
+        player.hit_count += ceil((bullet.size / 10)**.5)
+        if player.hit_count >= self.max_hit_count:
+            player.hit_count = 0
+
+            if player.size >= player.initial_size:
+                lost_size = player.size / 3
+                player.matter_lost += lost_size
+                player.size = max(player.initial_size, player.size - lost_size)
+                player.radius = player.size / 2
+                self.throw_food(int(lost_size), player.x, player.y, player.radius)
+
+    def throw_food(self, size_to_dispatch: float, player_x: float, player_y: float, player_radius: float):
+        """
+        Throwss some food around the player
+
+        :param size_to_dispatch: quantity of food to throw
+        :param player_x: position of the player on the x axis
+        :param player_y: position of the player on the y axis
+        :param player_radius: radius of the player
+        """
+        while size_to_dispatch > 10:
+            size = random.randint(10, size_to_dispatch)
+            size_to_dispatch -= size
+            radius = size / 2
+            self.add_food(Food(
+                radius,
+                max(radius, (min(self.max_x - radius, random.randint(
+                    int(player_x - 5 * player_radius), int(5 * player_radius + player_x)
+                )))),
+                max(radius, (min(self.max_y - radius, random.randint(
+                    int(player_y - 5 * player_radius), int(5 * player_radius + player_y)
+                )))),
+            ))
+
+    def add_food(self, food: Food):
+        """
+        adds food to the game, to be sent to the players on the next step of the food
+
+        :param food: food to add
+        """
+        self.food.appendleft(food)
+        self.spawned_food.append(food)
+        self.food_checksum ^= checksum(food.uid)
+
+    def add_bonus(self, bonus: Bonus):
+        """
+        adds a bonus to the game
+
+        :param bonus: bonus to add
+        """
+        self.bonuses.append(bonus)
+        self.bonuses_checksum ^= checksum(bonus.uid)
+
+    def step_players(self, now: float) -> List:
+        """
+        applies the moves of all the players and handle collisions between them
+
+        :param now: current time
+        :return: events that happened
+        """
+        events = []
+        data = self.step_inputs(now)  # type: List[json_object]
+        droppable = True
+
+        for addr, update in self.moves.items():
+            player = self.players.get(addr)
+            if update is None or player is None:
+                continue
+
+            if addr in self.inputs:
+                # players move either with inputs or with positions, never both in the same tick
+                self.moves[addr] = None
+                continue
+
+            elapsed = now - player.timestamp
+            if elapsed <= 0:
+                # the speed can't be checked yet, the position will be applied on the next step
+                continue
+
+            factor_x = factor_y = 0
+
+            delta_x = update[0] - player.x
+            delta_y = update[1] - player.y
+            speed_x = abs(delta_x / elapsed)
+            speed_y = abs(delta_y / elapsed)
+
+            max_speed = player.max_speed * 1.5 if player.bonus == BonusTypes.SPEEDUP else player.max_speed
+
+            if speed_x > max_speed:
+                factor_x = delta_x * max_speed / speed_x
+                player.x = min(self.max_x - player.radius, max(
+                    player.radius, player.x + factor_x
+                ))
+            else:
+                player.x = min(self.max_x - player.radius, max(player.radius, update[0]))
+
+            if speed_y > max_speed:
+                factor_y = delta_y * max_speed / speed_y
+                player.y = min(self.max_y - player.radius, max(
+                    player.radius, player.y + factor_y
+                ))
+            else:
+                player.y = min(self.max_y - player.radius, max(player.radius, update[1]))
+
+            _json = player.to_json()
+            if factor_x or factor_y or player.grabbed_x or player.grabbed_y:
+                _json["dirty"] = (factor_x + player.grabbed_x - delta_x, factor_y + player.grabbed_y - delta_y)
+                player.grabbed_x = player.grabbed_y = 0
+                droppable = False
+
+            data.append(_json)
+            self.moves[addr] = None
+            player.timestamp = now
+
+        deaths = set()  # type: Set[address]
+
+        for eater_addr, eater in self.players.items():
+            for eaten_addr, eaten in self.players.items():
+                if eaten_addr in deaths or eater_addr in deaths:
+                    continue
+
+                if eaten.size > eater.size * self.eat_ratio:
+                    # the eaten is bigger than the eater, let's inverse roles
+                    eater, eaten = eaten, eater
+                    eater_addr, eaten_addr = eaten_addr, eater_addr
+                elif eater.size < eaten.size * self.eat_ratio:
+                    # eater is not big enough to eat the eaten, we go on
+                    continue
+
+                if eater.collides_with(eaten):
+                    eater.update_size(eaten)
+                    deaths.add(eaten_addr)
+
+                    if eaten.uid is not None:
+                        events.append(Stats(eaten.uid, eaten.get_stats(now, died=True)))
+
+                    if eater.size > self.win_size:
+                        events.extend(self.win(eater, now))
+
+        corpses = []
+        for death in deaths:
+            corpses.append(self.players.pop(death).name)
+            self.moves.pop(death, None)
+            self.inputs.pop(death, None)
+            # remembering the dead until they acknowledge their death, or for a while if they never do
+            self.deaths[death] = now
+            events.append(Death(death))
+
+        if len(data) or len(corpses):
+            events.append(Broadcast(dict(event=Event.STATE, deaths=corpses, t=now), "updates", data,
+                                    droppable and not corpses))
+
+        return events
+
+    def step_inputs(self, now: float) -> List[json_object]:
+        """
+        moves the players sending inputs, by INPUT_STEP seconds for each of their inputs
+
+        Players can only apply inputs as fast as time goes by, with a small burst allowed to catch up
+        on the jitter of the network: sending them faster doesn't make them move faster.
+
+        :param now: current time
+        :return: state of each player that moved or needs to be sent again, with the last input applied
+        """
+        data = []  # type: List[json_object]
+        # rounded, for ticks as long as an input step to allow exactly one input despite floating point errors
+        credit = round((now - self.last_players_update) / INPUT_STEP, 3)
+        self.last_players_update = now
+
+        for addr, inputs in self.inputs.items():
+            player = self.players.get(addr)
+            if player is None:
+                continue
+
+            player.input_credit = min(INPUT_BURST, player.input_credit + credit)
+
+            step = player.max_speed * INPUT_STEP
+            if player.bonus == BonusTypes.SPEEDUP:
+                step *= 1.5
+
+            position = (player.x, player.y)
+
+            while inputs and player.input_credit >= 1:
+                seq, direction = inputs.popleft()
+                player.input_credit -= 1
+                player.input_seq = seq
+                player.timestamp = now
+                player.x = min(self.max_x - player.radius, max(player.radius, player.x + (direction // 3 - 1) * step))
+                player.y = min(self.max_y - player.radius, max(player.radius, player.y + (direction % 3 - 1) * step))
+
+            if position != (player.x, player.y) or player.grabbed_x or player.grabbed_y:
+                # sent once more on the next step, for the players who stop to be seen where they stopped
+                player.resend_at = now
+            elif now >= player.resend_at:
+                # players that don't move are only sent from time to time, in case their last update was lost
+                player.resend_at = now + IDLE_RESEND
+            else:
+                continue
+
+            # the position sent is authoritative, players being grabbed by a hook only need it to be sent
+            player.grabbed_x = player.grabbed_y = 0
+
+            _json = player.to_json()
+            _json["ack"] = player.input_seq
+            data.append(_json)
+
+        return data
+
+    def step_food(self, now: float) -> List:
+        """
+        randomly adds new food and checks for collisions against all players
+
+        :param now: current time
+        :return: events that happened
+        """
+        events = []
+        deletions = []  # type: List[int]
+
+        chance = self.food_production_rate * self.tick_interval / TICK_INTERVAL
+        if random.random() * 100 < chance and len(self.food) < 50 + 50 * len(self.players)**1.1:
+            radius = random.randint(5, 25)
+            self.add_food(Food(
+                radius, random.randint(radius, self.max_x - radius), random.randint(radius, self.max_y - radius)
+            ))
+
+        for i in range(min(len(self.food), 70)):
+            food = self.food.popleft()
+            for player in self.players.values():
+                if player.collides_with(food):
+                    player.update_size(food)
+                    deletions.append(food.uid)
+                    self.food_checksum ^= checksum(food.uid)
+                    if player.size > self.win_size:
+                        events.extend(self.win(player, now))
+                    break
+            else:
+                self.food.append(food)
+
+        spawned = [food.to_json() for food in self.spawned_food if food.uid not in deletions]
+        self.spawned_food = []  # type: List[Food]
+
+        if spawned or deletions:
+            # spawns and despawns are only sent once, they cannot be dropped
+            events.append(Broadcast(dict(event=Event.FOOD, deleted=deletions), "food", spawned, False))
+        return events
+
+    def step_bonuses(self, now: float) -> List:
+        """
+        expires the bonuses of the players, randomly adds new bonuses in the game and checks for
+        collisions against all players
+
+        :param now: current time
+        :return: events that happened
+        """
+        deletions = []  # type: List[int]
+        spawned = []  # type: List[json_object]
+
+        for player in self.players.values():
+            if player.bonus_expiry is not None and player.bonus_expiry <= now:
+                player.bonus = None
+                player.bonus_expiry = None
+
+        chance = self.new_bonuses_ratio * self.tick_interval / TICK_INTERVAL
+        if random.random() * 1000 < chance and len(self.bonuses) < 5 * len(self.players) ** 1.1:
+            bonus = Bonus(self.max_x, self.max_y)
+            self.add_bonus(bonus)
+            spawned.append(bonus.to_json())
+
+        for i in range(min(len(self.bonuses), 70)):
+            bonus = self.bonuses.popleft()
+            for player in self.players.values():
+                if player.collides_with(bonus):
+                    player.bonus = bonus.bonus
+                    player.bonus_expiry = now + self.bonus_time
+                    deletions.append(bonus.uid)
+                    self.bonuses_checksum ^= checksum(bonus.uid)
+                    player.bonuses_taken += 1
+                    break
+            else:
+                self.bonuses.append(bonus)
+
+        if spawned or deletions:
+            return [Broadcast(dict(event=Event.BONUS, deleted=deletions), "bonus", spawned, False)]
+        return []
+
+    def step_hooks(self) -> List:
+        """
+        handles the movements and throwing of grab hooks
+
+        :return: events that happened
+        """
+        for player1 in self.players.values():
+            hook = player1.hook
+            if hook is None:
+                continue
+            elif hook.hooked_player is None:
+                # we need to find if a player is hit by the hook
+                for player2 in self.players.values():
+                    if player2 == player1:
+                        continue
+
+                    if player2.collides_with(hook):
+                        hook.hooked_player = player2
+                        player1.successful_hooks += 1
+                        break
+
+                else:
+                    step = 2 * player1.initial_max_speed * self.tick_interval
+                    hook.x = max(0, min(self.max_x, hook.x + step * hook.ratio_x))
+                    hook.y = max(0, min(self.max_y, hook.y + step * hook.ratio_y))
+
+                    if (hook.x - player1.x) ** 2 + (hook.y - player1.y) ** 2 >= (2 * player1.size) ** 2:
+                        player1.hook = None
+
+            else:
+                # we need to move the players closer from each other
+                player2 = hook.hooked_player
+
+                move_ratio1 = player1.size / (player1.size + player2.size)
+                move_ratio2 = 1 - move_ratio1
+
+                total_movement = (player1.max_speed + player2.max_speed) * self.tick_interval
+
+                x_delta = player1.x - player2.x
+                y_delta = player1.y - player2.y
+
+                x_ratio = abs(x_delta) / (abs(x_delta) + abs(y_delta))
+                y_ratio = 1 - x_ratio
+
+                if x_delta > 0:
+                    movement_x = min(total_movement * x_ratio, x_delta)
+                else:
+                    movement_x = max(-total_movement * x_ratio, x_delta)
+
+                if y_delta > 0:
+                    movement_y = min(total_movement * y_ratio, y_delta)
+                else:
+                    movement_y = max(-total_movement * y_ratio, y_delta)
+
+                player1.grabbed_x -= movement_x * move_ratio1
+                player1.grabbed_y -= movement_y * move_ratio1
+
+                player2.grabbed_x += movement_x * move_ratio2
+                player2.grabbed_y += movement_y * move_ratio2
+
+                hook.moves += 1
+                if hook.moves >= 15:
+                    player1.hook = None
+                else:
+                    hook.x = player2.x
+                    hook.y = player2.y
+
+        return []
+
+    def step_disconnects(self, now: float) -> List:
+        """
+        removes the players that were not connected for too long, and cleans up what they left behind
+
+        :param now: current time
+        :return: events that happened
+        """
+        alives = []
+        deads = []
+
+        for addr, player in self.players.items():
+            if now - player.timestamp > DISCONNECTION_DELAY:
+                deads.append(addr)
+            else:
+                alives.append(player.to_json())
+
+        for dead in deads:
+            self.players.pop(dead)
+
+        self.cleanup(now)
+        return [Broadcast(dict(event=Event.ALIVE), "alives", alives, False)]
+
+    def cleanup(self, now: float):
+        """
+        forgets the dead that never acknowledged their death, and the inputs and sessions of players that left
+
+        :param now: current time
+        """
+        for addr in [addr for addr, time_of_death in self.deaths.items() if now - time_of_death > DEATH_TTL]:
+            del self.deaths[addr]
+
+        for inputs in [self.moves, self.inputs, self.new_bullets]:
+            for addr in [addr for addr in inputs if addr not in self.players]:
+                del inputs[addr]
+
+        for token in [token for token, addr in self.sessions.items() if addr not in self.players]:
+            del self.sessions[token]
+
+    def step_sync(self) -> List:
+        """
+        sends the number and the checksum of the food and bonuses in the game, for players to check that
+        they didn't miss any spawn or despawn
+
+        :return: events that happened
+        """
+        return [Broadcast(dict(event=Event.SYNC), "sync", self.checksums(), True)]
+
+    def checksums(self) -> List[json_object]:
+        """
+        get the number and the checksum of the food and bonuses in the game
+
+        :return: one record for each kind of object, with the field in which their spawns are sent
+        """
+        return [
+            {"field": "food", "count": len(self.food), "checksum": self.food_checksum},
+            {"field": "bonus", "count": len(self.bonuses), "checksum": self.bonuses_checksum},
+        ]
+
+    def snapshot(self) -> Dict[str, List[json_object]]:
+        """
+        get all the food and bonuses in the game, for players that need to resynchronize
+
+        :return: records of the food and bonuses, under the fields in which their spawns are sent
+        """
+        return {
+            "food": [food.to_json() for food in self.food],
+            "bonus": [bonus.to_json() for bonus in self.bonuses],
+        }
+
+    def sizes(self) -> Dict[str, int]:
+        """
+        get the number of entries of each container of the world, to track the memory used
+
+        :return: size of each container, by name
+        """
+        return {
+            "players": len(self.players),
+            "moves": len(self.moves),
+            "inputs": len(self.inputs),
+            "sessions": len(self.sessions),
+            "deaths": len(self.deaths),
+            "food": len(self.food),
+            "bullets": len(self.bullets),
+            "bonuses": len(self.bonuses),
+            "new_bullets": len(self.new_bullets),
+        }
+
+    def win(self, winner: Player, now: float) -> List:
+        """
+        ends the game
+
+        :param winner: player that won
+        :param now: current time
+        :return: events that happened
+        """
+        self.finished = True
+        self.winning_player = winner.name
+
+        events = [Win(winner.name)]
+        events.extend(
+            Stats(player.uid, player.get_stats(now, won=(player == winner)))
+            for player in self.players.values() if player.uid is not None
+        )
+        return events
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from phagocyte_game_benchmarks import compare, run
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def results(self, **times):
+        return {"results": {name: {"min": value, "median": value, "number": 1} for name, value in times.items()}}
+
+    def test_run_selected_benchmarks(self):
+        results = run(["collides_with", "handle_players"], repeat=1, min_time=0.001)["results"]
+
+        self.assertEqual(list(results.keys()), ["collides_with", "handle_players[10]", "handle_players[50]",
+                                                "handle_players[200]"])
+        self.assertTrue(all(result["min"] > 0 for result in results.values()))
+
+    def test_compare_flags_regressions(self):
+        comparison = compare(self.results(a=1, b=1, c=1), self.results(a=1.05, b=1.2, d=1), threshold=0.1)
+
+        self.assertEqual(comparison, [("a", 1, 1.05, False), ("b", 1, 1.2, True)])
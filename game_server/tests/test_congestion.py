@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from phagocyte_game_server.congestion import CongestionController, ReceiveWindow
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestCongestion(unittest.TestCase):
+
+    @staticmethod
+    def exchange(controller: CongestionController, window: ReceiveWindow, start: int, end: int,
+                 lost_every: int=None):
+        for seq in range(start, end):
+            controller.on_send(seq, seq)
+            if lost_every is None or seq % lost_every:
+                window.receive(seq, seq)
+            if seq % 3 == 2:
+                ack = window.to_json(seq)
+                controller.on_ack(ack["seq"], ack["mask"], ack["delay"], seq + 0.1)
+
+    def test_window_acknowledges_previous_sequences(self):
+        window = ReceiveWindow()
+        for seq in [0, 1, 3, 2, 5]:
+            window.receive(seq, 0)
+
+        self.assertEqual(window.seq, 5)
+        self.assertEqual(window.mask, 0b11110)
+
+    def test_healthy_link_keeps_full_rate(self):
+        controller = CongestionController()
+        self.exchange(controller, ReceiveWindow(), 0, 300)
+
+        self.assertEqual(controller.interval, 1)
+        self.assertEqual(controller.loss, 0)
+
+    def test_lossy_link_slows_down_and_recovers(self):
+        controller = CongestionController()
+        window = ReceiveWindow()
+        self.exchange(controller, window, 0, 300, lost_every=4)
+
+        self.assertEqual(controller.interval, controller.max_interval)
+        self.assertIsNotNone(controller.max_records)
+
+        self.exchange(controller, window, 300, 900)
+        self.assertEqual(controller.interval, 1)
+        self.assertIsNone(controller.max_records)
+
+    def test_limited_payload_rotates_records(self):
+        controller = CongestionController()
+        controller.max_records = 8
+
+        self.assertEqual(controller.payload(5), (0, None))
+        self.assertEqual(controller.payload(20), (0, 8))
+        self.assertEqual(controller.payload(20), (8, 8))
+        self.assertEqual(controller.payload(20), (16, 8))
+        self.assertEqual(controller.payload(20), (4, 8))
+
+    def test_client_without_acknowledgements_keeps_full_rate(self):
+        controller = CongestionController()
+        for seq in range(1000):
+            controller.on_send(seq, seq)
+
+        self.assertEqual(controller.interval, 1)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import json
+import unittest
+
+from twisted.internet import reactor
+from twisted.internet.testing import StringTransport
+
+from phagocyte_game_benchmarks import create_protocol
+from phagocyte_game_server.control import ControlFactory
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestControl(unittest.TestCase):
+
+    def setUp(self):
+        self.game = create_protocol(10)
+        self.control = ControlFactory(self.game).buildProtocol(None)
+        self.transport = StringTransport()
+        self.control.makeConnection(self.transport)
+
+    def tearDown(self):
+        for call in reactor.getDelayedCalls():
+            call.cancel()
+
+    def send(self, **command) -> dict:
+        self.transport.clear()
+        self.control.dataReceived(json.dumps(command).encode("utf8") + b"\n")
+        return json.loads(self.transport.value().decode("utf8"))
+
+    def test_stats(self):
+        stats = self.send(command="stats")
+
+        self.assertEqual(stats["players"], 10)
+        self.assertEqual(stats["tunables"]["capacity"], 10)
+        self.assertIn("players", stats["metrics"])
+
+    def test_set_tunables(self):
+        tunables = self.send(command="set", tunables={"food_production_rate": 20, "tick_rate": 20})["tunables"]
+
+        self.assertEqual(tunables["food_production_rate"], 20)
+        self.assertEqual(self.game.world.food_production_rate, 20)
+        self.assertAlmostEqual(self.game.tick_loops[0].interval, 1 / 20)
+
+    def test_set_unknown_tunable_changes_nothing(self):
+        reply = self.send(command="set", tunables={"max_hit_count": 100, "max_speed": 100})
+
+        self.assertIn("error", reply)
+        self.assertEqual(self.game.world.max_hit_count, 10)
+
+    def test_set_invalid_tunables(self):
+        self.assertEqual(self.send(command="set", tunables=[20]), {"error": "invalid value"})
+        self.assertEqual(self.send(command="stats")["players"], 10)
+
+    def test_drain_refuses_new_players(self):
+        self.assertEqual(self.send(command="drain"), {"draining": True})
+
+        self.game.handle_data({"event": 1, "name": "late"}, ("10.1.0.1", 1000))
+        self.assertEqual(len(self.game.players), 10)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import json
+import unittest
+
+from phagocyte_game_server.frames import Frame
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestFrames(unittest.TestCase):
+
+    frame = Frame({"event": 4, "deleted": []}, "food", [{"x": i} for i in range(5)])
+
+    def decode(self, segments):
+        return json.loads(b"".join(segments).decode("utf-8"))
+
+    def test_full_frame_is_a_single_segment(self):
+        segments = self.frame.segments()
+
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(self.decode(segments), {"event": 4, "deleted": [], "food": [{"x": i} for i in range(5)]})
+
+    def test_partial_frame(self):
+        self.assertEqual(self.decode(self.frame.segments(1, 2))["food"], [{"x": 1}, {"x": 2}])
+
+    def test_partial_frame_wraps_around(self):
+        self.assertEqual(self.decode(self.frame.segments(4, 2))["food"], [{"x": 4}, {"x": 0}])
+
+    def test_empty_frame(self):
+        self.assertEqual(self.decode(Frame({}, "food", []).segments(0, 3)), {"food": []})
+
+    def test_chunks_fit_in_size(self):
+        frame = Frame({"event": 12}, "food", [{"uid": i} for i in range(100)])
+        chunks = frame.chunks(100)
+
+        self.assertTrue(all(sum(len(segment) for segment in chunk) <= 100 for chunk in chunks))
+        self.assertEqual([record for chunk in chunks for record in self.decode(chunk)["food"]],
+                         [{"uid": i} for i in range(100)])
+
+    def test_chunks_of_empty_frame(self):
+        self.assertEqual([self.decode(chunk) for chunk in Frame({}, "food", []).chunks(100)], [{"food": []}])
+
+    def test_chunks_keep_records_bigger_than_size(self):
+        chunks = Frame({}, "food", [{"x": "a" * 100}, {"x": 1}]).chunks(50)
+
+        self.assertEqual([self.decode(chunk)["food"] for chunk in chunks], [[{"x": "a" * 100}], [{"x": 1}]])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import gc
+import unittest
+
+from twisted.internet import reactor
+
+from phagocyte_game_server.gc_control import GCController
+from phagocyte_game_server.metrics import Metrics
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestGCController(unittest.TestCase):
+
+    def setUp(self):
+        self.thresholds = gc.get_threshold()
+        self.metrics = Metrics()
+
+    def tearDown(self):
+        gc.callbacks.remove(self.controller.on_collection)
+        gc.set_threshold(*self.thresholds)
+        gc.enable()
+        for call in reactor.getDelayedCalls():
+            call.cancel()
+
+    def fill_young_generation(self, ratio=1):
+        return [[] for _ in range(int(gc.get_threshold()[0] * ratio) + 10)]
+
+    def test_pauses_are_reported(self):
+        self.controller = GCController(self.metrics, thresholds=(500, 10, 10))
+        self.controller.install()
+        gc.collect(0)
+
+        self.assertEqual(gc.get_threshold(), (500, 10, 10))
+        self.assertEqual(self.metrics.histogram("gc.gen0").count, 1)
+        self.assertEqual(self.metrics.to_json()["gc"]["collections"][0], 1)
+
+    def test_manual_collection_with_time_left(self):
+        self.controller = GCController(self.metrics, manual=True)
+        self.controller.install()
+        self.controller.spare_time = lambda: 1
+        self.assertFalse(gc.isenabled())
+
+        objects = self.fill_young_generation()
+        self.controller.end_of_tick()
+
+        self.assertEqual(self.controller.collections[0], 1)
+        self.assertLess(gc.get_count()[0], len(objects))
+
+    def test_manual_collection_is_deferred_without_time_left(self):
+        self.controller = GCController(self.metrics, manual=True)
+        self.controller.install()
+        self.controller.spare_time = lambda: 0
+
+        objects = self.fill_young_generation()
+        self.controller.end_of_tick()
+
+        self.assertEqual(self.controller.deferred, 1)
+        self.assertEqual(self.controller.collections, [0, 0, 0])
+
+        objects.extend(self.fill_young_generation(ratio=10))
+        self.controller.end_of_tick()
+        self.assertEqual(self.controller.forced, 1)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from phagocyte_game_server.headless import VirtualClock, simulate
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestHeadless(unittest.TestCase):
+
+    parameters = dict(
+        map_height=2000, map_width=2000, max_speed=400, max_hit_count=10, eat_ratio=1.2, min_radius=20,
+        food_production_rate=50, win_size=1500
+    )
+
+    def run_simulation(self, seed):
+        report = simulate(players=5, duration=30, seed=seed, **self.parameters)
+        for key in ["elapsed", "speedup", "tick_mean"]:
+            del report[key]
+        return report
+
+    def test_clock_only_moves_when_advanced(self):
+        clock = VirtualClock(10)
+        self.assertEqual(clock(), 10)
+
+        clock.advance(0.5)
+        self.assertEqual(clock(), 10.5)
+
+    def test_simulation_runs_for_the_simulated_duration(self):
+        report = self.run_simulation(1)
+
+        self.assertIsNone(report["winner"])
+        self.assertAlmostEqual(report["simulated"], 30, delta=1 / 30)
+        self.assertEqual(report["ticks"], 30 * 30)
+
+    def test_simulation_is_reproducible(self):
+        self.assertEqual(self.run_simulation(3), self.run_simulation(3))
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from phagocyte_game_server.latency import LatencyEstimator
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestLatency(unittest.TestCase):
+
+    def test_round_trip_and_jitter(self):
+        latency = LatencyEstimator()
+        for index, rtt in enumerate([0.1, 0.1, 0.1, 0.1]):
+            latency.on_pong(index, 1000 + index + rtt / 2, index + rtt)
+
+        self.assertAlmostEqual(latency.rtt, 0.1)
+        self.assertAlmostEqual(latency.jitter, 0)
+
+    def test_one_way_latency_is_relative_to_best_exchange(self):
+        latency = LatencyEstimator()
+        # client clock is 1000 seconds ahead, the first exchange is symmetric
+        latency.on_pong(0, 1000.05, 0.1)
+        # the second exchange takes 100ms more on the way back
+        latency.on_pong(1, 1001.05, 1.2)
+
+        self.assertAlmostEqual(latency.offset, 1000)
+        self.assertGreater(latency.upstream, latency.downstream)
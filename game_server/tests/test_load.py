@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import unittest
+
+from phagocyte_game_server.load import LoadReporter
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class FakeProtocol:
+    def __init__(self):
+        self.players = {("127.0.0.1", 1): None, ("127.0.0.1", 2): None}
+        self.max_capacity = 10
+        self.busy = 0
+        self.overruns = 0
+
+
+class TestLoadReporter(unittest.TestCase):
+
+    def test_report_resets_counters(self):
+        protocol = FakeProtocol()
+        output = io.StringIO()
+        reporter = LoadReporter(protocol, output)
+
+        protocol.busy = 0.001
+        protocol.overruns = 2
+        reporter.report()
+
+        load = json.loads(output.getvalue())["load"]
+        self.assertEqual(load["players"], 2)
+        self.assertEqual(load["capacity"], 10)
+        self.assertEqual(load["overruns"], 2)
+        self.assertGreater(load["busy"], 0)
+        self.assertEqual(protocol.busy, 0)
+        self.assertEqual(protocol.overruns, 0)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import tracemalloc
+import unittest
+
+from phagocyte_game_server.memory import MemoryTracker, resident_memory
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestMemoryTracker(unittest.TestCase):
+
+    def tearDown(self):
+        tracemalloc.stop()
+
+    def test_resident_memory(self):
+        self.assertGreater(resident_memory(), 0)
+
+    def test_without_tracing(self):
+        report = MemoryTracker().to_json()
+
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(set(report.keys()), {"rss", "gc_objects"})
+
+    def test_tracing_reports_top_lines_and_growth(self):
+        tracker = MemoryTracker(top=3)
+        first = tracker.to_json()
+        kept = [bytearray(1024) for _ in range(1000)]
+        second = tracker.to_json()
+
+        self.assertNotIn("growth", first)
+        self.assertEqual(len(second["top"]), 3)
+        self.assertIn("test_memory.py", second["growth"][0]["line"])
+        self.assertGreater(second["growth"][0]["growth"], 1000 * 1024)
+        del kept
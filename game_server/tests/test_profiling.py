@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+from twisted.internet import reactor
+
+from phagocyte_game_server.profiling import CPROFILE, SAMPLE, Profiler
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+def handle_work():
+    end = time.process_time() + 0.2
+    while time.process_time() < end:
+        pass
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(self.directory.name, "test", logging.getLogger("test"), interval=0.001)
+
+    def tearDown(self):
+        for call in reactor.getDelayedCalls():
+            call.cancel()
+        self.directory.cleanup()
+
+    def test_sampling(self):
+        self.assertTrue(self.profiler.start(SAMPLE))
+        self.assertFalse(self.profiler.start(SAMPLE))
+        handle_work()
+        path = self.profiler.stop()
+
+        self.assertFalse(self.profiler.running)
+        self.assertTrue(path.endswith(".folded"))
+        with open(path) as profile_file:
+            lines = profile_file.read().splitlines()
+
+        self.assertTrue(any("handle_work (test_profiling.py" in line for line in lines))
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        self.assertGreater(self.profiler.handlers_summary()["handle_work"], 0.5)
+
+    def test_cprofile(self):
+        self.profiler.start(CPROFILE)
+        handle_work()
+        path = self.profiler.stop()
+
+        self.assertTrue(path.endswith(".prof"))
+        self.assertTrue(os.path.getsize(path) > 0)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import json
+import unittest
+
+from twisted.internet import reactor
+
+from phagocyte_game_benchmarks import create_protocol
+from phagocyte_game_server import RESYNC_DATAGRAM_SIZE
+from phagocyte_game_server.gc_control import GCController
+from phagocyte_game_server.world import TICK_INTERVAL
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class RecordingTransport:
+
+    def __init__(self):
+        self.datagrams = []
+
+    def write(self, datagram, addr=None):
+        self.datagrams.append(bytes(datagram))
+
+    def writeSequence(self, seq, addr=None):
+        self.datagrams.append(b"".join(seq))
+
+
+class TestProtocol(unittest.TestCase):
+
+    def tearDown(self):
+        for call in reactor.getDelayedCalls():
+            call.cancel()
+
+    def test_reset_clears_the_game(self):
+        protocol = create_protocol(10)
+        protocol.closed = True
+
+        protocol.reset(20, "next", map_height=1000, map_width=2000, max_speed=400, max_hit_count=10, eat_ratio=1.2,
+                       min_radius=50, food_production_rate=5, win_size=500)
+
+        self.assertEqual(len(protocol.players), 0)
+        self.assertEqual(len(protocol.world.food), 0)
+        self.assertEqual(len(protocol.world.bullets), 0)
+        self.assertEqual(len(protocol.world.bonuses), 0)
+        self.assertEqual(protocol.world.max_x, 2000)
+        self.assertEqual(protocol.max_capacity, 20)
+        self.assertEqual(protocol.token, "next")
+        self.assertFalse(protocol.closed)
+
+    def test_resync_datagrams_fit_in_mtu(self):
+        protocol = create_protocol(50)
+        protocol.transport = RecordingTransport()
+
+        protocol.resync_requests.add(next(iter(protocol.players)))
+        protocol.send_resyncs()
+
+        self.assertTrue(all(len(datagram) <= RESYNC_DATAGRAM_SIZE for datagram in protocol.transport.datagrams))
+        messages = [json.loads(datagram.decode("utf8")) for datagram in protocol.transport.datagrams]
+        self.assertEqual(sum(len(message["food"]) for message in messages if message["kind"] == "food"),
+                         len(protocol.world.food))
+        self.assertEqual(sum(len(message["bonus"]) for message in messages if message["kind"] == "bonus"),
+                         len(protocol.world.bonuses))
+
+    def test_resync_datagrams_are_encoded_once(self):
+        protocol = create_protocol(10)
+        protocol.resync_requests.add(next(iter(protocol.players)))
+        protocol.send_resyncs()
+        datagrams = protocol.resync_datagrams
+
+        protocol.resync_requests.update(protocol.players)
+        protocol.send_resyncs()
+
+        self.assertIs(protocol.resync_datagrams, datagrams)
+
+    def test_tick_interval_is_followed_and_reset(self):
+        protocol = create_protocol(10)
+        protocol.gc_controller = GCController(protocol.metrics)
+
+        protocol.set_tick_interval(1 / 20)
+        self.assertEqual(protocol.world.tick_interval, 1 / 20)
+        self.assertEqual(protocol.gc_controller.interval, 1 / 20)
+        self.assertEqual({loop.interval for loop in protocol.tick_loops}, {1 / 20})
+
+        protocol.reset(20, "next", map_height=1000, map_width=2000, max_speed=400, max_hit_count=10, eat_ratio=1.2,
+                       min_radius=50, food_production_rate=5, win_size=500)
+        self.assertEqual(protocol.tick_interval, TICK_INTERVAL)
+        self.assertEqual(protocol.world.tick_interval, TICK_INTERVAL)
+        self.assertEqual(protocol.gc_controller.interval, TICK_INTERVAL)
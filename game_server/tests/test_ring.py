@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import pickle
+import unittest
+
+from twisted.internet import reactor
+from twisted.internet.error import ConnectionDone
+
+from phagocyte_game_server.ring import LENGTH, RingBuffer, RingReader, RingWriter
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+def size(message):
+    return LENGTH.size + len(pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = RingBuffer.create(128)
+        # the consumer lives in another process, it only shares the memory of the ring with the producer
+        self.reader = RingBuffer.attach(self.ring.name)
+
+    def tearDown(self):
+        self.reader.close()
+        self.ring.close(unlink=True)
+
+    def test_messages_round_trip(self):
+        messages = [("raw", b"\x00\xff datagram", ("10.0.0.1", 1000)), ("data", {"event": 3, "x": 1.5}, None)]
+
+        for message in messages:
+            self.assertTrue(self.ring.put(message))
+
+        self.assertEqual(list(self.reader.drain()), messages)
+        self.assertEqual(list(self.reader.drain()), [])
+
+    def test_messages_wrap_around(self):
+        # messages of odd sizes end up cut at every offset of the ring, length prefixes included
+        for index in range(100):
+            message = ("raw", b"x" * (index % 23), index)
+            self.assertTrue(self.ring.put(message))
+            self.assertEqual(list(self.reader.drain()), [message])
+
+        self.assertEqual(self.ring.dropped, 0)
+
+    def test_full_ring_drops_messages(self):
+        message = ("raw", b"x" * 20, None)
+        count = self.ring.capacity // size(message)
+
+        for _ in range(count):
+            self.assertTrue(self.ring.put(message))
+        self.assertFalse(self.ring.put(message))
+        self.assertEqual(self.ring.dropped, 1)
+
+        self.assertEqual(len(list(self.reader.drain())), count)
+        self.assertTrue(self.ring.put(message))
+
+    def test_partially_drained_ring(self):
+        first, second, third = ("raw", b"a" * 30, 1), ("raw", b"b" * 30, 2), ("raw", b"c" * 30, 3)
+        self.ring.put(first)
+        self.ring.put(second)
+
+        messages = self.reader.drain()
+        self.assertEqual(next(messages), first)
+
+        # the space of the message read is already available, messages added meanwhile wait for the next drain
+        self.assertTrue(self.ring.put(third))
+        self.assertEqual(list(messages), [second])
+        self.assertEqual(list(self.reader.drain()), [third])
+
+
+class TestRingDoorbell(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = RingBuffer.create(1024)
+        self.bell_reader, self.bell_writer = multiprocessing.Pipe(duplex=False)
+        self.messages = []
+        self.closed = False
+
+        self.writer = RingWriter(self.ring, self.bell_writer)
+        self.reader = RingReader(RingBuffer.attach(self.ring.name), self.bell_reader, self.messages.append,
+                                 self.on_close)
+
+    def tearDown(self):
+        for call in reactor.getDelayedCalls():
+            call.cancel()
+        self.bell_reader.close()
+        self.bell_writer.close()
+        self.reader.ring.close()
+        self.ring.close(unlink=True)
+
+    def on_close(self):
+        self.closed = True
+
+    def test_doorbell_rings_once_per_iteration(self):
+        self.writer.put(("raw", b"first", None))
+        self.writer.put(("raw", b"second", None))
+
+        self.assertEqual(len(reactor.getDelayedCalls()), 1)
+        self.writer.notify()
+        self.reader.doRead()
+
+        self.assertEqual(self.messages, [("raw", b"first", None), ("raw", b"second", None)])
+
+    def test_closed_doorbell(self):
+        self.bell_writer.close()
+
+        self.assertIsInstance(self.reader.doRead(), ConnectionDone)
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from phagocyte_game_server.sockets import advertised_address
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestAdvertisedAddress(unittest.TestCase):
+
+    def test_explicit_address_first(self):
+        self.assertEqual(advertised_address("127.0.0.1", 8080, "10.0.0.2", "game.example.com"), "game.example.com")
+
+    def test_bound_interface(self):
+        self.assertEqual(advertised_address("127.0.0.1", 8080, "10.0.0.2"), "10.0.0.2")
+
+    def test_interface_routing_to_authentication_server(self):
+        self.assertEqual(advertised_address("127.0.0.1", 8080), "127.0.0.1")
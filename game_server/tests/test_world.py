@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+import collections
+import gc
+import random
+import time
+import unittest
+
+from phagocyte_game_server.events import Event
+from phagocyte_game_server.game_objects import Bonus, BonusTypes, Bullet, Food
+from phagocyte_game_server.world import DEATH_TTL, IDLE_RESEND, INPUT_STEP, RECONNECTION_DELAY, TICK_INTERVAL, \
+    Broadcast, Death, DuplicateNameError, Stats, Win, World, checksum
+
+
+__author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
+
+
+class TestWorld(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(42)
+        self.now = time.time()
+        self.world = World(
+            map_height=1000, map_width=1000, max_speed=100, max_hit_count=10, eat_ratio=1.2, min_radius=20,
+            food_production_rate=0, win_size=500, now=self.now
+        )
+
+    def join(self, port, name, uid=None):
+        self.world.join(("127.0.0.1", port), uid, name, "#ffffff", self.now)
+        return self.world.players[("127.0.0.1", port)]
+
+    def test_join_returns_game_info(self):
+        self.join(1, "first")
+        info = self.world.join(("127.0.0.1", 2), None, "second", "#000000", self.now)
+
+        self.assertEqual(info["event"], Event.GAME_INFO)
+        self.assertEqual([other["name"] for other in info["others"]], ["first"])
+        self.assertEqual(len(self.world.players), 2)
+
+    def test_join_with_name_in_use(self):
+        self.join(1, "first")
+
+        with self.assertRaises(DuplicateNameError):
+            self.join(2, "first")
+
+    def test_resume_moves_player_to_new_address(self):
+        info = self.world.join(("127.0.0.1", 1), None, "first", "#ffffff", self.now)
+        player = self.world.players[("127.0.0.1", 1)]
+        self.world.push_input(("127.0.0.1", 1), 1, 7)
+
+        old_addr, catch_up = self.world.resume(info["resume"], ("127.0.0.2", 1), self.now + 1)
+
+        self.assertEqual(old_addr, ("127.0.0.1", 1))
+        self.assertEqual(self.world.players, {("127.0.0.2", 1): player})
+        self.assertIn(("127.0.0.2", 1), self.world.inputs)
+        self.assertEqual(catch_up["event"], Event.RESUME)
+        self.assertEqual(catch_up["players"], ["first"])
+        self.assertEqual(player.timestamp, self.now + 1)
+
+    def test_resume_is_refused_once_player_left(self):
+        info = self.world.join(("127.0.0.1", 1), None, "first", "#ffffff", self.now)
+
+        self.assertIsNone(self.world.resume("invalid", ("127.0.0.1", 2), self.now))
+
+        self.world.leave(("127.0.0.1", 1))
+        self.assertIsNone(self.world.resume(info["resume"], ("127.0.0.1", 2), self.now))
+
+    def test_move_is_limited_by_speed(self):
+        player = self.join(1, "first")
+        player.x, player.y = 100, 100
+        player.timestamp = self.now
+
+        self.world.move(("127.0.0.1", 1), (900, 100))
+        events = self.world.step_players(self.now + 1)
+
+        self.assertAlmostEqual(player.x, 100 + player.max_speed)
+        self.assertEqual(len(events), 1)
+        self.assertIn("dirty", events[0].records[0])
+        self.assertFalse(events[0].droppable)
+
+    def test_inputs_are_applied_and_acknowledged(self):
+        player = self.join(1, "first")
+        player.x, player.y = 100, 100
+
+        # right, then up-right, then a duplicate that is ignored
+        for seq, direction in [(1, 7), (2, 8), (2, 0)]:
+            self.world.push_input(("127.0.0.1", 1), seq, direction)
+        events = self.world.step_players(self.now + 2 * INPUT_STEP)
+
+        step = player.max_speed * INPUT_STEP
+        self.assertAlmostEqual(player.x, 100 + 2 * step)
+        self.assertAlmostEqual(player.y, 100 + step)
+        self.assertEqual(events[0].records[0]["ack"], 2)
+        self.assertNotIn("dirty", events[0].records[0])
+
+    def test_inputs_cannot_be_applied_faster_than_time(self):
+        player = self.join(1, "first")
+        player.x, player.y = 100, 100
+
+        for seq in range(1, 11):
+            self.world.push_input(("127.0.0.1", 1), seq, 7)
+        events = self.world.step_players(self.now + INPUT_STEP)
+
+        self.assertAlmostEqual(player.x, 100 + player.max_speed * INPUT_STEP)
+        self.assertEqual(events[0].records[0]["ack"], 1)
+
+    def test_idle_players_are_sent_again_from_time_to_time(self):
+        player = self.join(1, "first")
+        player.x, player.y = 100, 100
+        self.world.push_input(("127.0.0.1", 1), 1, 7)
+
+        def sent(now):
+            return [record for event in self.world.step_players(now) for record in event.records]
+
+        # the player moves, then is sent once more where it stopped, and only again after a while
+        self.assertEqual(len(sent(self.now + INPUT_STEP)), 1)
+        self.assertEqual(sent(self.now + 2 * INPUT_STEP)[0]["x"], int(player.x))
+        self.assertEqual(sent(self.now + 3 * INPUT_STEP), [])
+        self.assertEqual(len(sent(self.now + 2 * INPUT_STEP + IDLE_RESEND)), 1)
+
+    def test_positions_are_ignored_from_players_sending_inputs(self):
+        player = self.join(1, "first")
+        player.x, player.y = 100, 100
+
+        self.world.push_input(("127.0.0.1", 1), 1, 7)
+        self.world.move(("127.0.0.1", 1), (900, 900))
+        self.world.step_players(self.now + INPUT_STEP)
+
+        self.assertAlmostEqual(player.x, 100 + player.max_speed * INPUT_STEP)
+        self.assertEqual(player.y, 100)
+
+    def test_move_is_delayed_when_no_time_elapsed(self):
+        player = self.join(1, "first")
+        player.x, player.y = 100, 100
+
+        self.world.move(("127.0.0.1", 1), (110, 100))
+        self.world.step_players(self.now)
+        self.assertEqual(player.x, 100)
+
+        self.world.step_players(self.now + 1)
+        self.assertEqual(player.x, 110)
+
+    def test_takeover_forgets_inputs_of_previous_address(self):
+        player = self.join(1, "first")
+        self.world.push_input(("127.0.0.1", 1), 1, 7)
+        self.world.move(("127.0.0.1", 1), (100, 100))
+        self.world.shoot(("127.0.0.1", 1), 0)
+        self.now += RECONNECTION_DELAY
+
+        self.assertIs(self.join(2, "first"), player)
+        self.world.step_new_bullets(self.now)
+        self.world.step_players(self.now)
+
+        self.assertEqual(list(self.world.players), [("127.0.0.1", 2)])
+        for inputs in [self.world.moves, self.world.inputs, self.world.new_bullets]:
+            self.assertNotIn(("127.0.0.1", 1), inputs)
+
+    def test_rejoin_with_inputs_queued(self):
+        player = self.join(1, "first", uid=1)
+        player.x, player.y = 100, 100
+        self.world.push_input(("127.0.0.1", 1), 5, 7)
+        self.now += RECONNECTION_DELAY
+
+        self.assertIs(self.join(2, "first", uid=1), player)
+        self.world.push_input(("127.0.0.1", 2), 1, 1)
+        self.world.step(self.now)
+
+        # only the input sent from the new address is applied, the new client numbers its inputs from 1
+        self.assertAlmostEqual(player.x, 100 - player.max_speed * INPUT_STEP)
+        self.assertEqual(player.input_seq, 1)
+        self.assertEqual(list(self.world.inputs), [("127.0.0.1", 2)])
+
+    def test_bigger_player_eats_smaller_one(self):
+        eater = self.join(1, "eater", uid=1)
+        eaten = self.join(2, "eaten", uid=2)
+        eater.update_radius(100)
+        eater.x = eater.y = eaten.x = eaten.y = 500
+
+        events = self.world.step_players(self.now)
+
+        self.assertEqual(events[0], Stats(2, events[0].stats))
+        self.assertTrue(events[0].stats["death"])
+        self.assertEqual(events[1], Death(("127.0.0.1", 2)))
+        self.assertEqual(events[2].header["deaths"], ["eaten"])
+        self.assertEqual(list(self.world.players.values()), [eater])
+        self.assertIn(("127.0.0.1", 2), self.world.deaths)
+
+    def test_win(self):
+        winner = self.join(1, "winner", uid=1)
+        self.join(2, "other", uid=2)
+
+        events = self.world.win(winner, self.now)
+
+        self.assertTrue(self.world.finished)
+        self.assertEqual(events[0], Win("winner"))
+        self.assertEqual({event.uid: event.stats["won"] for event in events[1:]}, {1: True, 2: False})
+
+    def test_bonus_expires(self):
+        player = self.join(1, "first")
+        player.bonus = BonusTypes.SHIELD
+        player.bonus_expiry = self.now + 10
+
+        self.world.step_bonuses(self.now + 5)
+        self.assertEqual(player.bonus, BonusTypes.SHIELD)
+
+        self.world.step_bonuses(self.now + 10)
+        self.assertIsNone(player.bonus)
+
+    def test_disconnected_players_are_removed(self):
+        self.join(1, "first")
+
+        events = self.world.step_disconnects(self.now + 61)
+
+        self.assertEqual(self.world.players, {})
+        self.assertEqual(events, [Broadcast({"event": Event.ALIVE}, "alives", [], False)])
+
+    def test_food_is_only_sent_when_spawned_or_eaten(self):
+        player = self.join(1, "first")
+        player.x = player.y = 100
+        food = Food(5, 900, 900)
+
+        self.world.add_food(food)
+        events = self.world.step_food(self.now)
+        self.assertEqual(events, [Broadcast({"event": Event.FOOD, "deleted": []}, "food", [food.to_json()], False)])
+        self.assertEqual(self.world.food_checksum, checksum(food.uid))
+
+        self.assertEqual(self.world.step_food(self.now), [])
+
+        food.x = food.y = 100
+        events = self.world.step_food(self.now)
+        self.assertEqual(events, [Broadcast({"event": Event.FOOD, "deleted": [food.uid]}, "food", [], False)])
+        self.assertEqual(self.world.food_checksum, 0)
+
+    def test_food_production_follows_tick_interval(self):
+        self.world.food_production_rate = 50
+        self.world.tick_interval = 2 * TICK_INTERVAL
+
+        for _ in range(20):
+            self.world.step_food(self.now)
+
+        self.assertEqual(len(self.world.food), 20)
+
+    def test_bonuses_are_only_sent_when_taken(self):
+        player = self.join(1, "first")
+        player.x = player.y = 100
+        bonus = Bonus(1000, 1000)
+        bonus.x = bonus.y = 900
+        self.world.add_bonus(bonus)
+
+        self.assertEqual(self.world.step_bonuses(self.now), [])
+
+        bonus.x = bonus.y = 100
+        events = self.world.step_bonuses(self.now)
+        self.assertEqual(events[0].header["deleted"], [bonus.uid])
+        self.assertEqual(player.bonus, bonus.bonus)
+        self.assertEqual(self.world.bonuses_checksum, 0)
+
+    def test_sync_matches_snapshot(self):
+        for x in range(3):
+            self.world.add_food(Food(5, 100 * (x + 1), 100))
+        self.world.add_bonus(Bonus(1000, 1000))
+
+        sync = {record["field"]: record for record in self.world.step_sync()[0].records}
+        for field, records in self.world.snapshot().items():
+            expected = 0
+            for record in records:
+                expected ^= checksum(record["uid"])
+
+            self.assertEqual(sync[field]["count"], len(records))
+            self.assertEqual(sync[field]["checksum"], expected)
+
+    def test_cleanup_forgets_dead_and_inputs_of_absent_players(self):
+        self.join(1, "first")
+        self.world.deaths[("127.0.0.1", 2)] = self.now
+        self.world.moves[("127.0.0.1", 3)] = (10, 10)
+        self.world.new_bullets[("127.0.0.1", 3)] = 1
+        self.world.inputs[("127.0.0.1", 3)] = collections.deque()
+        self.world.moves[("127.0.0.1", 1)] = (10, 10)
+
+        self.world.cleanup(self.now + DEATH_TTL / 2)
+        self.assertIn(("127.0.0.1", 2), self.world.deaths)
+
+        self.world.cleanup(self.now + DEATH_TTL + 1)
+        self.assertEqual(self.world.sizes(), {
+            "players": 1, "moves": 1, "inputs": 0, "sessions": 1, "deaths": 0, "food": 0, "bullets": 0, "bonuses": 0,
+            "new_bullets": 0,
+        })
+
+    def test_bullets_are_only_sent_when_shot_and_removed(self):
+        shooter = self.join(1, "shooter")
+        shooter.x = shooter.y = 500
+        shooter.update_radius(shooter.radius * 2)
+        self.world.shoot(("127.0.0.1", 1), 0)
+
+        events = self.world.step_new_bullets(self.now)
+        bullet = self.world.bullets[0]
+        self.assertEqual(events, [
+            Broadcast({"event": Event.BULLETS, "deleted": [], "t": self.now}, "bullets", [bullet.to_json()], False)
+        ])
+
+        self.assertEqual(self.world.step_bullets(self.now + 0.1), [])
+        self.assertAlmostEqual(bullet.y, 500 + bullet.speed_y * 0.1, places=3)
+
+        events = self.world.step_bullets(self.now + 60)
+        self.assertEqual(events[0].header["deleted"], [bullet.uid])
+        self.assertEqual(len(self.world.bullets), 0)
+
+    def test_bullets_do_not_keep_their_shooter_alive(self):
+        shooter = self.join(1, "first")
+        self.world.bullets.append(Bullet(0, shooter, self.now))
+
+        self.world.leave(("127.0.0.1", 1))
+        del shooter
+        gc.collect()
+
+        self.assertIsNone(self.world.bullets[0].player())